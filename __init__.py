@@ -1 +1 @@
-from .vastai_sdk import VastAI
\ No newline at end of file
+from .vastai_sdk import VastAI, AsyncVastAI
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Time spent building the argparse tree and parsing a command line, per fresh interpreter.
+
+For each case this reports the median wall time of `import vast` (which registers every
+command) and of `vast.parser.parse_args(argv)`, plus the number of argparse subparsers that
+exist once parsing is done. A single command such as `show instances` should only build its
+own subparser; top-level help still builds all of them. Pass --compare REV to measure an
+older vast.py (e.g. HEAD~1) side by side. No network access is needed.
+
+    python3 benchmarks/bench_cli_parse.py [-n RUNS] [--compare REV]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {path!r})
+t0 = time.perf_counter()
+import vast
+t1 = time.perf_counter()
+try:
+    vast.parser.parse_args({argv!r})
+except SystemExit:
+    pass
+t2 = time.perf_counter()
+sp = getattr(vast.parser, "_subparsers", None) or vast.parser.subparsers_
+built = len(set(map(id, sp.choices.values())))
+print(json.dumps([t1 - t0, t2 - t1, built]))
+"""
+
+CASES = {
+    "show instances": ["show", "instances"],
+    "search offers": ["search", "offers", "gpu_name=RTX_4090", "-o", "dph"],
+    "--help": ["--help"],
+}
+
+
+def run_once(path, argv):
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"),
+                   XDG_CONFIG_HOME=os.path.join(home, ".config"))
+        p = subprocess.run([sys.executable, "-c", PROBE.format(path=path, argv=argv)], env=env, cwd=home,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(p.stdout.splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--runs", type=int, default=7)
+    ap.add_argument("--compare", metavar="REV", help="git revision of vast.py to compare against")
+    opts = ap.parse_args()
+
+    trees = [("working tree", REPO)]
+    tmp = None
+    if opts.compare:
+        tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(tmp.name, "vast.py"), "wb") as f:
+            f.write(subprocess.check_output(["git", "show", "{}:vast.py".format(opts.compare)], cwd=REPO))
+        trees.append((opts.compare, tmp.name))
+
+    print("{:<16} {:<16} {:>10} {:>10} {:>11}".format("vast.py", "case", "import ms", "parse ms", "subparsers"))
+    for label, path in trees:
+        for name, argv in CASES.items():
+            samples = [run_once(path, argv) for _ in range(opts.runs)]
+            print("{:<16} {:<16} {:>10.1f} {:>10.2f} {:>11}".format(
+                label, name, statistics.median(s[0] for s in samples) * 1000.0,
+                statistics.median(s[1] for s in samples) * 1000.0, samples[-1][2]))
+
+
+if __name__ == "__main__":
+    main()
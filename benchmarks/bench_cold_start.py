@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget for `vastai show instances --help`, measured with `python -X importtime`.
+
+Each run starts a fresh interpreter that imports vast and calls main() the way the `vastai`
+entry point does. The import time charged to the CLI is the sum of the top-level imports in
+the -X importtime report, minus those an empty interpreter already performs (site,
+encodings, ...). One warm-up run first creates the config directory and byte-code caches,
+so the numbers are for the steady state a script calling the CLI repeatedly sees.
+
+Exits with status 1 if the median import time exceeds --budget-ms, or if the help path
+imports a module that is supposed to be deferred until first use (requests, urllib3,
+argcomplete). Pass --compare REV to also measure an older vast.py (e.g. HEAD~1).
+
+    python3 benchmarks/bench_cold_start.py [-n RUNS] [--budget-ms MS] [--compare REV]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARGV = ["vastai", "show", "instances", "--help"]
+DEFERRED = ("requests", "urllib3", "argcomplete")
+
+CLI = "import sys; sys.path.insert(0, {path!r}); sys.argv = {argv!r}; import vast; vast.main()"
+
+
+def importtime(code, env):
+    """Runs code under -X importtime; returns ({top-level module: cumulative us}, all modules, wall seconds)."""
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, cwd=env["HOME"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    top, modules = {}, set()
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):  # one space of indentation: imported directly, not by another module
+            top[name.strip()] = top.get(name.strip(), 0) + int(cumulative)
+    return top, modules, elapsed
+
+
+def measure(path, runs, home):
+    env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"),
+               XDG_CONFIG_HOME=os.path.join(home, ".config"))
+    env.pop("VAST_API_KEY", None)
+    env.pop("_ARGCOMPLETE", None)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # the warm-up run should leave a .pyc behind, as pip installs do
+    baseline = set(importtime("pass", env)[0])
+    code = CLI.format(path=path, argv=ARGV)
+    importtime(code, env)  # warm-up
+    samples, walls, modules = [], [], set()
+    for _ in range(runs):
+        top, mods, elapsed = importtime(code, env)
+        samples.append(sum(us for name, us in top.items() if name not in baseline) / 1000.0)
+        walls.append(elapsed * 1000.0)
+        modules |= mods
+        heaviest = sorted(((us, name) for name, us in top.items() if name not in baseline), reverse=True)[:5]
+    return statistics.median(samples), statistics.median(walls), sorted(m for m in DEFERRED if m in modules), heaviest
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--runs", type=int, default=7)
+    ap.add_argument("--budget-ms", type=float, default=50.0, help="maximum median import time (default: %(default)s)")
+    ap.add_argument("--compare", metavar="REV", help="git revision of vast.py to compare against")
+    opts = ap.parse_args()
+
+    trees = [("working tree", REPO)]
+    tmp = tempfile.TemporaryDirectory()
+    if opts.compare:
+        os.mkdir(os.path.join(tmp.name, "old"))
+        with open(os.path.join(tmp.name, "old", "vast.py"), "wb") as f:
+            f.write(subprocess.check_output(["git", "show", "{}:vast.py".format(opts.compare)], cwd=REPO))
+        trees.append((opts.compare, os.path.join(tmp.name, "old")))
+
+    print("`{}`, median of {} runs".format(" ".join(ARGV), opts.runs))
+    ok = True
+    for label, path in trees:
+        with tempfile.TemporaryDirectory() as home:
+            import_ms, wall_ms, deferred, heaviest = measure(path, opts.runs, home)
+        print("\n{}: imports {:.1f} ms, wall {:.1f} ms".format(label, import_ms, wall_ms))
+        for us, name in heaviest:
+            print("    {:>8.1f} ms  {}".format(us / 1000.0, name))
+        if path != REPO:
+            continue
+        if import_ms > opts.budget_ms:
+            print("FAIL: import time {:.1f} ms exceeds the {:.1f} ms budget".format(import_ms, opts.budget_ms))
+            ok = False
+        if deferred:
+            print("FAIL: the help path imported {}".format(", ".join(deferred)))
+            ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Cost of polling an unchanged endpoint (`show instances` in a watch loop) with and without
+the conditional GET (ETag / If-None-Match) validator cache: time per poll including
+r.json(), and response body bytes transferred.
+
+    python3 benchmarks/bench_conditional_get.py [-n POLLS] [--instances N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast
+from standin_server import start_server, make_instances
+
+
+def poll(args, url, polls):
+    start = time.perf_counter()
+    for _ in range(polls):
+        r = vast.http_get(args, url)
+        r.raise_for_status()
+        r.json()
+    return (time.perf_counter() - start) / polls * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--polls", type=int, default=200)
+    ap.add_argument("--instances", type=int, default=500)
+    opts = ap.parse_args()
+
+    vast.configure_rate_limits({name: None for name in vast.RATE_LIMITS})  # measure the client, not the limiter
+    server, base_url = start_server({"/api/v0/instances": {"instances": make_instances(opts.instances)}}, etags=True)
+    handler = server.RequestHandlerClass
+    args = argparse.Namespace(api_key="bench", url=base_url, retry=3, explain=False, raw=True)
+    url = vast.apiurl(args, "/instances", {"owner": "me"})
+
+    print("{:<22} {:>10} {:>16}".format("validator cache", "ms/poll", "body bytes/poll"))
+    for name, size in (("off", 0), ("on", 64)):
+        vast.VALIDATOR_CACHE.max_entries = size
+        vast.VALIDATOR_CACHE.clear()
+        handler.bytes_sent = 0
+        ms = poll(args, url, opts.polls)
+        print("{:<22} {:>10.3f} {:>16.0f}".format(name, ms, handler.bytes_sent / opts.polls))
+    print("cache stats:", vast.VALIDATOR_CACHE.snapshot())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Throughput of sequential CLI invocations (`show instance ID --raw`, each a new process, the
+way vast_machine_tester.py and shell scripts call the CLI) with and without a `vastai serve`
+daemon, against the local stand-in API server.
+
+Each call runs `python vast.py ...` like `./vast.py`. Without the daemon every call loads the
+whole CLI and opens a new connection to the server; with it, the call stops after the top of
+vast.py and forwards argv over a Unix socket. The stand-in server speaks
+plain HTTP, so the TLS handshake a real call also saves is not part of these numbers. Rate
+limiting is turned off so the numbers measure the CLI, not the limiter.
+
+    python3 benchmarks/bench_daemon.py [-n CALLS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standin_server import start_server
+
+SCRIPT = os.path.join(REPO, "vast.py")
+
+
+def run_calls(calls, argv, env):
+    start = time.perf_counter()
+    for _ in range(calls):
+        subprocess.run([sys.executable, SCRIPT] + argv, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--calls", type=int, default=1000)
+    opts = ap.parse_args()
+
+    server, base_url = start_server()
+    argv = ["show", "instance", "1001", "--url", base_url, "--raw"]
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"),
+                   XDG_CONFIG_HOME=os.path.join(home, ".config"), VAST_API_KEY="bench", VAST_RATE_LIMITS="off",
+                   VAST_SERVE_SOCKET=os.path.join(home, "serve.sock"))
+        env.pop("PYTHONDONTWRITEBYTECODE", None)  # installed packages have their .pyc
+        run_calls(1, argv, env)  # warm-up: first-run setup and byte-code caches
+
+        results = [("no daemon", run_calls(opts.calls, argv, env))]
+
+        daemon = subprocess.Popen([sys.executable, SCRIPT, "serve"], env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            daemon.stdout.readline()  # "listening on ..."
+            run_calls(1, argv, env)
+            results.append(("vastai serve", run_calls(opts.calls, argv, env)))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    server.shutdown()
+
+    print("{} sequential `vastai {}` calls".format(opts.calls, " ".join(argv[:3] + argv[-1:])))
+    print("{:<14} {:>10} {:>10} {:>10}".format("mode", "total s", "ms/call", "calls/s"))
+    for name, seconds in results:
+        print("{:<14} {:>10.1f} {:>10.1f} {:>10.1f}".format(name, seconds, seconds / opts.calls * 1000.0,
+                                                           opts.calls / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Per-call latency of a bare requests.get() (a new connection per call, the old
+behaviour of the http_* helpers) against vast.http_get() going through the shared
+keep-alive pool, both sequentially and from 16 exec_with_threads-style workers.
+
+Runs against a local stand-in server, so it only measures TCP connection setup;
+against console.vast.ai every avoided connection also saves a TLS handshake.
+
+    python3 benchmarks/bench_http_session.py [-n CALLS]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import vast
+from standin_server import start_server
+
+
+def timed(fn, calls, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(calls):
+            fn()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: fn(), range(calls)))
+    return (time.perf_counter() - start) / calls * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--calls", type=int, default=500)
+    opts = ap.parse_args()
+
+    vast.configure_rate_limits({name: None for name in vast.RATE_LIMITS})  # measure the client, not the limiter
+    server, base_url = start_server()
+    args = argparse.Namespace(api_key="bench", url=base_url, retry=3, explain=False, raw=True)
+    url = vast.apiurl(args, "/instances", {"owner": "me"})
+
+    print("{:<28} {:>8} {:>14}".format("client", "threads", "ms/call"))
+    for threads in (1, 16):
+        bare = timed(lambda: requests.get(url).raise_for_status(), opts.calls, threads)
+        pooled = timed(lambda: vast.http_get(args, url).raise_for_status(), opts.calls, threads)
+        print("{:<28} {:>8} {:>14.3f}".format("requests.get (no pool)", threads, bare))
+        print("{:<28} {:>8} {:>14.3f}".format("vast.http_get (pooled)", threads, pooled))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Latency of `search offers --local` over a snapshot of N offers (default 100,000).
+
+Each run opens the snapshot, compiles the query with LocalOfferQuery, evaluates it (NumPy
+masks and lexsort when NumPy is installed, plain Python loops otherwise) and rebuilds the
+first 64 matching offers as dicts, which is what `search offers --local --limit 64 --raw`
+does apart from argument parsing and printing. No network access is needed.
+
+    python3 benchmarks/bench_local_search.py [-n OFFERS] [-r RUNS]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast
+from bench_offer_snapshot import GPUS
+from bench_search_offers import make_offers
+
+QUERIES = {
+    "default query, -o score-": [],
+    "gpu_name, reliability, -o dph": ["gpu_name=RTX_4090 reliability>0.99", "-o", "dph"],
+    "geolocation in, driver >=": ["geolocation in [SE,US,TW] driver_version>=545.0.0 num_gpus>=2"],
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--offers", type=int, default=100000)
+    ap.add_argument("-r", "--runs", type=int, default=9)
+    opts = ap.parse_args()
+
+    geos = ["Sweden, SE", "United States, US", "Taiwan, TW", "Vietnam, VN", "Germany, DE"]
+    drivers = ["535.86.05", "545.29.06", "550.54.14", "560.35.03"]
+    offers = [dict(o, gpu_name=GPUS[i % len(GPUS)], dph_total=0.1 + (i % 97) / 20.0, score=(i * 7919) % 1000 / 10.0,
+                   reliability=0.95 + (i % 50) / 1000.0, geolocation=geos[i % 5], driver_version=drivers[i % 4],
+                   num_gpus=1 << (i % 4), external=False)
+              for i, o in enumerate(make_offers(opts.offers))]
+    vast.add_global_arguments()
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "offers.snapshot")
+        vast.write_offer_snapshot(path, offers, {"type": "on-demand", "storage": 5.0})
+        del offers
+        engines = [("numpy", {})]
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            engines = []
+        engines.append(("python", {"numpy": None}))
+
+        print("{} offers, median of {} runs".format(opts.offers, opts.runs))
+        print("{:<32} {:<8} {:>8} {:>10}".format("query", "engine", "matches", "ms"))
+        for name, argv in QUERIES.items():
+            args = vast.parser.parse_args(["search", "offers", "--local", "--raw", "--limit", "64"] + argv)
+            query = {}
+            with patch.object(vast, "offer_snapshot_path", return_value=path), \
+                    patch.object(vast, "search_offers_local", side_effect=lambda a, q, s: query.update(q) or s.close()):
+                args.func(args)  # builds the query dict exactly as the command does
+            for engine, modules in engines:
+                samples = []
+                with patch.dict("sys.modules", modules):
+                    with vast.OfferSnapshot(path) as snapshot:
+                        matches = len(vast.LocalOfferQuery(snapshot, dict(query, limit=None)).indices())
+                    for _ in range(opts.runs):
+                        start = time.perf_counter()
+                        with vast.OfferSnapshot(path) as snapshot:
+                            snapshot.offers(vast.LocalOfferQuery(snapshot, query).indices())
+                        samples.append((time.perf_counter() - start) * 1000.0)
+                print("{:<32} {:<8} {:>8} {:>10.1f}".format(name, engine, matches, statistics.median(samples)))
+
+
+if __name__ == "__main__":
+    main()
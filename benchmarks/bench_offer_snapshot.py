@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cost of answering a search from a local offers snapshot (`vastai offers snapshot`) compared
+with decoding the search response JSON, for a market of N offers.
+
+"json" is what every search does today once the body has arrived: decode the whole response
+and test each offer. "snapshot" opens the columnar snapshot file, maps the two columns the
+query uses (gpu_name, dph_total) and tests those. Both find the same offers. No network
+access is needed; the snapshot is written to a temporary directory.
+
+    python3 benchmarks/bench_offer_snapshot.py [-n OFFERS] [-r RUNS]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast
+from bench_search_offers import make_offers
+
+GPUS = ["RTX 4090", "RTX 3090", "A100 SXM4", "H100 SXM", "RTX A6000", "L40S"]
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples), result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--offers", type=int, default=20000)
+    ap.add_argument("-r", "--runs", type=int, default=9)
+    opts = ap.parse_args()
+
+    offers = [dict(o, gpu_name=GPUS[i % len(GPUS)], dph_total=0.1 + (i % 97) / 20.0)
+              for i, o in enumerate(make_offers(opts.offers))]
+    body = json.dumps({"offers": offers}).encode()
+
+    def from_json():
+        return [o["id"] for o in json.loads(body)["offers"] if o["gpu_name"] == "RTX 4090" and o["dph_total"] < 0.5]
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "offers.snapshot")
+        vast.write_offer_snapshot(path, offers)
+
+        def from_snapshot():
+            with vast.OfferSnapshot(path) as snapshot:
+                code = snapshot.columns["gpu_name"]["dictionary"].index("RTX 4090")
+                ids, gpus, prices = snapshot.column("id"), snapshot.column("gpu_name"), snapshot.column("dph_total")
+                found = [ids[i] for i in range(snapshot.rows) if gpus[i] == code and prices[i] < 0.5]
+                del ids, gpus, prices
+                return found
+
+        json_ms, expected = median_ms(from_json, opts.runs)
+        snap_ms, found = median_ms(from_snapshot, opts.runs)
+        size = os.path.getsize(path)
+    assert found == expected
+
+    print("{} offers, {} matching 'gpu_name=RTX_4090 dph<0.5', median of {} runs".format(len(offers), len(found), opts.runs))
+    print("{:<10} {:>10} {:>10}".format("source", "KiB", "ms"))
+    print("{:<10} {:>10.0f} {:>10.1f}".format("json", len(body) / 1024.0, json_ms))
+    print("{:<10} {:>10.0f} {:>10.1f}".format("snapshot", size / 1024.0, snap_ms))
+
+
+if __name__ == "__main__":
+    main()
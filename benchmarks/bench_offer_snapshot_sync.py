@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Cost of refreshing an offers snapshot with a new download of the market: syncing it in place
+(sync_offer_snapshot, what `vastai offers snapshot` does when a snapshot exists) compared
+with rewriting the file (write_offer_snapshot, `--full`).
+
+Each run starts from a fresh snapshot of N offers and applies a pull in which --churn of the
+offers changed price, as many are gone and as many are new. The download itself, which both
+pay, is not timed. No network access is needed; files go to a temporary directory.
+
+    python3 benchmarks/bench_offer_snapshot_sync.py [-n OFFERS] [-r RUNS] [--churn FRACTION]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast
+from bench_offer_snapshot import GPUS
+from bench_search_offers import make_offers
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--offers", type=int, default=100000)
+    ap.add_argument("-r", "--runs", type=int, default=5)
+    ap.add_argument("--churn", type=float, default=0.01)
+    opts = ap.parse_args()
+
+    offers = [dict(o, gpu_name=GPUS[i % len(GPUS)], dph_total=0.1 + (i % 97) / 20.0)
+              for i, o in enumerate(make_offers(opts.offers))]
+    step = max(int(1 / opts.churn), 3)
+    fresh = [dict(o, dph_total=o["dph_total"] + 0.01) if i % step == 0 else o
+             for i, o in enumerate(offers) if i % step != 1]
+    fresh += [dict(o, id=o["id"] + len(offers)) for o in offers[2::step]]
+    meta = {"type": "on-demand", "storage": 5.0}
+
+    results = {"sync": [], "rewrite": []}
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "offers.snapshot")
+        for _ in range(opts.runs):
+            vast.write_offer_snapshot(path, offers, meta)
+            start = time.perf_counter()
+            stats = vast.sync_offer_snapshot(path, fresh, meta)
+            results["sync"].append((time.perf_counter() - start) * 1000.0)
+            start = time.perf_counter()
+            vast.write_offer_snapshot(path, fresh, meta)
+            results["rewrite"].append((time.perf_counter() - start) * 1000.0)
+        size = os.path.getsize(path)
+    assert stats is not None
+
+    print("{} offers ({:.0f} KiB snapshot): {added} new, {updated} changed, {removed} gone, median of {} runs".format(
+        len(offers), size / 1024.0, opts.runs, **stats))
+    print("{:<10} {:>10}".format("refresh", "ms"))
+    for name, samples in results.items():
+        print("{:<10} {:>10.1f}".format(name, statistics.median(samples)))
+
+
+if __name__ == "__main__":
+    main()
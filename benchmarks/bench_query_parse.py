@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Throughput of the search query parser (parse_query) and the -o order parser, in process.
+
+Cases:
+  repeated   the same offers query parsed over and over, as `vastai batch`, `create instances`
+             and SDK loops do; after the first call this is answered from the memo
+  distinct   a different query every call (a counter in the value), so the memo never hits
+  order      parse_order() of a typical -o value (inline loop on revisions that predate it)
+Each call merges into a fresh copy of the default search offers query, like search__offers
+does. Pass --compare REV to also load an older vast.py (e.g. HEAD~1) and time it the same way.
+No network access is needed.
+
+    python3 benchmarks/bench_query_parse.py [-n CALLS] [--compare REV]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERY = "reliability>0.99 num_gpus>=4 gpu_ram>=24 gpu_name in [RTX_4090,RTX_3090] geolocation notin [CN,VN] dph<2 rented=any"
+ORDER = "score-,dph,num_gpus-"
+DEFAULT = {"verified": {"eq": True}, "external": {"eq": False}, "rentable": {"eq": True}, "rented": {"eq": False}}
+
+
+def load(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def parse_order_inline(spec, alias):
+    order = []
+    for name in spec.split(","):
+        name = name.strip()
+        if not name: continue
+        direction, field = "asc", name
+        if name.strip("-") != name:
+            direction, field = "desc", name.strip("-")
+        if name.strip("+") != name:
+            direction, field = "asc", name.strip("+")
+        order.append([alias.get(field, field), direction])
+    return order
+
+
+def per_call_us(fn, calls, repeats=5):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(i)
+        samples.append((time.perf_counter() - start) / calls * 1e6)
+    return statistics.median(samples)
+
+
+def measure(vast, calls):
+    def parse(q):
+        return vast.parse_query(q, {k: dict(v) for k, v in DEFAULT.items()}, vast.offers_fields, vast.offers_alias,
+                                vast.offers_mult)
+    parse_order = getattr(vast, "parse_order", parse_order_inline)
+    return {
+        "repeated": per_call_us(lambda i: parse(QUERY), calls),
+        "distinct": per_call_us(lambda i: parse(QUERY + " disk_space>{}".format(i)), calls),
+        "order": per_call_us(lambda i: parse_order(ORDER, vast.offers_alias), calls),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--calls", type=int, default=20000)
+    ap.add_argument("--compare", metavar="REV", help="git revision of vast.py to compare against")
+    opts = ap.parse_args()
+
+    trees = [("working tree", os.path.join(REPO, "vast.py"))]
+    tmp = tempfile.TemporaryDirectory()
+    if opts.compare:
+        old = os.path.join(tmp.name, "vast.py")
+        with open(old, "wb") as f:
+            f.write(subprocess.check_output(["git", "show", "{}:vast.py".format(opts.compare)], cwd=REPO))
+        trees.append((opts.compare, old))
+
+    print("{} calls per case, median us per call".format(opts.calls))
+    print("{:<16} {:>10} {:>10} {:>10}".format("vast.py", "repeated", "distinct", "order"))
+    for i, (label, path) in enumerate(trees):
+        results = measure(load(path, "vast_bench_{}".format(i)), opts.calls)
+        print("{:<16} {:>10.1f} {:>10.1f} {:>10.2f}".format(label, results["repeated"], results["distinct"], results["order"]))
+
+
+if __name__ == "__main__":
+    main()
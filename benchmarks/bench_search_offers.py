@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Peak memory and time to first offer of `search offers` on a large result set, decoding the
+response the old way (r.json()["offers"], then filtering) against the streaming decoder used
+now (iter_offers over a stream=True response).
+
+The stand-in server gzips the body as console.vast.ai does, so both paths also exercise
+transfer compression. Peak memory is measured with tracemalloc and covers the response body
+plus the decoded offers.
+
+    python3 benchmarks/bench_search_offers.py [-n OFFERS]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast
+from standin_server import start_server
+
+
+def make_offers(n):
+    offer = {"ask_contract_id": 0, "bundle_id": 0, "compute_cap": 890, "cpu_cores": 32, "cpu_name": "AMD EPYC 7543",
+             "cpu_ram": 257000, "cuda_max_good": 12.4, "direct_port_count": 100, "disk_space": 1500.0,
+             "dlperf": 88.5, "dph_total": 0.412, "driver_version": "550.54.14", "geolocation": "Sweden, SE",
+             "gpu_name": "RTX 4090", "gpu_ram": 24564, "inet_down": 940.0, "inet_up": 880.0, "machine_id": 0,
+             "num_gpus": 1, "reliability2": 0.994, "rentable": True, "rented": False, "verified": True}
+    return [dict(offer, id=i, ask_contract_id=i, machine_id=i // 4, rented=(i % 5 == 0)) for i in range(n)]
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first, count = fn(start)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, total, peak, count
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--offers", type=int, default=20000)
+    opts = ap.parse_args()
+
+    body = json.dumps({"offers": make_offers(opts.offers)}).encode()
+    vast.configure_rate_limits({name: None for name in vast.RATE_LIMITS})  # measure the client, not the limiter
+    server, base_url = start_server({"/api/v0/bundles/": body}, gzip_min_size=1024)
+    args = argparse.Namespace(api_key="bench", url=base_url, retry=3, explain=False, raw=True)
+    url = vast.apiurl(args, "/bundles/")
+    query = {"rented": {"eq": False}}
+    headers = {"Accept-Encoding": vast.HTTP_ACCEPT_ENCODING}
+
+    def buffered(start):
+        r = vast.http_post(args, url, headers=headers, json=query)
+        rows = [row for row in r.json()["offers"] if vast.offer_passes_rented_filter(row, "eq", False)]
+        return time.perf_counter() - start, len(rows)
+
+    def streamed(start):
+        r = vast.http_post(args, url, headers=headers, json=query, stream=True)
+        first, count = None, 0
+        for row in vast.iter_offers(r, query):
+            if first is None:
+                first = time.perf_counter() - start
+            count += 1
+        return first, count
+
+    print("{} offers, {:.1f} MB of JSON".format(opts.offers, len(body) / 1e6))
+    print("{:<24} {:>14} {:>10} {:>14} {:>8}".format("decoder", "first offer", "total", "peak memory", "kept"))
+    for name, fn in (("r.json() then filter", buffered), ("iter_offers (stream)", streamed)):
+        fn(time.perf_counter())  # warm up the connection
+        first, total, peak, count = measure(fn)
+        print("{:<24} {:>12.1f}ms {:>8.1f}ms {:>12.1f}MB {:>8}".format(name, first * 1000, total * 1000, peak / 1e6, count))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
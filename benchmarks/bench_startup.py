@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Cold-start cost of `import vast` and `vast.py --help`: wall time (median of several fresh
+interpreters) and the number of network operations (DNS lookups and socket connects, counted
+with an audit hook) each performs.
+
+Every run gets an empty HOME / XDG cache directory, so nothing is served from the response
+cache. `import vast` must perform zero network operations; the script exits with status 1
+if it does. Pass --compare REV to measure an older vast.py (e.g. HEAD~1) side by side.
+
+    python3 benchmarks/bench_startup.py [-n RUNS] [--compare REV]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys
+net = []
+def hook(event, args):
+    if event in ("socket.getaddrinfo", "socket.connect"):
+        net.append(event)
+sys.addaudithook(hook)
+sys.path.insert(0, {path!r})
+try:
+    {code}
+except SystemExit:
+    pass
+except BaseException as e:
+    sys.stderr.write("error: %r\\n" % (e,))
+    sys.stderr.write("NET %d\\n" % len(net))
+    sys.exit(3)
+sys.stderr.write("NET %d\\n" % len(net))
+"""
+
+CASES = {
+    "import vast": "import vast",
+    "vast.py --help": "sys.argv = ['vast.py', '--help']; import runpy; runpy.run_path({script!r}, run_name='__main__')",
+}
+
+
+def run_once(path, code):
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"),
+                   XDG_CONFIG_HOME=os.path.join(home, ".config"))
+        env.pop("VAST_API_KEY", None)
+        script = PROBE.format(path=path, code=code.format(script=os.path.join(path, "vast.py")))
+        start = time.perf_counter()
+        p = subprocess.run([sys.executable, "-c", script], env=env, cwd=home,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+    net = [int(line.split()[1]) for line in p.stderr.splitlines() if line.startswith("NET ")]
+    return elapsed, net[0] if net else None, p.returncode == 0
+
+
+def measure(path, runs):
+    results = {}
+    for name, code in CASES.items():
+        samples = [run_once(path, code) for _ in range(runs)]
+        results[name] = (statistics.median(s[0] for s in samples) * 1000.0, max(s[1] or 0 for s in samples),
+                         all(s[2] for s in samples))
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--runs", type=int, default=7)
+    ap.add_argument("--compare", metavar="REV", help="git revision of vast.py to compare against")
+    opts = ap.parse_args()
+
+    trees = [("working tree", REPO)]
+    tmp = None
+    if opts.compare:
+        tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(tmp.name, "vast.py"), "wb") as f:
+            f.write(subprocess.check_output(["git", "show", "{}:vast.py".format(opts.compare)], cwd=REPO))
+        trees.append((opts.compare, tmp.name))
+
+    print("{:<16} {:<16} {:>10} {:>8}  {}".format("vast.py", "case", "ms", "net ops", "status"))
+    ok = True
+    for label, path in trees:
+        for name, (ms, net, success) in measure(path, opts.runs).items():
+            print("{:<16} {:<16} {:>10.1f} {:>8}  {}".format(label, name, ms, net, "ok" if success else "failed"))
+            if path == REPO and name == "import vast" and net:
+                ok = False
+    if not ok:
+        print("FAIL: import vast performed network I/O")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
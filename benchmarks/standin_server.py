@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+A tiny local stand-in for the console.vast.ai REST API, used by the benchmarks in
+this directory. It speaks HTTP/1.1 with keep-alive and answers every request with a
+canned JSON body (gzip-compressed on request, like the real API), so the numbers
+measure client-side overhead (connection setup, retries, parsing) rather than real
+API latency.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_instances(n=20):
+    return [{"id": 1000 + i, "machine_id": 200 + i, "actual_status": "running", "label": None,
+             "start_date": 1700000000.0, "extra_env": [], "num_gpus": 1, "gpu_name": "RTX 4090"}
+            for i in range(n)]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    routes = {}
+    gzip_min_size = None  # gzip bodies at least this large when the client accepts it
+    etags = False         # send ETags and answer matching If-None-Match with 304
+    bytes_sent = 0
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split("?")[0]
+        body = self.routes.get(path)
+        if body is None:
+            if path.startswith("/api/v0/instances/") and path != "/api/v0/instances/":
+                body = {"instances": make_instances(1)[0], "success": True}
+            else:
+                body = {"instances": make_instances(), "success": True}
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest()) if self.etags else None
+        if etag and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        if self.gzip_min_size is not None and len(data) >= self.gzip_min_size \
+                and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, 5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        type(self).bytes_sent += len(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _reply
+
+    def log_message(self, *a):
+        pass
+
+
+def start_server(routes=None, gzip_min_size=None, etags=False):
+    """Starts the stand-in server on an ephemeral port. Returns (server, base_url).
+
+    routes maps a path to the JSON-able object (or pre-encoded bytes) served for it.
+    server.RequestHandlerClass.bytes_sent counts the body bytes sent so far."""
+    handler = type("Handler", (StandinHandler,), {"routes": dict(routes or {}), "gzip_min_size": gzip_min_size,
+                                                  "etags": etags})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
@@ -0,0 +1,356 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stderr
+from unittest.mock import MagicMock, patch
+
+import vast
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.cache = vast.DiskCache(self.dir.name, max_bytes=10000, ttls={"templates": 60, "gpu_names": 60})
+
+    def test_fetch_is_served_from_disk_until_the_ttl_expires(self):
+        fetch = MagicMock(return_value={"templates": [1, 2]})
+        self.assertEqual(self.cache.fetch("templates", "k", fetch), {"templates": [1, 2]})
+        self.assertEqual(self.cache.fetch("templates", "k", fetch), {"templates": [1, 2]})
+        self.assertEqual(fetch.call_count, 1)
+        self.cache.ttls["templates"] = 0
+        self.cache.fetch("templates", "k", fetch)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual((self.cache.stats["hits"], self.cache.stats["misses"]), (1, 2))
+
+    def test_entries_are_shared_between_instances(self):
+        """A second DiskCache on the same directory (i.e. another CLI invocation) sees the entry."""
+        self.cache.put("templates", "k", [1])
+        other = vast.DiskCache(self.dir.name, ttls={"templates": 60})
+        self.assertEqual(other.get("templates", "k"), (True, [1]))
+
+    def test_refresh_and_no_cache_modes(self):
+        self.cache.put("templates", "k", "old")
+        self.assertEqual(self.cache.fetch("templates", "k", lambda: "new", mode="off"), "new")
+        self.assertEqual(self.cache.get("templates", "k"), (True, "old"))
+        self.assertEqual(self.cache.fetch("templates", "k", lambda: "new", mode="refresh"), "new")
+        self.assertEqual(self.cache.get("templates", "k"), (True, "new"))
+
+    def test_writes_are_atomic_and_leave_no_temp_files(self):
+        self.cache.put("templates", "k", list(range(100)))
+        self.assertEqual([n for n in os.listdir(self.dir.name) if n.endswith(".tmp")], [])
+
+    def test_lru_eviction_keeps_the_directory_under_max_bytes(self):
+        for i in range(30):
+            self.cache.put("templates", "k{}".format(i), "x" * 1000)
+        self.assertLessEqual(sum(e["size"] for e in self.cache.entries()), 10000)
+        self.assertGreater(self.cache.stats["evictions"], 0)
+        self.assertEqual(self.cache.get("templates", "k29"), (True, "x" * 1000))
+        self.assertEqual(self.cache.get("templates", "k0"), (False, None))
+
+    def test_stores_under_max_bytes_do_not_read_entries(self):
+        self.cache.put("templates", "a", 1)
+        with patch.object(self.cache, "entries", side_effect=AssertionError("entries read")):
+            self.cache.put("templates", "b", 2)
+
+    def test_concurrent_misses_fetch_once(self):
+        calls = []
+        started = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            started.wait(0.2)
+            return "value"
+        threads = [threading.Thread(target=self.cache.fetch, args=("templates", "k", fetch)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        started.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_clear_by_namespace(self):
+        self.cache.put("templates", "a", 1)
+        self.cache.put("gpu_names", "b", 2)
+        self.assertEqual(self.cache.clear("templates"), 1)
+        self.assertEqual([e["namespace"] for e in self.cache.entries()], ["gpu_names"])
+
+    def test_cached_get_json_keys_by_credential(self):
+        args = argparse.Namespace(retry=3)
+        url = "https://console.vast.ai/api/v0/template/?api_key="
+        with patch.object(vast, "RESPONSE_CACHE", self.cache), \
+                patch.object(vast, "http_get", side_effect=lambda a, u, headers=None: MagicMock(json=lambda: u)):
+            self.assertEqual(vast.cached_get_json(args, "templates", url + "k1"), url + "k1")
+            self.assertEqual(vast.cached_get_json(args, "templates", url + "k2"), url + "k2")
+            self.assertEqual(vast.cached_get_json(args, "templates", url + "k1"), url + "k1")
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+    def test_cached_get_json_keys_by_the_api_key_it_sends(self):
+        """The default fetch sends args.api_key; a custom fetch (the GPU names) sends no key, so all accounts share it."""
+        url = "https://console.vast.ai/api/v0/template/"
+        with patch.object(vast, "RESPONSE_CACHE", self.cache), \
+                patch.object(vast, "http_get", side_effect=lambda a, u, headers=None: MagicMock(json=lambda: a.api_key)):
+            for key in ("k1", "k2"):
+                self.assertEqual(vast.cached_get_json(argparse.Namespace(api_key=key), "templates", url), key)
+            for key in ("k1", "k2", vast.api_key_guard):
+                self.assertEqual(vast.cached_get_json(argparse.Namespace(api_key=key), "gpu_names", url,
+                                                      fetch=lambda: "names"), "names")
+        self.assertEqual((self.cache.stats["hits"], self.cache.stats["misses"]), (2, 3))
+
+
+class TestCompletionIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        cache = vast.DiskCache(self.dir.name, ttls={"completion": 60})
+        for p in (patch.object(vast, "RESPONSE_CACHE", cache), patch.object(vast, "_start_completion_refresh")):
+            self.refresh = p.start()
+            self.addCleanup(p.stop)
+        self.args = argparse.Namespace(url="https://console.vast.ai", api_key="k1")
+
+    def test_show_instances_fills_the_index_and_completion_reads_it_from_disk(self):
+        body = {"instances": [{"id": 11, "machine_id": 7, "label": "train", "start_date": 0, "extra_env": []},
+                              {"id": 12, "machine_id": 8, "label": None, "start_date": 0, "extra_env": []}]}
+        args = argparse.Namespace(**vars(self.args), retry=3, raw=True, quiet=False, explain=False)
+        with patch.object(vast, "http_get", return_value=MagicMock(json=lambda: body)) as http_get:
+            vast.show__instances(args)
+            self.assertEqual(vast.complete_instance(parsed_args=self.args), ["11", "12"])
+            self.assertEqual(vast.complete_instance_label(parsed_args=self.args), ["train"])
+            self.assertEqual(http_get.call_count, 1)
+        self.refresh.assert_not_called()
+
+    def test_missing_or_stale_fields_are_refreshed_in_the_background(self):
+        vast.update_completion_index(self.args, ssh_key_ids=[5])
+        self.assertEqual(vast.complete_instance(parsed_args=self.args), [])
+        self.refresh.assert_called_once_with(unittest.mock.ANY, "instances")
+        vast.RESPONSE_CACHE.ttls["completion"] = 0
+        self.assertEqual(vast.complete_ssh_key_id(parsed_args=self.args), ["5"])
+        self.assertEqual(self.refresh.call_args[0][1], "ssh_keys")
+
+    def test_index_is_per_api_key(self):
+        vast.update_completion_index(self.args, instance_ids=[1])
+        other = argparse.Namespace(url=self.args.url, api_key="k2")
+        self.assertEqual(vast.complete_instance(parsed_args=other), [])
+
+    def test_gpu_names_complete_from_disk_and_refresh_in_the_background(self):
+        vast.RESPONSE_CACHE.ttls["gpu_names"] = 60
+        with patch.object(vast, "http_session") as http_session:
+            self.assertEqual(vast.complete_gpu_name(parsed_args=self.args), [])  # cold cache
+            self.assertEqual(self.refresh.call_args[0][1], "gpu_names")
+            self.refresh.reset_mock()
+            vast.RESPONSE_CACHE.put("gpu_names", vast._gpu_names_cache_key(), {"gpu_names": ["RTX 4090", "H100 SXM"]})
+            self.assertEqual(vast.complete_gpu_name(parsed_args=self.args), ["RTX_4090", "H100_SXM"])
+            self.refresh.assert_not_called()
+            vast.RESPONSE_CACHE.ttls["gpu_names"] = 0
+            self.assertEqual(vast.complete_gpu_name(parsed_args=self.args), ["RTX_4090", "H100_SXM"])  # stale
+            self.assertEqual(self.refresh.call_args[0][1], "gpu_names")
+        http_session.assert_not_called()
+
+    def test_background_refresh_stores_the_gpu_names_completion_reads(self):
+        body = {"gpu_names": ["RTX 4090"]}
+        with patch.object(vast, "http_session", return_value=MagicMock(get=lambda *a, **kw: MagicMock(json=lambda: body))):
+            vast.refresh_completion_index(self.args.url, "gpu_names")
+        vast.RESPONSE_CACHE.ttls["gpu_names"] = 60
+        self.assertEqual(vast.complete_gpu_name(parsed_args=self.args), ["RTX_4090"])
+
+
+class TestOfferSnapshot(unittest.TestCase):
+    OFFERS = [
+        {"id": 1, "gpu_name": "RTX 4090", "num_gpus": 1, "dph_total": 0.4, "verified": True, "geolocation": "SE"},
+        {"id": 2, "gpu_name": "A100", "num_gpus": None, "dph_total": 1.2, "verified": False, "geolocation": None},
+        {"id": 3, "gpu_name": "RTX 4090", "num_gpus": 8, "dph_total": None, "verified": None, "extra_env": [1]},
+    ]
+
+    def snapshot(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "offers.snapshot")
+            vast.write_offer_snapshot(path, iter(self.OFFERS), {"type": "bid"})
+            snapshot = vast.OfferSnapshot(path)
+            self.addCleanup(snapshot.close)
+            return snapshot  # the mapping outlives the unlinked file
+
+    def test_round_trip_with_nulls(self):
+        snapshot = self.snapshot()
+        self.assertEqual((snapshot.rows, snapshot.header["type"]), (3, "bid"))
+        columns = ["id", "gpu_name", "num_gpus", "dph_total", "verified", "geolocation"]
+        self.assertEqual(snapshot.offers(names=columns), [{k: o.get(k) for k in columns} for o in self.OFFERS])
+        self.assertNotIn("extra_env", snapshot.columns)
+        self.assertEqual(snapshot.values("cpu_arch"), [None, None, None])
+
+    def test_columns_are_typed_arrays_and_strings_dictionary_encoded(self):
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot.columns["gpu_name"]["dictionary"], ["A100", "RTX 4090"])
+        self.assertEqual(snapshot.column("gpu_name").tolist(), [1, 0, 1])
+        self.assertEqual(snapshot.column("num_gpus").tolist(), [1, vast.OFFER_SNAPSHOT_NULL_INT, 8])
+        self.assertEqual(snapshot.column("verified").tolist(), [1, 0, -1])
+        self.assertEqual({name: info["offset"] % 8 for name, info in snapshot.columns.items()},
+                         dict.fromkeys(snapshot.columns, 0))
+
+
+class TestOfferSnapshotSync(unittest.TestCase):
+    OFFERS = [
+        {"id": 1, "gpu_name": "RTX 4090", "dph_total": 0.4, "verified": True},
+        {"id": 2, "gpu_name": "A100", "dph_total": 1.2, "verified": False},
+        {"id": 3, "gpu_name": "RTX 4090", "dph_total": None, "verified": None},
+        {"id": 4, "gpu_name": "RTX 3090", "dph_total": 0.2, "verified": True},
+    ]
+    FRESH = [
+        {"id": 4, "gpu_name": "RTX 3090", "dph_total": 0.2, "verified": True},
+        {"id": 1, "gpu_name": "RTX 4090", "dph_total": 0.35, "verified": True},
+        {"id": 3, "gpu_name": "RTX 4090", "dph_total": None, "verified": None},
+        {"id": 5, "gpu_name": "H100", "dph_total": 2.5, "verified": True},
+    ]
+
+    def setUp(self):
+        vast.add_global_arguments()
+        d = tempfile.TemporaryDirectory()
+        self.addCleanup(d.cleanup)
+        self.path = os.path.join(d.name, "offers.snapshot")
+        vast.write_offer_snapshot(self.path, self.OFFERS, {"type": "on-demand", "storage": 5.0})
+
+    def open(self):
+        snapshot = vast.OfferSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def check_sync(self):
+        inode = os.stat(self.path).st_ino
+        stats = vast.sync_offer_snapshot(self.path, self.FRESH, {"type": "on-demand", "storage": 5.0})
+        self.assertEqual(stats, {"added": 1, "updated": 1, "removed": 1, "unchanged": 2})
+        self.assertEqual(os.stat(self.path).st_ino, inode)  # updated in place
+        snapshot = self.open()
+        self.assertEqual((snapshot.rows, snapshot.deleted), (5, 1))
+        self.assertEqual(sorted(snapshot.offers(), key=lambda o: o["id"]), sorted(self.FRESH, key=lambda o: o["id"]))
+        self.assertEqual(snapshot.columns["gpu_name"]["dictionary"], ["A100", "RTX 3090", "RTX 4090", "H100"])
+        args = vast.parser.parse_args(["search", "offers", "--local", "--raw", "-n", "-o", "gpu_name-,dph"])
+        with patch.object(vast, "offer_snapshot_path", return_value=self.path):
+            self.assertEqual([o["id"] for o in args.func(args)], [1, 3, 4, 5])
+
+    def test_sync_updates_appends_and_tombstones_in_place(self):
+        self.check_sync()
+
+    def test_sync_without_numpy(self):
+        with patch.dict("sys.modules", {"numpy": None}):
+            self.check_sync()
+
+    def test_sync_declines_what_needs_a_rewrite(self):
+        with open(self.path, "rb") as f:
+            before = f.read()
+        meta = {"type": "on-demand", "storage": 5.0}
+        self.assertIsNone(vast.sync_offer_snapshot(self.path, self.FRESH, dict(meta, storage=20.0)))
+        self.assertIsNone(vast.sync_offer_snapshot(self.path, [dict(o, cpu_arch="amd64") for o in self.FRESH], meta))
+        self.assertIsNone(vast.sync_offer_snapshot(self.path, [dict(o, verified="yes") for o in self.FRESH], meta))
+        self.assertIsNone(vast.sync_offer_snapshot(self.path, self.FRESH[:1], meta))  # too many tombstones
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), before)
+
+    def test_interrupted_sync_is_rejected_and_rewritten(self):
+        import mmap
+        meta = {"type": "on-demand", "storage": 5.0}
+
+        class CrashingMap(mmap.mmap):
+            """Dies after the columns are flushed, before the final header is written."""
+            flushes = 0
+
+            def flush(self, *args):
+                super().flush(*args)
+                CrashingMap.flushes += 1
+                if CrashingMap.flushes == 2:
+                    raise RuntimeError("killed mid-sync")
+        with patch.object(mmap, "mmap", CrashingMap), self.assertRaises(RuntimeError):
+            vast.sync_offer_snapshot(self.path, self.FRESH, meta)
+        with self.assertRaisesRegex(ValueError, "interrupted sync"):
+            vast.OfferSnapshot(self.path)
+        self.assertTrue(vast.offer_snapshot_stale(self.path, 3600, 5.0))
+        self.assertIsNone(vast.sync_offer_snapshot(self.path, self.FRESH, meta))
+        vast.write_offer_snapshot(self.path, self.FRESH, meta)
+        self.assertEqual(self.open().offers(), self.FRESH)
+
+    def test_sync_waits_for_open_readers(self):
+        snapshot = vast.OfferSnapshot(self.path)
+        result = []
+        sync = threading.Thread(target=lambda: result.append(
+            vast.sync_offer_snapshot(self.path, self.FRESH, {"type": "on-demand", "storage": 5.0})))
+        sync.start()
+        sync.join(0.2)
+        self.assertTrue(sync.is_alive())
+        self.assertEqual(snapshot.offers(), self.OFFERS)
+        snapshot.close()
+        sync.join(5)
+        self.assertEqual(result, [{"added": 1, "updated": 1, "removed": 1, "unchanged": 2}])
+
+    def test_max_staleness_syncs_only_a_stale_snapshot(self):
+        args = vast.parser.parse_args(["search", "offers", "--local", "--raw", "-n", "--max-staleness", "60"])
+        with patch.object(vast, "offer_snapshot_path", return_value=self.path), \
+                patch.object(vast, "refresh_offer_snapshot") as refresh:
+            self.assertEqual(len(args.func(args)), 4)
+            refresh.assert_not_called()
+            with patch.object(vast.time, "time", return_value=time.time() + 61):
+                refresh.return_value = {"added": 0, "updated": 0, "removed": 0, "seconds": 0.1}
+                with redirect_stderr(io.StringIO()):
+                    args.func(args)
+            refresh.assert_called_once_with(args, self.path, "on-demand", 5.0)
+
+
+class TestLocalOfferSearch(unittest.TestCase):
+    """search offers --local against a small corpus, with and without NumPy."""
+    CORPUS = [
+        {"id": 1, "gpu_name": "RTX 4090", "num_gpus": 1, "dph_total": 0.40, "reliability": 0.995, "verified": True,
+         "rentable": True, "rented": False, "external": False, "geolocation": "Sweden, SE", "driver_version": "550.54.14",
+         "cpu_arch": "amd64", "score": 10.0},
+        {"id": 2, "gpu_name": "RTX 4090", "num_gpus": 2, "dph_total": 0.75, "reliability": 0.98, "verified": True,
+         "rentable": True, "rented": None, "external": False, "geolocation": "Taiwan, TW", "driver_version": "535.86.05",
+         "cpu_arch": "amd64", "score": 30.0},
+        {"id": 3, "gpu_name": "RTX 3090", "num_gpus": 1, "dph_total": 0.20, "reliability": 0.999, "verified": True,
+         "rentable": True, "rented": True, "external": False, "geolocation": "US", "driver_version": "470.1.2",
+         "cpu_arch": "arm64", "score": 20.0},
+        {"id": 4, "gpu_name": "A100", "num_gpus": 8, "dph_total": None, "reliability": 0.97, "verified": False,
+         "rentable": True, "rented": False, "external": False, "geolocation": None, "driver_version": "550.54.14",
+         "cpu_arch": "amd64", "score": None},
+        {"id": 5, "gpu_name": "RTX 3090", "num_gpus": 4, "dph_total": 0.90, "reliability": None, "verified": True,
+         "rentable": True, "rented": False, "external": False, "geolocation": "Vietnam, VN", "driver_version": "545.29.06",
+         "cpu_arch": None, "score": 5.0},
+    ]
+    CASES = [
+        ([], [2, 1, 5]),  # default query, score-
+        (["gpu_name=RTX_4090 num_gpus>=2"], [2]),
+        (["-n", "geolocation in [SE,TW,US]", "-o", "dph"], [3, 1, 2]),
+        (["-n", "driver_version >= 545.0.0", "-o", "driver_version-"], [1, 4, 5]),
+        (["-n", "reliability > 0.98", "-o", "dph-"], [1, 3]),
+        (["-n", "dph == None"], [4]),
+        (["-n", "cpu_arch != arm64"], [2, 1, 4]),
+        (["-n", "num_gpus notin [1,2]", "-o", "num_gpus", "--limit", "1"], [5]),
+        (["-n", "num_gpus in [1.5,4]"], [5]),  # 1.5 is not truncated to match num_gpus 1
+        (["-n", "score > 1", "-o", "score"], [5, 1, 3, 2]),
+    ]
+
+    def setUp(self):
+        vast.add_global_arguments()
+        d = tempfile.TemporaryDirectory()
+        self.addCleanup(d.cleanup)
+        self.path = os.path.join(d.name, "offers.snapshot")
+        vast.write_offer_snapshot(self.path, self.CORPUS, {"type": "on-demand", "storage": 5.0})
+
+    def search(self, argv):
+        args = vast.parser.parse_args(["search", "offers", "--local", "--raw"] + argv)
+        with patch.object(vast, "offer_snapshot_path", return_value=self.path):
+            return [offer["id"] for offer in args.func(args)]
+
+    def test_matches_expected_results(self):
+        for argv, expected in self.CASES:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.search(argv), expected)
+
+    def test_pure_python_fallback_gives_the_same_results(self):
+        with patch.dict("sys.modules", {"numpy": None}):
+            for argv, expected in self.CASES:
+                with self.subTest(argv=argv):
+                    self.assertEqual(self.search(argv), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,578 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+import vast
+
+
+def fake_response(status, headers=None):
+    r = requests.Response()
+    r.status_code = status
+    r.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    r._content = b"{}"
+    r._content_consumed = True
+    r.raw = io.BytesIO()
+    return r
+
+
+def run_request(method, policy, outcomes, retry=3, deadline=None, session=None, idempotent=None):
+    """Runs vast.http_request against a fake session that returns/raises outcomes in order."""
+    session = session or MagicMock()
+    session.request.side_effect = outcomes
+    args = argparse.Namespace(retry=retry, retry_policy=policy)
+    vast.set_deadline(args, deadline)
+    with patch.object(vast, "http_session", return_value=session), patch.object(vast, "rate_limiter", return_value=None), \
+            patch.object(vast.time, "sleep") as sleep:
+        try:
+            result = vast.http_request(method, args, "https://console.vast.ai/api/v0/instances/", idempotent=idempotent)
+        except Exception as e:
+            result = e
+    return result, session.request.call_count, [c.args[0] for c in sleep.call_args_list]
+
+
+class TestHttpSession(unittest.TestCase):
+    def tearDown(self):
+        vast.configure_http_pool(pool_size=32)
+
+    def test_session_is_reused_within_a_thread(self):
+        """Repeated calls from one thread should get the same keep-alive session."""
+        self.assertIs(vast.http_session(), vast.http_session())
+
+    def test_threads_share_one_connection_pool(self):
+        """Each thread gets its own session, but all of them mount the same adapter (pool)."""
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(vast.http_session())) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(s) for s in sessions}), 4)
+        adapters = {id(s.get_adapter("https://console.vast.ai")) for s in sessions}
+        self.assertEqual(len(adapters), 1)
+
+    def test_configure_http_pool_resizes(self):
+        """Reconfiguring the pool gives sessions a fresh adapter with the new size."""
+        before = vast.http_session().get_adapter("https://console.vast.ai")
+        vast.configure_http_pool(pool_size=4)
+        after = vast.http_session().get_adapter("https://console.vast.ai")
+        self.assertIsNot(before, after)
+        self.assertEqual(after._pool_maxsize, 4)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_retries_429_then_succeeds(self):
+        policy = vast.RetryPolicy(jitter=False)
+        r, calls, sleeps = run_request("POST", policy, [fake_response(429), fake_response(200)])
+        self.assertEqual((r.status_code, calls), (200, 2))
+        self.assertEqual(sleeps, [0.3])
+        self.assertEqual(policy.snapshot()["retries_status"], 1)
+
+    def test_honours_retry_after(self):
+        policy = vast.RetryPolicy()
+        r, calls, sleeps = run_request("GET", policy, [fake_response(503, {"Retry-After": "2"}), fake_response(200)])
+        self.assertEqual(sleeps, [2.0])
+        self.assertEqual(policy.snapshot()["retry_after_honoured"], 1)
+
+    def test_full_jitter_stays_under_backoff_cap(self):
+        policy = vast.RetryPolicy(base_delay=1.0, multiplier=2.0, max_delay=3.0, budget_min=1000)
+        for attempt, cap in ((1, 1.0), (2, 2.0), (5, 3.0)):
+            for _ in range(20):
+                delay = policy.next_delay("GET", attempt, 10, response=fake_response(429))
+                self.assertTrue(0 <= delay <= cap)
+
+    def test_post_is_not_retried_on_5xx(self):
+        """A 503 on POST may have been processed, so it is returned rather than retried."""
+        r, calls, _ = run_request("POST", vast.RetryPolicy(), [fake_response(503), fake_response(200)])
+        self.assertEqual((r.status_code, calls), (503, 1))
+
+    def test_put_is_not_retried_on_5xx_by_default(self):
+        """Many PUTs have side effects (transfer credit, prepay, copy), so they are not replayed unless opted in."""
+        r, calls, _ = run_request("PUT", vast.RetryPolicy(), [fake_response(503), fake_response(200)])
+        self.assertEqual((r.status_code, calls), (503, 1))
+
+    def test_idempotent_put_is_retried_on_connection_reset(self):
+        reset = requests.exceptions.ConnectionError("Connection reset by peer")
+        r, calls, _ = run_request("PUT", vast.RetryPolicy(), [reset, fake_response(200)], idempotent=True)
+        self.assertEqual((r.status_code, calls), (200, 2))
+
+    def test_side_effecting_commands_send_one_request_on_503(self):
+        vast.add_global_arguments()
+        commands = (
+            ["transfer", "credit", "someone@example.com", "5", "--skip"],
+            ["prepay", "instance", "123", "10"],
+            ["recycle", "instance", "123"],
+            ["reboot", "instance", "123"],
+            ["vm", "copy", "123", "456"],
+            ["copy", "123:/workspace/a", "456:/workspace/b"],
+        )
+        for argv in commands:
+            with self.subTest(command=" ".join(argv[:2])):
+                args = vast.parser.parse_args(argv)
+                args.api_key = "k"
+                session = MagicMock()
+                session.request.side_effect = [fake_response(503), fake_response(200)]
+                with patch.object(vast, "http_session", return_value=session), \
+                        patch.object(vast, "rate_limiter", return_value=None), patch.object(vast.time, "sleep"), \
+                        patch("sys.stdout", new_callable=io.StringIO):
+                    try:
+                        args.func(args)
+                    except (requests.exceptions.HTTPError, ValueError):
+                        pass
+                self.assertEqual(session.request.call_count, 1)
+
+    def test_instance_creating_put_is_not_replayed(self):
+        """PUT /asks/ID/ may have created (and billed) an instance before the reset or 503."""
+        args = argparse.Namespace(retry=3, retry_policy=vast.RetryPolicy(), url="https://console.vast.ai", api_key="k",
+                                  explain=False)
+        vast.set_deadline(args, None)
+        for outcome in (requests.exceptions.ConnectionError("Connection reset by peer"), fake_response(503)):
+            session = MagicMock()
+            session.request.side_effect = [outcome, fake_response(200)]
+            with patch.object(vast, "http_session", return_value=session), \
+                    patch.object(vast, "rate_limiter", return_value=None), patch.object(vast.time, "sleep"):
+                with self.assertRaises((requests.exceptions.ConnectionError, requests.exceptions.HTTPError)):
+                    vast.create_from_offer(args, 123, {"image": "x"})
+            self.assertEqual(session.request.call_count, 1)
+
+    def test_post_connection_reset_is_raised(self):
+        reset = requests.exceptions.ConnectionError("Connection reset by peer")
+        r, calls, _ = run_request("POST", vast.RetryPolicy(), [reset, fake_response(200)])
+        self.assertIsInstance(r, requests.exceptions.ConnectionError)
+        self.assertEqual(calls, 1)
+
+    def test_gives_up_after_max_attempts(self):
+        policy = vast.RetryPolicy()
+        r, calls, _ = run_request("GET", policy, [fake_response(429)] * 5, retry=3)
+        self.assertEqual((r.status_code, calls), (429, 3))
+        self.assertEqual(policy.snapshot()["gave_up"], 1)
+
+    def test_retry_budget_limits_retry_storms(self):
+        """Once the reserve is spent, retries are only allowed at budget_ratio per request."""
+        policy = vast.RetryPolicy(budget_min=2, budget_ratio=0.5)
+        retried = 0
+        for _ in range(10):
+            policy.start()
+            if policy.next_delay("GET", 1, 3, response=fake_response(429)) is not None:
+                retried += 1
+        self.assertLess(retried, 10)
+        self.assertGreater(policy.snapshot()["budget_exhausted"], 0)
+
+
+class TestDeadline(unittest.TestCase):
+    def test_every_request_has_a_timeout(self):
+        session = MagicMock()
+        run_request("GET", vast.RetryPolicy(), [fake_response(200)], session=session)
+        self.assertEqual(session.request.call_args.kwargs["timeout"], (vast.HTTP_CONNECT_TIMEOUT, vast.HTTP_READ_TIMEOUT))
+
+    def test_timeouts_are_capped_by_the_deadline(self):
+        args = argparse.Namespace()
+        vast.set_deadline(args, 2)
+        connect, read = vast.http_timeout(args)
+        self.assertLessEqual(connect, 2)
+        self.assertLessEqual(read, 2)
+
+    def test_expired_deadline_raises_before_sending(self):
+        r, calls, _ = run_request("GET", vast.RetryPolicy(), [fake_response(200)], deadline=-1)
+        self.assertIsInstance(r, vast.DeadlineExceeded)
+        self.assertEqual(calls, 0)
+
+    def test_no_retry_is_scheduled_past_the_deadline(self):
+        """A Retry-After longer than the time left returns the 503 instead of sleeping through the deadline."""
+        outcomes = [fake_response(503, {"Retry-After": "30"}), fake_response(200)]
+        r, calls, sleeps = run_request("GET", vast.RetryPolicy(), outcomes, deadline=5)
+        self.assertEqual((r.status_code, calls, sleeps), (503, 1, []))
+
+    def test_connection_error_past_the_deadline_raises_deadline_exceeded(self):
+        reset = requests.exceptions.ConnectionError("Connection reset by peer")
+        r, calls, _ = run_request("GET", vast.RetryPolicy(base_delay=30, jitter=False), [reset, fake_response(200)], deadline=5)
+        self.assertIsInstance(r, vast.DeadlineExceeded)
+        self.assertIsInstance(r, requests.exceptions.Timeout)
+
+
+class TestValidatorCache(unittest.TestCase):
+    URL = "https://console.vast.ai/api/v0/instances?owner=me&api_key="
+
+    def setUp(self):
+        self.cache = vast.ValidatorCache(max_entries=2)
+        patcher = patch.object(vast, "VALIDATOR_CACHE", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, response, api_key="k1"):
+        session = MagicMock()
+        session.request.return_value = response
+        args = argparse.Namespace(retry=3)
+        with patch.object(vast, "http_session", return_value=session), patch.object(vast, "rate_limiter", return_value=None):
+            r = vast.http_get(args, self.URL + api_key)
+        return r, session.request.call_args.kwargs["headers"] or {}
+
+    def body(self, status, etag, rows):
+        r = fake_response(status, {"ETag": etag, "Content-Type": "application/json"})
+        r._content = json.dumps({"instances": rows}).encode() if status == 200 else b""
+        return r
+
+    def test_304_is_answered_from_the_cache(self):
+        rows = [{"id": 1, "label": None}]
+        r, sent = self.get(self.body(200, '"v1"', rows))
+        self.assertNotIn("If-None-Match", sent)
+        r, sent = self.get(self.body(304, '"v1"', rows))
+        self.assertEqual(sent["If-None-Match"], '"v1"')
+        self.assertEqual((r.status_code, r.json()), (200, {"instances": rows}))
+        self.assertTrue(r.from_cache)
+        self.assertEqual(self.cache.snapshot()["hits"], 1)
+
+    def test_callers_cannot_corrupt_the_cached_body(self):
+        self.get(self.body(200, '"v1"', [{"id": 1}]))
+        r, _ = self.get(self.body(304, '"v1"', []))
+        r.json()["instances"][0]["id"] = 99
+        r, _ = self.get(self.body(304, '"v1"', []))
+        self.assertEqual(r.json()["instances"][0]["id"], 1)
+
+    def test_entries_are_per_credential(self):
+        self.get(self.body(200, '"v1"', [{"id": 1}]), api_key="k1")
+        _, sent = self.get(self.body(200, '"v2"', [{"id": 2}]), api_key="k2")
+        self.assertNotIn("If-None-Match", sent)
+        self.assertNotEqual(self.cache.key(self.URL + "k1"), self.cache.key(self.URL + "k2"))
+        self.assertEqual(self.cache.key(self.URL + "k1"), self.cache.key(self.URL + "k1", {}))
+
+    def test_lru_eviction(self):
+        for i in range(3):
+            self.get(self.body(200, '"v"', []), api_key=str(i))
+        self.assertEqual(self.cache.snapshot()["evictions"], 1)
+        _, sent = self.get(self.body(200, '"v"', []), api_key="0")
+        self.assertNotIn("If-None-Match", sent)
+
+
+class TestStreamingDecode(unittest.TestCase):
+    OFFERS = [{"id": i, "gpu_name": "RTX 4090 \u00e9", "dph_total": 0.25 * i, "rented": i % 3 == 0} for i in range(50)]
+
+    def chunked(self, text, size):
+        data = text.encode("utf-8")
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_elements_are_decoded_across_chunk_boundaries(self):
+        """Chunks split tokens, numbers and multi-byte characters at arbitrary points."""
+        text = json.dumps({"timestamp": 1.5, "extra": {"a": [1, 2]}, "offers": self.OFFERS})
+        for size in (1, 7, 4096):
+            self.assertEqual(list(vast.iter_json_array(self.chunked(text, size), key="offers")), self.OFFERS)
+
+    def test_first_element_is_yielded_before_the_end_of_the_stream(self):
+        def chunks():
+            yield b'{"offers": [{"id": 1}, '
+            raise AssertionError("read past the first offer")
+        self.assertEqual(next(vast.iter_json_array(chunks(), key="offers")), {"id": 1})
+
+    def test_empty_and_missing_arrays(self):
+        self.assertEqual(list(vast.iter_json_array([b'{"offers": [ ]}'], key="offers")), [])
+        with self.assertRaises(ValueError):
+            list(vast.iter_json_array([b'{"msg": "nope"}'], key="offers"))
+        with self.assertRaises(ValueError):
+            list(vast.iter_json_array([b'{"offers": [{"id": 1}, {"id"'], key="offers"))
+
+    def test_iter_offers_applies_rented_filter(self):
+        r = fake_response(200, {"Content-Type": "application/json"})
+        r._content = json.dumps({"offers": self.OFFERS}).encode()
+        rows = list(vast.iter_offers(r, {"rented": {"eq": False}}))
+        self.assertEqual([o["id"] for o in rows], [o["id"] for o in self.OFFERS if not o["rented"]])
+
+    def test_print_json_stream_matches_json_dumps(self):
+        for rows in (self.OFFERS[:3], []):
+            out = io.StringIO()
+            vast.print_json_stream(iter(rows), out)
+            self.assertEqual(out.getvalue(), json.dumps(rows, indent=1, sort_keys=True) + "\n")
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_bucket_allows_burst_then_paces(self):
+        bucket = vast.TokenBucket(rate=50, burst=5)
+        start = time.time()
+        for _ in range(15):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 10 / 50.0 * 0.9)
+        self.assertEqual(bucket.stats["acquired"], 15)
+
+    def test_shared_bucket_state_is_seen_by_other_instances(self):
+        """Two buckets on the same state file (as in two processes) draw from the same tokens."""
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "bucket.state")
+            a = vast.TokenBucket(rate=0.01, burst=2, path=path)
+            b = vast.TokenBucket(rate=0.01, burst=2, path=path)
+            self.assertEqual(a.try_acquire(), 0)
+            self.assertEqual(b.try_acquire(), 0)
+            self.assertGreater(a.try_acquire(), 0)
+            self.assertGreater(b.try_acquire(), 0)
+
+    def test_penalize_empties_bucket(self):
+        bucket = vast.TokenBucket(rate=1, burst=10)
+        bucket.penalize()
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_default_limits_apply_from_the_first_call(self):
+        """A fresh process is paced by the default limits without waiting for a 429."""
+        with patch.dict(vast._rate_limiters, clear=True), patch.dict(os.environ, {"VAST_RATE_LIMIT_SHARED": "0"}), \
+                patch.dict(vast.RATE_LIMITS, {"search": (0.01, 2)}):
+            bucket = vast.rate_limiter("POST", "https://console.vast.ai/api/v0/bundles/")
+            self.assertEqual([bucket.try_acquire() for _ in range(2)], [0, 0])
+            self.assertGreater(bucket.try_acquire(), 0)
+            self.assertEqual(bucket.stats["penalized"], 0)
+
+    def test_endpoint_classes(self):
+        base = "https://console.vast.ai/api/v0"
+        self.assertEqual(vast.endpoint_class("POST", base + "/bundles/?api_key=x"), "search")
+        self.assertEqual(vast.endpoint_class("PUT", base + "/instances/request_logs/12/"), "logs")
+        self.assertEqual(vast.endpoint_class("DELETE", base + "/instances/12/"), "mutation")
+        self.assertEqual(vast.endpoint_class("PUT", base + "/asks/12/"), "mutation")
+        self.assertEqual(vast.endpoint_class("GET", base + "/instances?owner=me"), "default")
+
+
+class TestDestroyInstances(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+
+    def destroy(self, ids, respond, *options):
+        calls = []
+
+        def http_del(args, url, headers, json={}):
+            calls.append((url.split("/api/v0")[1].split("?")[0], json))
+            status, content = respond(calls[-1][0], json)
+            r = fake_response(status)
+            r._content = content if content is not None else \
+                b'{"success": true}' if r.status_code == 200 else b'{"msg": "no such instance"}'
+            return r
+        args = vast.parser.parse_args(["destroy", "instances"] + [str(i) for i in ids] + list(options))
+        args.api_key = "k"
+        out = io.StringIO()
+        with patch.object(vast, "http_del", side_effect=http_del), patch("sys.stdout", out):
+            return args.func(args), calls, out.getvalue()
+
+    def test_one_request_per_id_by_default(self):
+        status, calls, out = self.destroy([1, 2, 3], lambda path, body: (200, None), "--raw")
+        self.assertEqual(status["destroyed"], [1, 2, 3])
+        self.assertEqual(sorted(path for path, _ in calls), ["/instances/1/", "/instances/2/", "/instances/3/"])
+
+    def test_batches_count_only_ids_the_response_reports_destroyed(self):
+        def respond(path, body):
+            if path != "/instances/":
+                return 200, None
+            if body["ids"] == [1, 2]:  # a blanket success says nothing about any one id
+                return 200, b'{"success": true}'
+            results = [{"id": id, "success": id != 4} for id in body["ids"] if id != 5]
+            return 200, json.dumps({"success": True, "results": results}).encode()
+        status, calls, out = self.destroy(range(1, 6), respond, "--batch-size", "2", "--raw")
+        self.assertEqual(status, {"destroyed": [1, 2, 3, 4, 5], "failed": [],
+                                  "results": [{"id": i, "success": True} for i in range(1, 6)]})
+        self.assertEqual(sorted(body["ids"] for path, body in calls if path == "/instances/"), [[1, 2], [3, 4], [5]])
+        self.assertEqual(sorted(path for path, _ in calls if path != "/instances/"),
+                         ["/instances/1/", "/instances/2/", "/instances/4/", "/instances/5/"])
+        self.assertEqual(out, "")
+
+    def test_falls_back_to_one_request_per_id_and_reports_failures(self):
+        def respond(path, body):
+            if path == "/instances/":
+                return 405, None
+            return (404 if path == "/instances/3/" else 200), None
+        status, calls, out = self.destroy([1, 2, 3, 2], respond, "--batch-size", "2", "--parallel", "1")
+        self.assertEqual(status, 1)
+        self.assertEqual([path for path, _ in calls], ["/instances/", "/instances/1/", "/instances/2/", "/instances/3/"])
+        self.assertIn("failed destroying instance 3: failed with error 404: no such instance", out)
+        self.assertTrue(out.endswith("destroyed 2 of 3 instances, failed: 3\n"))
+
+
+class TestListMachines(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+
+    def test_only_transient_failures_are_retried(self):
+        attempts = {}
+
+        def http_put(args, url, headers, json, idempotent=None):
+            self.assertEqual(vast.get_retry_policy(args).attempts(args), 1)  # retried by the queue only
+            id = json["machine"]
+            attempts[id] = attempts.get(id, 0) + 1
+            if id == 2 and attempts[id] == 1:
+                raise requests.exceptions.ConnectionError("connection reset")
+            r = fake_response(503 if id == 4 else 200)
+            r._content = b'{"success": false, "msg": "bad price"}' if id == 3 else b'{"success": true, "extended": 2}'
+            return r
+        args = vast.parser.parse_args(["list", "machines", "1", "2", "3", "4", "--max-retries", "2", "--raw"])
+        args.api_key = "k"
+        with patch.object(vast, "http_put", side_effect=http_put), patch.object(vast.time, "sleep"):
+            res = args.func(args)
+        self.assertEqual(attempts, {1: 1, 2: 2, 3: 1, 4: 3})
+        self.assertEqual((res["listed"], res["failed"], res["extended"]), ([1, 2], [3, 4], 4))
+        self.assertEqual(res["results"][2], {"id": 3, "status": "failed", "extended": 0, "attempts": 1, "msg": "bad price"})
+
+    def test_retry_sets_the_tries_per_machine(self):
+        attempts = []
+
+        def http_put(args, url, headers, json, idempotent=None):
+            attempts.append(json["machine"])
+            return fake_response(404 if json["machine"] == 2 else 503)
+        args = vast.parser.parse_args(["list", "machines", "1", "2", "--retry", "2", "--raw"])
+        args.api_key = "k"
+        with patch.object(vast, "http_put", side_effect=http_put), patch.object(vast.time, "sleep"):
+            res = args.func(args)
+        self.assertEqual(sorted(attempts), [1, 1, 2])  # a 404 is not worth a second try
+        self.assertEqual(res["failed"], [1, 2])
+
+
+class TestWorkQueue(unittest.TestCase):
+    def test_slow_item_does_not_hold_up_the_rest(self):
+        release = threading.Event()
+        done = []
+
+        def f(i):
+            if i == 0:
+                release.wait(5)
+            done.append(i)
+            if len(done) == 7:
+                release.set()
+            return True
+        work = vast.exec_with_threads(f, list(range(8)), nt=2)
+        self.assertEqual(done[-1], 0)  # the other thread ran items 1-7 while item 0 was stuck
+        self.assertTrue(all(w.ok for w in work))
+
+    def test_failures_are_retried_then_collected(self):
+        calls = []
+
+        def f(i, fail):
+            calls.append(i)
+            if fail:
+                raise requests.exceptions.ConnectionError("boom {}".format(i))
+            return i
+        work = vast.exec_with_threads(f, [(1, False), (2, True), (3, False)], nt=1, max_retries=2)
+        self.assertEqual([w.result for w in work], [1, None, 3])
+        self.assertEqual([w.attempts for w in work], [1, 3, 1])
+        self.assertEqual(str(work[1].error), "boom 2")
+        self.assertEqual(calls[:3], [1, 2, 3])  # item 3 didn't wait for item 2's retries
+
+    def test_only_transient_errors_are_retried(self):
+        def http_error(status):
+            return requests.exceptions.HTTPError(response=fake_response(status))
+        errors = [http_error(400), http_error(401), http_error(403), http_error(404), RuntimeError("bug"),
+                  http_error(429), http_error(502), requests.exceptions.ReadTimeout("slow")]
+
+        def f(i):
+            raise errors[i]
+        work = vast.exec_with_threads(f, range(len(errors)), nt=2, max_retries=2)
+        self.assertEqual([w.attempts for w in work], [1, 1, 1, 1, 1, 3, 3, 3])
+
+    def test_deadline_and_interrupts_are_not_retried(self):
+        calls = []
+
+        def f(i):
+            calls.append(i)
+            if i == 1:
+                vast.check_deadline(argparse.Namespace(deadline_at=time.time() - 1))
+            raise KeyboardInterrupt
+        work = vast.exec_with_threads(f, [1], nt=1, max_retries=3)
+        self.assertIsInstance(work[0].error, vast.DeadlineExceeded)
+        with self.assertRaises(KeyboardInterrupt):
+            vast.exec_with_threads(f, [2, 3], nt=1, max_retries=3)
+        self.assertEqual(calls, [1, 2])
+
+    def test_ctrl_c_stops_handing_out_items(self):
+        started = []
+        queue = vast.WorkQueue(lambda i: started.append(i) or time.sleep(0.05) or True, concurrency=1)
+        with patch.object(threading.Thread, "join", side_effect=KeyboardInterrupt):  # Ctrl-C while waiting
+            with self.assertRaises(KeyboardInterrupt):
+                queue.run(range(100))
+        time.sleep(0.2)
+        self.assertTrue(queue.cancelled)
+        self.assertLess(len(started), 5)
+
+
+class TestBulkInstanceCommands(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+
+    def test_label_instances_reports_each_id(self):
+        sent = []
+
+        def http_put(args, url, headers, json, idempotent=None):
+            sent.append((url.split("/api/v0")[1].split("?")[0], json))
+            r = fake_response(200)
+            r._content = b'{"success": false, "msg": "not yours"}' if "/2/" in url else b'{"success": true}'
+            return r
+        args = vast.parser.parse_args(["label", "instances", "1", "2", "3", "1", "gpu-box", "--raw"])
+        args.api_key = "k"
+        with patch.object(vast, "http_put", side_effect=http_put):
+            res = args.func(args)
+        self.assertEqual(sorted(sent), [("/instances/{}/".format(i), {"label": "gpu-box"}) for i in (1, 2, 3)])
+        self.assertEqual(res, {"labeled": [1, 3], "failed": [2], "results": [
+            {"id": 1, "success": True}, {"id": 2, "success": False, "msg": "not yours"}, {"id": 3, "success": True}]})
+
+
+class TestCreateInstances(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+
+    def test_moves_past_taken_offers_and_stops_at_count(self):
+        sent = []
+
+        def http_put(args, url, headers, json, idempotent=None):
+            self.assertIs(idempotent, False)  # a replayed create could start a second instance
+            offer = int(url.split("/asks/")[1].split("/")[0])
+            sent.append((offer, json["cancel_unavail"]))
+            r = fake_response(200)
+            r._content = b'{"success": false, "msg": "offer taken"}' if offer == 2 else \
+                '{{"success": true, "new_contract": {}}}'.format(offer + 100).encode()
+            return r
+        searched = []
+
+        def search__offers(args):
+            searched.append((args.query, args.limit, args.raw_stream))
+            return ({"id": i} for i in range(1, 11))
+        args = vast.parser.parse_args(["create", "instances", "--count", "3", "--query", "num_gpus=1", "--image", "x",
+                                       "--parallel", "2", "--raw"])
+        args.api_key = "k"
+        with patch.object(vast, "http_put", side_effect=http_put), patch.object(vast, "search__offers", side_effect=search__offers):
+            res = args.func(args)
+        self.assertEqual(searched, [(["num_gpus=1"], 64, True)])
+        self.assertEqual(sorted(res["instances"]), [101, 103, 104])
+        self.assertEqual(res["failed"], [{"offer": 2, "msg": "offer taken"}])
+        self.assertEqual(res["tried"], 4)
+        self.assertEqual(sorted(sent), [(1, True), (2, True), (3, True), (4, True)])
+        self.assertIsNotNone(res["time_to_fleet"])
+
+    def test_race_keeps_the_first_instance_and_destroys_the_rest(self):
+        search = fake_response(200)
+        search.close = MagicMock()
+
+        def http_put(args, url, headers, json, idempotent=None):
+            self.assertIs(idempotent, False)
+            search.close.assert_called_once_with()  # the search response isn't held open during the creates
+            offer = int(url.split("/asks/")[1].split("/")[0])
+            r = fake_response(200)
+            r._content = b'{"success": false, "msg": "offer taken"}' if offer == 1 else \
+                '{{"success": true, "new_contract": {}}}'.format(offer + 100).encode()
+            return r
+        deleted = []
+
+        def http_del(args, url, headers, json={}):
+            deleted.append(int(url.split("/instances/")[1].split("/")[0]))
+            r = fake_response(200)
+            r._content = b'{"success": true}'
+            return r
+        args = vast.parser.parse_args(["launch", "instance", "-g", "RTX_4090", "-n", "1", "-i", "x", "--race", "3", "--raw"])
+        args.api_key = "k"
+        with patch.object(vast, "_get_gpu_names", return_value=None), patch.object(vast, "http_post", return_value=search), \
+                patch.object(vast, "iter_offers", return_value=iter([{"id": 1}, {"id": 2}, {"id": 3}])), \
+                patch.object(vast, "http_put", side_effect=http_put), patch.object(vast, "http_del", side_effect=http_del):
+            res = args.func(args)
+        self.assertTrue(res["success"])
+        self.assertEqual(sorted([res["new_contract"]] + deleted), [102, 103])
+        self.assertEqual(res["destroyed"], [{"id": deleted[0], "success": True}])
+        self.assertEqual(res["failed"], [{"offer": 1, "msg": "offer taken"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import io
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+import vast
+
+
+class TestParseQuery(unittest.TestCase):
+    def parse(self, query, res=None):
+        return vast.parse_query(query, res, vast.offers_fields, vast.offers_alias, vast.offers_mult)
+
+    def test_aliases_multipliers_lists_and_wildcards(self):
+        base = {"verified": {"eq": True}, "rented": {"eq": False}}
+        self.assertEqual(self.parse("dph<0.5 gpu_ram>=24 geolocation in [TW,SE] gpu_name=RTX_4090 rented=any", base), {
+            "verified": {"eq": True}, "dph_total": {"lt": "0.5"}, "gpu_ram": {"gte": 24000.0},
+            "geolocation": {"in": ["TW", "SE"]}, "gpu_name": {"eq": "RTX 4090"}})
+        self.assertEqual(self.parse("cpu_ram in [1,2] verified=False num_gpus != None"), {
+            "cpu_ram": {"in": [1000.0, 2000.0]}, "verified": {"eq": False}, "num_gpus": {"neq": None}})
+
+    def test_memoized_results_are_not_shared(self):
+        vast._compile_query.cache_clear()
+        first = self.parse("geolocation in [TW,SE] num_gpus>=2")
+        first["geolocation"]["in"].append("US")
+        first["num_gpus"]["lte"] = "8"
+        self.assertEqual(self.parse("geolocation in [TW,SE] num_gpus>=2"),
+                         {"geolocation": {"in": ["TW", "SE"]}, "num_gpus": {"gte": "2"}})
+        self.assertEqual(vast._compile_query.cache_info().hits, 1)
+
+    def test_warnings_repeat_and_errors_are_raised_every_time(self):
+        for _ in range(2):
+            err = io.StringIO()
+            with redirect_stderr(err):
+                self.parse("bogus_field=1")
+            self.assertIn("Unrecognized field: bogus_field", err.getvalue())
+            with self.assertRaisesRegex(ValueError, "Unconsumed text"):
+                self.parse("num_gpus>=4 ~~")
+            with self.assertRaisesRegex(ValueError, "Wildcard"):
+                self.parse("rented!=any")
+
+    def test_unknown_fields_are_warned_about_before_a_syntax_error(self):
+        for _ in range(2):  # the second parse is served from the memo
+            err = io.StringIO()
+            with redirect_stderr(err), self.assertRaisesRegex(ValueError, "Wildcard"):
+                self.parse("bogus_a=1 num_gpus>=2 bogus_b=2 bogus_c!=any bogus_d=3")
+            self.assertEqual(err.getvalue().splitlines(), [
+                "Warning: Unrecognized field: bogus_a, see list of recognized fields.",
+                "Warning: Unrecognized field: bogus_b, see list of recognized fields.",
+                "Warning: Unrecognized field: bogus_c, see list of recognized fields."])
+
+    def test_parse_order(self):
+        self.assertEqual(vast.parse_order("num_gpus, dph-,+score,", vast.offers_alias),
+                         [["num_gpus", "asc"], ["dph_total", "desc"], ["score", "asc"]])
+
+
+class TestQueryPlan(unittest.TestCase):
+    CASES = [
+        ("gpu_ram>=16 gpu_ram>24", {"gpu_ram": {"gt": 24000.0}}),
+        ("num_gpus in [1,2,4,2] num_gpus>=2", {"num_gpus": {"in": ["2", "4"]}}),
+        ("num_gpus>=4 num_gpus<=4", {"num_gpus": {"eq": "4"}}),
+        ("geolocation in [SE,TW] geolocation notin [TW,CN]", {"geolocation": {"in": ["SE"]}}),
+        ("num_gpus>2 num_gpus notin [1,2,3,8] num_gpus!=3", {"num_gpus": {"gt": "2", "notin": ["3", "8"]}}),
+        ("verified!=False", {"verified": {"eq": True}}),  # with the default verified=True
+        ("gpu_name>A dph==None dph<1", {"gpu_name": {"gt": "A"}, "dph_total": {"eq": None, "lt": "1"}}),  # left alone
+    ]
+    UNSATISFIABLE = ["dph<0.2 dph>0.5", "dph<=0.2 dph>0.2", "num_gpus>=4 num_gpus<=4 num_gpus!=4",
+                     "gpu_name=RTX_4090 gpu_name!=RTX_4090", "num_gpus=4 num_gpus in [1,2]"]
+
+    def plan(self, query, base=None):
+        return vast.QueryPlan(vast.parse_query(query, base, vast.offers_fields, vast.offers_alias, vast.offers_mult))
+
+    def test_comparisons_on_a_field_are_combined(self):
+        for query, expected in self.CASES:
+            with self.subTest(query=query):
+                plan = self.plan(query, {"verified": {"eq": True}} if "verified" in query else None)
+                self.assertEqual(plan.query, expected)
+                self.assertIsNone(plan.unsatisfiable)
+
+    def test_unsatisfiable_queries(self):
+        for query in self.UNSATISFIABLE:
+            with self.subTest(query=query):
+                self.assertIsNotNone(self.plan(query).unsatisfiable)
+
+    def test_search_offers_skips_the_api_for_an_unsatisfiable_query(self):
+        vast.add_global_arguments()
+        args = vast.parser.parse_args(["search", "offers", "--raw", "--explain", "gpu_ram>=16 gpu_ram>24 dph<0.2 dph>0.5"])
+        out = io.StringIO()
+        with patch.object(vast, "http_post", side_effect=AssertionError("no request expected")), redirect_stdout(out):
+            self.assertEqual(args.func(args), [])
+        self.assertIn("gpu_ram: gte 16000.0, gt 24000.0  ->  gt 24000.0", out.getvalue())
+        self.assertIn("no offer can match", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import vast
+
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+        self.stdout, self.stderr = vast._ThreadOutput(sys.stdout), vast._ThreadOutput(sys.stderr)
+        for name, stream in (("stdout", self.stdout), ("stderr", self.stderr)):
+            patcher = patch.object(sys, name, stream)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def request(self, argv, env=None, cwd=None):
+        client, daemon = socket.socketpair()
+        with client:
+            client.sendall(json.dumps({"argv": argv, "cwd": cwd or os.getcwd(), "env": env or {}}).encode() + b"\n")
+            vast._serve_connection(daemon, self.stdout, self.stderr)
+            return [json.loads(line) for line in client.makefile("rb")]
+
+    def test_output_and_exit_status_are_sent_back(self):
+        messages = self.request(["show", "instance"])
+        self.assertEqual(messages[-1], {"exit": 2})
+        stderr = "".join(m["data"] for m in messages if m.get("fd") == 2)
+        self.assertIn("the following arguments are required: id", stderr)
+
+    def test_command_sees_the_clients_api_key(self):
+        seen = []
+        with patch.dict(os.environ, {"VAST_API_KEY": "daemon-key"}), \
+                patch.object(vast, "run", side_effect=lambda argv: seen.append(vast.default_api_key())):
+            self.assertEqual(self.request(["show", "ssh-keys"], env={"VAST_API_KEY": "client-key"}), [{"exit": 0}])
+            self.assertEqual(os.environ["VAST_API_KEY"], "daemon-key")
+        self.assertEqual(seen, ["client-key"])
+
+    def test_client_forwards_to_a_listening_daemon(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "serve.sock")
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+            listener.listen(1)
+
+            def serve_once():
+                conn, _ = listener.accept()
+                vast._serve_connection(conn, self.stdout, self.stderr)
+            t = threading.Thread(target=serve_once)
+            t.start()
+            out, err = io.StringIO(), io.StringIO()
+            with patch.object(vast, "SERVE_SOCKET", path), patch.object(sys, "stdout", out), patch.object(sys, "stderr", err):
+                status = vast.forward_to_daemon(["show", "instance"])
+            t.join()
+            listener.close()
+        self.assertEqual(status, 2)
+        self.assertIn("arguments are required", err.getvalue())
+
+    def test_connections_are_served_concurrently(self):
+        """A second client with the same directory and key isn't held up by a slow first one."""
+        second_done = threading.Event()
+
+        def run(argv):
+            if argv == ["first"]:
+                self.assertTrue(second_done.wait(5))
+            print(argv[0])
+        results = {}
+
+        def client(name):
+            results[name] = self.request([name])
+            if name == "second":
+                second_done.set()
+        with patch.object(vast, "run", side_effect=run):
+            first = threading.Thread(target=client, args=("first",))
+            first.start()
+            client("second")
+            first.join()
+        self.assertEqual(results["first"], [{"fd": 1, "data": "first"}, {"fd": 1, "data": "\n"}, {"exit": 0}])
+        self.assertEqual(results["second"][-1], {"exit": 0})
+
+    def test_concurrent_clients_send_their_own_api_keys(self):
+        """--api-key isn't part of the client context, so each request must carry its own key."""
+        sent = {}
+        both_in_flight = threading.Barrier(2, timeout=5)
+
+        def send(method, url, headers=None, **kwargs):
+            both_in_flight.wait()
+            sent[url.split("/reboot/")[1].split("?")[0]] = (headers or {}).get("Authorization")
+            r = requests.Response()
+            r.status_code, r._content = 200, b'{"success": true}'
+            return r
+        session = MagicMock()
+        session.request.side_effect = send
+        results = {}
+
+        def client(id, key):
+            results[id] = self.request(["reboot", "instance", id, "--api-key", key])
+        with patch.object(vast, "http_session", return_value=session), patch.object(vast, "rate_limiter", return_value=None):
+            threads = [threading.Thread(target=client, args=(id, key)) for id, key in (("1", "key-a"), ("2", "key-b"))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(sent, {"1/": "Bearer key-a", "2/": "Bearer key-b"})
+        self.assertEqual([results[id][-1] for id in ("1", "2")], [{"exit": 0}, {"exit": 0}])
+        self.assertNotIn("Authorization", vast.headers)
+
+    def test_clients_in_other_directories_take_turns(self):
+        seen = []
+        started = threading.Event()
+
+        def run(argv):
+            seen.append((argv[0], os.getcwd()))
+            if argv == ["a"]:
+                started.set()
+                time.sleep(0.2)
+                seen.append(("a done", os.getcwd()))
+        with tempfile.TemporaryDirectory() as d:
+            d, cwd = os.path.realpath(d), os.getcwd()
+            with patch.object(vast, "run", side_effect=run):
+                a = threading.Thread(target=self.request, args=(["a"],), kwargs={"cwd": d})
+                a.start()
+                started.wait(5)
+                self.request(["b"], cwd=cwd)
+                a.join()
+            self.assertEqual(seen, [("a", d), ("a done", d), ("b", cwd)])
+            self.assertEqual(os.getcwd(), cwd)
+
+    def test_local_commands_and_missing_daemon_run_in_process(self):
+        with patch.object(vast, "SERVE_SOCKET", "/nonexistent/serve.sock"):
+            self.assertIsNone(vast.forward_to_daemon(["show", "instances"]))
+        with tempfile.NamedTemporaryFile() as f, patch.object(vast, "SERVE_SOCKET", f.name):
+            self.assertIsNone(vast.forward_to_daemon(["copy", "a", "b"]))
+            self.assertIsNone(vast.forward_to_daemon(["show", "instances"]))  # stale socket file
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        vast.add_global_arguments()
+
+    def run_batch(self, text, *options):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        args = vast.parser.parse_args(["batch", f.name, "--url", "http://batch.test"] + list(options))
+        args.api_key = "k"
+        out = io.StringIO()
+        with redirect_stdout(out):
+            status = args.func(args)
+        return status, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_one_record_per_line_in_input_order(self):
+        calls = []
+
+        def show_instance(args):
+            calls.append((args.id, args.url, args.api_key, args.raw))
+            print("noise")
+            return {"id": args.id}
+        sp = vast.parser.subparsers_.choices["show instance"]
+        with patch.dict(sp._defaults, {"func": show_instance}):
+            status, records = self.run_batch("# comment\nshow instance 1\n\nvastai show instance 2 --url http://other\n"
+                                             "show instance\n", "--parallel", "2")
+        self.assertEqual(status, 1)
+        self.assertEqual([r["line"] for r in records], [2, 4, 5])
+        self.assertEqual(records[0], {"line": 2, "command": "show instance 1", "status": 0, "result": {"id": 1},
+                                      "stdout": "noise\n"})
+        self.assertEqual(records[2]["status"], 2)
+        self.assertIn("required: id", records[2]["error"])
+        self.assertEqual(sorted(calls), [(1, "http://batch.test", "k", True), (2, "http://other", "k", True)])
+
+    def test_failures_returned_by_commands_get_a_nonzero_status(self):
+        def show_instance(args):
+            if args.id == 1:
+                print("failed with error 404: no such instance")
+                return 1
+            r = requests.Response()
+            r.status_code, r._content, r.url = 400, b'{"msg": "bad id"}', "http://batch.test"
+            return r
+        sp = vast.parser.subparsers_.choices["show instance"]
+        with patch.dict(sp._defaults, {"func": show_instance}):
+            status, records = self.run_batch("show instance 1\nshow instance 2\n")
+        self.assertEqual(status, 1)
+        self.assertEqual([(r["status"], r["error"]) for r in records],
+                         [(1, "failed with error 404: no such instance"), (1, "failed with error 400: bad id")])
+
+    def test_stop_on_error_and_rejected_commands(self):
+        status, records = self.run_batch("serve\nbatch x\nserve\n", "--stop-on-error")
+        self.assertEqual(status, 1)
+        self.assertEqual(len(records), 1)
+        self.assertIn("can't be run from a batch", records[0]["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # PYTHON_ARGCOMPLETE_OK
 
-from __future__ import unicode_literals, print_function
+from __future__ import unicode_literals, print_function, annotations
 
 import re
 import json
@@ -11,33 +11,67 @@ import os
 import time
 from typing import Dict, List, Tuple, Optional
 from datetime import date, datetime, timedelta
-import hashlib
+import codecs
+import functools
+import heapq
+import importlib
 import math
+import random
+import struct
 import threading
-from concurrent.futures import ThreadPoolExecutor
-import requests
-import getpass
-import subprocess
-from subprocess import PIPE
-import urllib3
+import types
+from collections import OrderedDict
 import atexit
-from contextlib import redirect_stdout, redirect_stderr
+import builtins
+from contextlib import redirect_stdout, redirect_stderr, contextmanager
 from io import StringIO
 from typing import Optional
-import shutil
 import logging
 import textwrap
-from pathlib import Path
 import warnings
 
+
+class _LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access, so invocations that
+    never reach the network (--help, set api-key, ...) don't pay for importing requests and
+    urllib3. Functions registered with on_import() run once, right after the import."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lazy_module = None
+        self._lazy_hooks = []
+        self._lazy_lock = threading.RLock()
+
+    def on_import(self, func):
+        self._lazy_hooks.append(func)
+        return func
+
+    def _import(self):
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update(vars(module))
+                self._lazy_module = module
+                for func in self._lazy_hooks:
+                    func()
+            return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._import(), attr)
+
+
+requests = _LazyModule("requests")
+urllib3 = _LazyModule("urllib3")
+
 ARGS = None
 TABCOMPLETE = False
-try:
-    import argcomplete
-    TABCOMPLETE = True
-except:
-    # No tab-completion for you
-    pass
+if "_ARGCOMPLETE" in os.environ:  # argcomplete is only needed while the shell asks for completions
+    try:
+        import argcomplete
+        TABCOMPLETE = True
+    except:
+        # No tab-completion for you
+        pass
 
 try:
     from urllib import quote_plus  # Python 2.X
@@ -91,22 +125,115 @@ except:
   }
 
 for key in DIRS.keys():
-  DIRS[key] = path = os.path.join(DIRS[key], APP_NAME)
-  if not os.path.exists(path):
-    os.makedirs(path)
+  DIRS[key] = os.path.join(DIRS[key], APP_NAME)
 
-CACHE_FILE = os.path.join(DIRS['temp'], "gpu_names_cache.json")
-CACHE_DURATION = timedelta(hours=24)
+CACHE_DIR = os.path.join(DIRS['temp'], "responses")
 
 APIKEY_FILE = os.path.join(DIRS['config'], "vast_api_key")
 APIKEY_FILE_HOME = os.path.expanduser("~/.vast_api_key") # Legacy
 
-if os.path.exists(APIKEY_FILE_HOME):
-  shutil.copyfile(APIKEY_FILE_HOME, APIKEY_FILE)
+# One-time setup: create the config and cache directories and copy a legacy ~/.vast_api_key
+# into the config directory. The marker file records that it has been done, so later runs
+# only pay for one stat(). Code that writes into DIRS still creates the directory it needs,
+# in case it has been removed since.
+SETUP_MARKER = os.path.join(DIRS['config'], ".setup-v1")
+
+def _first_run_setup():
+  import shutil
+  for path in DIRS.values():
+    os.makedirs(path, exist_ok=True)
+  if os.path.exists(APIKEY_FILE_HOME):
+    shutil.copyfile(APIKEY_FILE_HOME, APIKEY_FILE)
+  with open(SETUP_MARKER, "w"):
+    pass
+
+if not os.path.exists(SETUP_MARKER):
+  _first_run_setup()
+
+
+# Daemon mode. `vastai serve` keeps one process with the command parsers built and the HTTP
+# connection pool warm, and runs command lines sent to it over a Unix socket. While it is
+# listening, each invocation is forwarded to it (forward_to_daemon) instead of running the
+# command itself, so a script calling the CLI in a loop pays for a small client rather than a
+# full start and a fresh TLS handshake per call. Set VAST_NO_DAEMON=1 to always run locally.
+# The client side lives up here so that `./vast.py` can forward before the rest of this file
+# (command registration, parser) has even been executed.
+#
+# Protocol: one JSON line from the client, {"argv": [...], "cwd": ..., "env": {...}}, then
+# JSON lines from the daemon, {"fd": 1 or 2, "data": ...} for output and finally {"exit": status}.
+# Each connection is served on its own thread, in the client's working directory and with its
+# VAST_API_KEY; commands from clients that differ in either wait for the others to finish.
+SERVE_SOCKET = os.getenv("VAST_SERVE_SOCKET") or os.path.join(DIRS['temp'], "serve.sock")
+
+DAEMON_ENV = ("VAST_API_KEY",)  # client environment variables a forwarded command sees
+
+# run in the client's own process: they prompt on stdin, run local programs, or are the daemon
+DAEMON_LOCAL_COMMANDS = {"serve", "batch", "copy", "transfer credit", "cancel maint", "schedule maint"}
+
+
+def _runs_locally(argv) -> bool:
+    """Whether argv names one of DAEMON_LOCAL_COMMANDS. Judged from the words alone, since the
+    parser doesn't exist yet when the client decides; a false match only costs a local run."""
+    words = [x for x in argv if not x.startswith("-")]
+    return any(w in DAEMON_LOCAL_COMMANDS or " ".join(words[i:i + 2]) in DAEMON_LOCAL_COMMANDS
+               for i, w in enumerate(words))
+
+
+def forward_to_daemon(argv) -> Optional[int]:
+    """Runs argv in the `vastai serve` daemon listening on SERVE_SOCKET, copying its output to
+    this process's stdout/stderr. Returns the command's exit status, or None if there is no
+    daemon (or the command must run locally) and the caller should run it itself."""
+    if os.getenv("VAST_NO_DAEMON") or not os.path.exists(SERVE_SOCKET) or not argv or _runs_locally(argv):
+        return None
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(SERVE_SOCKET)
+    except OSError:
+        conn.close()
+        return None  # stale socket file, daemon gone
+    with conn, conn.makefile("rwb") as f:
+        request = {"argv": list(argv), "cwd": os.getcwd(), "env": {k: os.environ.get(k) for k in DAEMON_ENV}}
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if message.get("fd") == 1 else sys.stderr
+            stream.write(message.get("data", ""))
+            stream.flush()
+    print("vastai: the daemon at {} closed the connection".format(SERVE_SOCKET), file=sys.stderr)
+    return 1
+
+
+_forwarded_early = False
+if __name__ == "__main__" and "_ARGCOMPLETE" not in os.environ:
+    _forwarded_early = True
+    try:
+        _status = forward_to_daemon(sys.argv[1:])
+    except (KeyboardInterrupt, BrokenPipeError):
+        sys.exit(1)
+    if _status is not None:
+        sys.exit(_status)
 
 
 api_key_guard = object()
 
+
+def stored_api_key() -> Optional[str]:
+    """The api key saved by `vastai set api-key`, or None."""
+    if not os.path.exists(APIKEY_FILE):
+        return None
+    with open(APIKEY_FILE, "r") as reader:
+        return reader.read().strip()
+
+
+def default_api_key() -> Optional[str]:
+    """The api key used when --api-key isn't given: VAST_API_KEY if set, else stored_api_key()."""
+    env_key = os.getenv("VAST_API_KEY")
+    return env_key if env_key is not None else stored_api_key()
+
 headers = {}
 
 
@@ -170,84 +297,1301 @@ class hidden_aliases(object):
     def append(self, x):
         self.l.append(x)
 
-def http_get(args, req_url, headers = None, json = None):
-    t = 0.15
-    for i in range(0, args.retry):
-        r = requests.get(req_url, headers=headers, json=json)
-        if (r.status_code == 429):
-            time.sleep(t)
-            t *= 1.5
+# Connection pooling. Every API call used to go through requests.get/put/... directly,
+# which opens (and TLS-handshakes) a brand new connection per call and per retry.
+# Instead all of the http_* helpers share one keep-alive pool per host. The pool is
+# process-wide; each thread gets its own requests.Session (sessions carry mutable
+# cookie state and aren't documented as thread-safe) but every session mounts the
+# same HTTPAdapter, whose urllib3 PoolManager is thread-safe.
+HTTP_POOL_HOSTS = int(os.getenv("VAST_HTTP_POOL_HOSTS", 8))   # number of per-host pools kept
+HTTP_POOL_SIZE  = int(os.getenv("VAST_HTTP_POOL_SIZE", 32))   # keep-alive connections per host
+
+_http_pool = {"adapter": None, "generation": 0}
+_http_pool_lock = threading.Lock()
+_http_local = threading.local()
+
+
+def configure_http_pool(pool_size: int = None, pool_hosts: int = None) -> None:
+    """Resizes the shared connection pool. Sessions pick up the new pool on their next request.
+
+    :param int pool_size: max keep-alive connections kept per host.
+    :param int pool_hosts: max number of distinct hosts to keep pools for.
+    """
+    global HTTP_POOL_SIZE, HTTP_POOL_HOSTS
+    with _http_pool_lock:
+        if pool_size is not None:
+            HTTP_POOL_SIZE = int(pool_size)
+        if pool_hosts is not None:
+            HTTP_POOL_HOSTS = int(pool_hosts)
+        old = _http_pool["adapter"]
+        _http_pool["adapter"] = None
+        _http_pool["generation"] += 1
+    if old is not None:
+        old.close()
+
+
+def _http_adapter():
+    with _http_pool_lock:
+        if _http_pool["adapter"] is None:
+            _http_pool["adapter"] = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_HOSTS,
+                                                                  pool_maxsize=HTTP_POOL_SIZE)
+        return _http_pool["adapter"], _http_pool["generation"]
+
+
+def http_session() -> requests.Session:
+    """Returns the calling thread's keep-alive session, backed by the shared connection pool."""
+    session = getattr(_http_local, "session", None)
+    if session is None or _http_local.generation != _http_pool["generation"]:
+        adapter, generation = _http_adapter()
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_local.session = session
+        _http_local.generation = generation
+    return session
+
+
+@atexit.register
+def _close_http_pool():
+    if _http_pool["adapter"] is not None:
+        _http_pool["adapter"].close()
+
+
+# Timeouts. Every request gets a connect and a read timeout, so a stalled connection
+# fails (and is retried) instead of hanging the command or an exec_with_threads worker.
+# On top of that a command can be given a deadline (--deadline SECONDS, or deadline= in
+# the SDK), stored as an absolute time in args.deadline_at. Timeouts, retry backoff and
+# polling loops are all capped by the time remaining, and DeadlineExceeded is raised
+# once it runs out.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("VAST_CONNECT_TIMEOUT", 10))   # seconds to establish a connection
+HTTP_READ_TIMEOUT    = float(os.getenv("VAST_READ_TIMEOUT", 60))      # seconds to wait between bytes of a response
+
+
+@requests.on_import
+def _define_deadline_exceeded():
+    # DeadlineExceeded subclasses requests' Timeout, so it is created once requests is imported
+    global DeadlineExceeded
+
+    class DeadlineExceeded(requests.exceptions.Timeout):
+        """Raised when an API call or polling loop can't finish before the command's deadline."""
+
+
+def set_deadline(args, seconds: Optional[float]) -> None:
+    """Starts the deadline clock: args.deadline_at = now + seconds (no deadline if seconds is falsy)."""
+    args.deadline_at = time.time() + float(seconds) if seconds else None
+
+
+def deadline_remaining(args) -> Optional[float]:
+    """Seconds left until args.deadline_at, or None if the command has no deadline."""
+    deadline_at = getattr(args, "deadline_at", None)
+    return None if deadline_at is None else deadline_at - time.time()
+
+
+def check_deadline(args, what: str = "request") -> None:
+    """Raises DeadlineExceeded if the command's deadline has passed."""
+    remaining = deadline_remaining(args)
+    if remaining is not None and remaining <= 0:
+        requests._import()  # defines DeadlineExceeded
+        raise DeadlineExceeded("deadline exceeded before {} could complete".format(what))
+
+
+def deadline_cap(args, end_time: float) -> float:
+    """The earlier of end_time (an absolute time, e.g. a polling loop's own timeout) and the deadline."""
+    deadline_at = getattr(args, "deadline_at", None)
+    return end_time if deadline_at is None else min(end_time, deadline_at)
+
+
+def http_timeout(args) -> Tuple[float, float]:
+    """(connect, read) timeouts for the next request, capped by the time left before the deadline."""
+    remaining = deadline_remaining(args)
+    if remaining is None:
+        return HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    check_deadline(args)
+    return min(HTTP_CONNECT_TIMEOUT, remaining), min(HTTP_READ_TIMEOUT, remaining)
+
+
+class RetryPolicy(object):
+    """Decides whether (and after how long) a failed API call is retried.
+
+    Shared by all of the http_* helpers. Retries happen on 429 and 502/503/504 responses and on
+    connection errors, with exponential backoff and full jitter (a random delay between 0 and the
+    backoff cap, so concurrent workers don't retry in lockstep). A Retry-After header, when
+    present, takes precedence over the computed delay.
+
+    Only idempotent calls (GET/DELETE by default) are retried after the server may have seen the
+    request (5xx, connection reset, read timeout). Other calls are retried only on 429 or when
+    the connection could not be established at all. Many API PUTs have side effects (transfer
+    credit, prepay, copy, reboot, create an instance), so PUT is not idempotent by default: the
+    PUTs that only set state to a given value (labels, bids, start/stop) pass idempotent=True,
+    and calls that must never be replayed pass idempotent=False explicitly.
+
+    Retries also draw from a per-process budget: every request deposits budget_ratio tokens
+    (up to budget_min) and every retry spends one, so a storm of 429s from many threads degrades
+    to roughly budget_ratio retries per request instead of multiplying the load.
+
+    :param int max_attempts: total tries per call, including the first. None uses args.retry.
+    :param float base_delay: backoff cap for the first retry, in seconds.
+    :param float max_delay: upper bound on the backoff cap.
+    :param float max_retry_after: longest Retry-After value honoured, in seconds.
+    """
+    RETRY_STATUSES = (429, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "DELETE")
+
+    def __init__(self, max_attempts=None, base_delay=0.3, max_delay=10.0, multiplier=2.0, jitter=True,
+                 respect_retry_after=True, max_retry_after=60.0, retry_statuses=RETRY_STATUSES,
+                 budget_ratio=0.2, budget_min=10):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = tuple(retry_statuses)
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self._budget = float(budget_min)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "retries_status": 0, "retries_connection": 0,
+                      "retry_after_honoured": 0, "budget_exhausted": 0, "gave_up": 0}
+
+    def attempts(self, args) -> int:
+        if self.max_attempts is not None:
+            return max(1, int(self.max_attempts))
+        return max(1, int(getattr(args, "retry", 3)))
+
+    def start(self):
+        """Records a new logical request and refills the retry budget."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["attempts"] += 1
+            self._budget = min(float(self.budget_min), self._budget + self.budget_ratio)
+
+    @staticmethod
+    def _connection_error_kind(exc):
+        """'connect' if the request never reached the server, 'transient' if it may have, else None."""
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return "connect"
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            reason = getattr(exc.args[0], "reason", None) if exc.args else None
+            return "connect" if isinstance(reason, urllib3.exceptions.NewConnectionError) else "transient"
+        if isinstance(exc, requests.exceptions.Timeout):
+            return "transient"
+        aiohttp = sys.modules.get("aiohttp")
+        if aiohttp is not None:
+            if isinstance(exc, aiohttp.ClientConnectorError):
+                return "connect"
+            if isinstance(exc, (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError, aiohttp.ServerTimeoutError)):
+                return "transient"
+        return None
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After") if response is not None else None
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0.0), self.max_retry_after)
+
+    def next_delay(self, method: str, attempt: int, max_attempts: int, response=None, exc=None,
+                   idempotent: bool = None) -> Optional[float]:
+        """Returns how long to sleep before retrying, or None if the call should not be retried.
+
+        :param str method: HTTP method of the call.
+        :param int attempt: number of tries made so far (1 after the first).
+        :param int max_attempts: total tries allowed for this call.
+        :param requests.Response response: the response received, if any.
+        :param Exception exc: the exception raised instead of a response, if any.
+        :param bool idempotent: whether the call may be replayed; None decides by method.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if exc is not None:
+            kind = self._connection_error_kind(exc)
+            retryable = kind == "connect" or (kind == "transient" and idempotent)
+            reason = "retries_connection"
         else:
-            break
-    return r
-
-def http_put(args, req_url, headers, json):
-    t = 0.3
-    for i in range(0, int(args.retry)):
-        r = requests.put(req_url, headers=headers, json=json)
-        if (r.status_code == 429):
-            time.sleep(t)
-            t *= 1.5
+            status = response.status_code
+            retryable = status in self.retry_statuses and (status == 429 or idempotent)
+            reason = "retries_status"
+        if not retryable:
+            return None
+        with self._lock:
+            if attempt >= max_attempts:
+                self.stats["gave_up"] += 1
+                return None
+            if self._budget < 1.0:
+                self.stats["budget_exhausted"] += 1
+                self.stats["gave_up"] += 1
+                return None
+            self._budget -= 1.0
+            self.stats["retries"] += 1
+            self.stats["attempts"] += 1
+            self.stats[reason] += 1
+        retry_after = self._retry_after(response) if self.respect_retry_after else None
+        if retry_after is not None:
+            with self._lock:
+                self.stats["retry_after_honoured"] += 1
+            return retry_after
+        cap = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(0, cap) if self.jitter else cap
+
+    def snapshot(self) -> Dict:
+        """Returns a copy of the counters, for instrumentation."""
+        with self._lock:
+            return dict(self.stats, budget=self._budget)
+
+
+RETRY_POLICY = RetryPolicy()
+
+
+def get_retry_policy(args) -> RetryPolicy:
+    """The policy for a call: args.retry_policy if the caller supplied one, else the process default."""
+    return getattr(args, "retry_policy", None) or RETRY_POLICY
+
+
+class TokenBucket(object):
+    """Client-side token bucket: refills at rate tokens/second up to burst tokens, and every API
+    call takes one token before it is sent, so bulk jobs run at the allowed rate rather than
+    overshooting it and eating 429s.
+
+    The bucket is shared by all threads of the process. If path is given its state lives in that
+    file under an fcntl lock instead, so separate CLI processes (e.g. the self-test workers of
+    vast_machine_tester.py) draw from the same bucket. Platforms without fcntl fall back to a
+    per-process bucket.
+
+    :param float rate: tokens added per second.
+    :param float burst: bucket capacity. Defaults to rate.
+    :param str path: optional state file for sharing the bucket across processes.
+    """
+
+    def __init__(self, rate: float, burst: float = None, path: str = None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self.path = path
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._fd = None
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "penalized": 0}
+
+    def _load(self):
+        if self.path is None:
+            return self._tokens, self._stamp
+        try:
+            import fcntl
+        except ImportError:
+            self.path = None
+            return self._tokens, self._stamp
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        data = os.pread(self._fd, 16, 0)
+        if len(data) == 16:
+            return struct.unpack("dd", data)
+        return self.burst, time.time()
+
+    def _store(self, tokens, stamp):
+        if self.path is None:
+            self._tokens, self._stamp = tokens, stamp
+            return
+        import fcntl
+        os.pwrite(self._fd, struct.pack("dd", tokens, stamp), 0)
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available. Returns 0 on success, else the seconds to wait."""
+        with self._lock:
+            tokens, stamp = self._load()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - stamp) * self.rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+                self.stats["acquired"] += 1
+            else:
+                wait = (1.0 - tokens) / self.rate
+            self._store(tokens, now)
+            return wait
+
+    def acquire(self) -> float:
+        """Blocks until a token is available. Returns the time spent waiting."""
+        waited = 0.0
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            waited += wait
+            wait = self.try_acquire()
+        self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self) -> float:
+        """Like acquire, but sleeps on the event loop instead of blocking it."""
+        import asyncio
+        waited = 0.0
+        wait = self.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+            wait = self.try_acquire()
+        self._record_wait(waited)
+        return waited
+
+    def _record_wait(self, waited):
+        if waited:
+            with self._lock:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+
+    def penalize(self):
+        """Empties the bucket. Called when the server answers 429 or sends Retry-After, i.e.
+        the rate is too high."""
+        with self._lock:
+            tokens, stamp = self._load()
+            self._store(min(tokens, 0.0), time.time())
+            self.stats["penalized"] += 1
+
+
+# Per endpoint class rate limits, as (tokens/second, burst), applied from the first call of
+# every process. Override with e.g.
+#   VAST_RATE_LIMITS="search=1:3,mutation=5,logs=0.5,default=10"
+# ("off" disables limiting) or configure_rate_limits(). VAST_RATE_LIMIT_SHARED=1 shares the
+# buckets between processes through state files in the cache dir.
+RATE_LIMITS = {
+    "search":   (2.0, 4.0),     # offer/template/benchmark searches
+    "mutation": (5.0, 10.0),    # create/start/stop/destroy/label/... instances
+    "logs":     (1.0, 3.0),     # log requests and remote command execution
+    "default":  (10.0, 20.0),
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def configure_rate_limits(limits: Dict = None, shared: bool = None) -> None:
+    """Replaces the rate limits (dict of endpoint class -> (rate, burst), or None to disable a class)
+    and/or turns cross-process sharing on or off. Existing buckets are discarded."""
+    if limits is not None:
+        RATE_LIMITS.update(limits)
+    if shared is not None:
+        os.environ["VAST_RATE_LIMIT_SHARED"] = "1" if shared else "0"
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+
+
+def _load_rate_limits_env():
+    spec = os.getenv("VAST_RATE_LIMITS")
+    if not spec:
+        return
+    if spec.strip().lower() in ("0", "off", "none"):
+        for k in list(RATE_LIMITS):
+            RATE_LIMITS[k] = None
+        return
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        if value.strip().lower() in ("0", "off", "none"):
+            RATE_LIMITS[name.strip()] = None
         else:
-            break
-    return r
-
-def http_post(args, req_url, headers, json={}):
-    t = 0.3
-    for i in range(0, int(args.retry)):
-        #if (args.explain):
-        #    print(req_url)
-        r = requests.post(req_url, headers=headers, json=json)
-        if (r.status_code == 429):
-            time.sleep(t)
-            t *= 1.5
+            RATE_LIMITS[name.strip()] = (float(rate), float(burst) if burst else None)
+
+_load_rate_limits_env()
+
+
+def endpoint_class(method: str, req_url: str) -> str:
+    """Buckets an API call into one of the RATE_LIMITS classes."""
+    path = req_url.split("?", 1)[0]
+    path = path[path.find("/api/v0") + len("/api/v0"):] if "/api/v0" in path else path
+    if path.startswith(("/bundles", "/search/", "/template/", "/benchmarks", "/invoices")):
+        return "search"
+    if "request_logs" in path or path.startswith("/instances/command/"):
+        return "logs"
+    if method != "GET" and path.startswith(("/instances", "/asks/", "/launch_instance/")):
+        return "mutation"
+    return "default"
+
+
+def rate_limiter(method: str, req_url: str) -> Optional[TokenBucket]:
+    """The shared bucket for an API call, or None if its class isn't limited."""
+    name = endpoint_class(method, req_url)
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            limit = RATE_LIMITS.get(name, RATE_LIMITS.get("default"))
+            bucket = None
+            if limit:
+                path = None
+                if os.getenv("VAST_RATE_LIMIT_SHARED", "0") not in ("", "0"):
+                    path = os.path.join(DIRS['temp'], "ratelimit-{}.state".format(name))
+                bucket = TokenBucket(limit[0], limit[1], path=path)
+            _rate_limiters[name] = bucket
+        return _rate_limiters[name]
+
+
+def _fresh_json(obj):
+    """Copies a parsed JSON body down to its rows (the top-level container, the lists in it and
+    the dicts in those), so callers can add or replace fields without touching the cached body.
+    Deeper values are shared. Costs a small fraction of re-parsing the body."""
+    def rows(v):
+        if type(v) is list:
+            return [dict(x) if type(x) is dict else x for x in v]
+        return dict(v) if type(v) is dict else v
+    if type(obj) is dict:
+        return {k: rows(v) for k, v in obj.items()}
+    return rows(obj)
+
+
+class _ValidatorEntry(object):
+    def __init__(self, r: requests.Response):
+        self.content = r.content
+        self.headers = requests.structures.CaseInsensitiveDict(r.headers)
+        self.encoding = r.encoding
+        self.etag = r.headers.get("ETag")
+        self.last_modified = r.headers.get("Last-Modified")
+        self._parsed = None
+
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = json.loads(self.content.decode(self.encoding or "utf-8"))
+        return self._parsed
+
+
+@requests.on_import
+def _define_cached_response():
+    global _CachedResponse
+
+    class _CachedResponse(requests.Response):
+        """A response whose body is held by the validator cache. json() parses the body once per
+        cache entry and returns a copy of it (see _fresh_json)."""
+        _entry = None
+
+        def json(self, **kwargs):
+            if kwargs:
+                return super().json(**kwargs)
+            return _fresh_json(self._entry.parsed())
+
+
+class ValidatorCache(object):
+    """Conditional GET cache: remembers the ETag / Last-Modified validators and body of recent
+    GET responses and revalidates them with If-None-Match / If-Modified-Since. A 304 is turned
+    back into the cached 200, so polling an unchanged endpoint costs a header round trip and no
+    JSON parsing.
+
+    Entries are keyed by the URL without its api_key parameter plus a hash of the credential
+    (api_key or Authorization header), so one account's cached body is never replayed to another.
+
+    :param int max_entries: LRU capacity; 0 disables the cache.
+    :param int max_body: bodies larger than this many bytes are not cached.
+    """
+
+    def __init__(self, max_entries: int = 64, max_body: int = 8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_body = max_body
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def key(req_url: str, headers=None) -> str:
+        import hashlib
+        from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+        parts = urlsplit(req_url)
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        credential = [v for k, v in params if k == "api_key"] + [(headers or {}).get("Authorization", "")]
+        query = urlencode([(k, v) for k, v in params if k != "api_key"])
+        digest = hashlib.sha256("\0".join(credential).encode()).hexdigest()[:16]
+        return digest + " " + urlunsplit(parts._replace(query=query))
+
+    def conditional_headers(self, key: str, headers=None):
+        """Returns (headers, entry): headers plus the validators of the cached entry for key, if any."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            return headers, None
+        headers = dict(headers or {})
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers, entry
+
+    def update(self, key: str, entry: Optional[_ValidatorEntry], r: requests.Response) -> requests.Response:
+        """Handles the response to a (possibly conditional) GET: a 304 is answered from entry,
+        a cacheable 200 is stored. Returns the response to hand to the caller."""
+        if r.status_code == 304 and entry is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return self._replay(entry, r)
+        with self._lock:
+            self.stats["misses"] += 1
+        if r.status_code != 200 or not (r.headers.get("ETag") or r.headers.get("Last-Modified")) \
+                or len(r.content) > self.max_body or self.max_entries <= 0:
+            return r
+        entry = _ValidatorEntry(r)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return self._replay(entry, r)
+
+    @staticmethod
+    def _replay(entry: _ValidatorEntry, r: requests.Response) -> requests.Response:
+        cached = _CachedResponse()
+        cached._entry = entry
+        cached.status_code = 200
+        cached.reason = "OK"
+        cached.headers = requests.structures.CaseInsensitiveDict(entry.headers)
+        if r.status_code == 304:
+            cached.headers.update(r.headers)  # a 304 carries the current validators and caching headers
+            cached.headers["Content-Length"] = str(len(entry.content))
+        cached.encoding = entry.encoding
+        cached._content = entry.content
+        cached._content_consumed = True
+        cached.raw = r.raw
+        cached.url = r.url
+        cached.request = r.request
+        cached.elapsed = r.elapsed
+        cached.history = r.history
+        cached.from_cache = r.status_code == 304
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> Dict:
+        """Returns a copy of the counters, for instrumentation."""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
+
+
+VALIDATOR_CACHE = ValidatorCache(max_entries=int(os.getenv("VAST_HTTP_CACHE_SIZE", 64)))
+
+
+def authorized(args, headers=None) -> Optional[Dict]:
+    """headers plus the Authorization for args.api_key. It's added per call rather than kept in
+    the module-level headers because the serve daemon runs commands with different keys at once."""
+    api_key = getattr(args, "api_key", None)
+    if not api_key or api_key is api_key_guard:
+        return headers
+    return dict(headers or {}, Authorization="Bearer " + api_key)
+
+
+def http_request(method: str, args, req_url: str, headers=None, json=None, stream=False,
+                 idempotent: bool = None) -> requests.Response:
+    """Sends one API call through the shared session, retrying according to the retry policy.
+
+    Each attempt has a connect and read timeout. If the command has a deadline, no retry is
+    scheduled past it: the last response is returned, or the last error re-raised as
+    DeadlineExceeded. Plain GETs are revalidated against VALIDATOR_CACHE.
+
+    :param str method: one of GET, PUT, POST, DELETE.
+    :param bool stream: return as soon as the headers arrive, leaving the body to be read
+                        incrementally (r.iter_content, iter_json_array). Close the response when done.
+    :param bool idempotent: whether the call may be replayed once the server may have seen it
+                            (see RetryPolicy); None decides by method (PUT is not).
+    :rtype requests.Response:
+    """
+    headers = authorized(args, headers)
+    policy = get_retry_policy(args)
+    max_attempts = policy.attempts(args)
+    limiter = rate_limiter(method, req_url)
+    cache = VALIDATOR_CACHE if method == "GET" and not stream and json is None and VALIDATOR_CACHE.max_entries > 0 else None
+    if cache is not None:
+        cache_key = cache.key(req_url, headers)
+        headers, cache_entry = cache.conditional_headers(cache_key, headers)
+    policy.start()
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            r = http_session().request(method, req_url, headers=headers, json=json, timeout=http_timeout(args), stream=stream)
+        except DeadlineExceeded:
+            raise
+        except requests.exceptions.RequestException as e:
+            delay = policy.next_delay(method, attempt, max_attempts, exc=e, idempotent=idempotent)
+            if delay is None:
+                raise
+            remaining = deadline_remaining(args)
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded("deadline exceeded after {} attempt(s): {}".format(attempt, e)) from e
         else:
-            break
-    return r
+            if limiter is not None and (r.status_code == 429 or "Retry-After" in r.headers):
+                limiter.penalize()
+            delay = policy.next_delay(method, attempt, max_attempts, response=r, idempotent=idempotent)
+            remaining = deadline_remaining(args)
+            if delay is None or (remaining is not None and delay >= remaining):
+                return r if cache is None else cache.update(cache_key, cache_entry, r)
+            r.close()  # give a streamed connection back to the pool before retrying
+        time.sleep(delay)
+
+
+def http_get(args, req_url, headers = None, json = None, stream = False):
+    return http_request("GET", args, req_url, headers=headers, json=json, stream=stream)
+
+def http_put(args, req_url, headers, json, stream = False, idempotent = None):
+    return http_request("PUT", args, req_url, headers=headers, json=json, stream=stream, idempotent=idempotent)
+
+def http_post(args, req_url, headers, json={}, stream = False):
+    return http_request("POST", args, req_url, headers=headers, json=json, stream=stream)
 
 def http_del(args, req_url, headers, json={}):
-    t = 0.3
-    for i in range(0, int(args.retry)):
-        r = requests.delete(req_url, headers=headers, json=json)
-        if (r.status_code == 429):
-            time.sleep(t)
-            t *= 1.5
-        else:
-            break
-    return r
+    return http_request("DELETE", args, req_url, headers=headers, json=json)
+
+
+# Compressed encodings this client can decode (gzip and deflate always, br/zstd when the
+# optional brotli/zstandard packages are installed). Sent explicitly on large responses.
+@urllib3.on_import
+def _define_accept_encoding():
+    global HTTP_ACCEPT_ENCODING
+    HTTP_ACCEPT_ENCODING = urllib3.util.request.ACCEPT_ENCODING
+
+
+def __getattr__(name):
+    # vast.DeadlineExceeded & co. for importers: these are defined by the on_import hooks above
+    if name in ("DeadlineExceeded", "_CachedResponse"):
+        requests._import()
+    elif name == "HTTP_ACCEPT_ENCODING":
+        urllib3._import()
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    return globals()[name]
+
+
+class _JsonStreamReader(object):
+    """Cursor over JSON text that arrives in chunks. Only the unconsumed tail is kept in memory."""
+    _ws = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character without consuming it."""
+        while True:
+            self.pos = self._ws.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON stream")
+
+    def expect(self, ch: str) -> None:
+        if self.peek() != ch:
+            raise ValueError("expected {!r} in JSON stream, got {!r}".format(ch, self.buf[self.pos]))
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete JSON value, reading more chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number cut off by the end of the buffer ("1" of "1.5") also decodes, so a
+                # value only counts as complete once the delimiter after it has arrived
+                if self.eof or (end < len(self.buf) and self.buf[end] in " \t\n\r,:]}"):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_array(chunks, key: str = None):
+    """Incrementally decodes a JSON array and yields its elements as soon as each is complete.
+
+    The array is either the whole document or, if key is given, the value of that key in the
+    top-level object (other keys are decoded and skipped). Memory use is bounded by the largest
+    element rather than the whole document.
+
+    :param chunks: iterable of str (or utf-8 bytes) pieces of the document, e.g. r.iter_content().
+    :param str key: name of the array in the top-level object.
+    """
+    def text(chunks):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in chunks:
+            yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        yield decoder.decode(b"", final=True)
+
+    reader = _JsonStreamReader(text(chunks))
+    if key is not None:
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                raise ValueError("no {!r} in JSON object".format(key))
+            name = reader.value()
+            reader.expect(":")
+            if name == key:
+                break
+            reader.value()
+            if reader.peek() == ",":
+                reader.pos += 1
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.value()
+        ch = reader.peek()
+        reader.pos += 1
+        if ch == "]":
+            return
+        if ch != ",":
+            raise ValueError("expected ',' or ']' in JSON array, got {!r}".format(ch))
+
+
+# asyncio transport. async_http_get/put/post/del mirror the helpers above but are
+# coroutines, so one event loop can keep hundreds of requests in flight. When aiohttp
+# is installed requests are made natively on the loop; otherwise each request is handed
+# to the synchronous helper in a worker thread (still sharing the keep-alive pool).
+# Either way at most ASYNC_HTTP_CONCURRENCY requests are in flight per event loop, and
+# the result is a regular requests.Response so callers don't care which path ran.
+ASYNC_HTTP_CONCURRENCY = int(os.getenv("VAST_ASYNC_CONCURRENCY", 256))
+
+_async_loop_state = {}  # event loop -> {"semaphore": ..., "session": ...}
+
+
+def _async_state():
+    import asyncio
+    loop = asyncio.get_running_loop()
+    state = _async_loop_state.get(loop)
+    if state is None:
+        for old in [l for l in _async_loop_state if l.is_closed()]:
+            del _async_loop_state[old]
+        state = _async_loop_state[loop] = {"semaphore": asyncio.Semaphore(ASYNC_HTTP_CONCURRENCY), "session": None}
+    return state
+
+
+def _aiohttp_session(state):
+    try:
+        import aiohttp
+    except ImportError:
+        return None
+    if state["session"] is None or state["session"].closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_HTTP_CONCURRENCY, limit_per_host=0)
+        state["session"] = aiohttp.ClientSession(connector=connector)
+    return state["session"]
+
+
+async def close_async_http():
+    """Closes the aiohttp session (if any) of the running event loop. Call before the loop exits."""
+    state = _async_state()
+    if state["session"] is not None:
+        await state["session"].close()
+        state["session"] = None
+
+
+async def async_http_request(method: str, args, req_url: str, headers=None, json=None,
+                             idempotent: bool = None) -> requests.Response:
+    """Coroutine version of http_request, retrying according to the same retry policy.
+
+    :param str method: one of GET, PUT, POST, DELETE.
+    :param bool idempotent: as for http_request.
+    :rtype requests.Response:
+    """
+    import asyncio
+    state = _async_state()
+    async with state["semaphore"]:
+        session = _aiohttp_session(state)
+        if session is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: http_request(method, args, req_url, headers=headers, json=json,
+                                                                          idempotent=idempotent))
+
+        import aiohttp
+        requests._import()  # results are handed back as requests.Response; also defines DeadlineExceeded
+        headers = authorized(args, headers)
+        policy = get_retry_policy(args)
+        max_attempts = policy.attempts(args)
+        limiter = rate_limiter(method, req_url)
+        cache = VALIDATOR_CACHE if method == "GET" and json is None and VALIDATOR_CACHE.max_entries > 0 else None
+        if cache is not None:
+            cache_key = cache.key(req_url, headers)
+            headers, cache_entry = cache.conditional_headers(cache_key, headers)
+        policy.start()
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter is not None:
+                await limiter.acquire_async()
+            connect, read = http_timeout(args)
+            remaining = deadline_remaining(args)
+            timeout = aiohttp.ClientTimeout(total=remaining, sock_connect=connect, sock_read=read)
+            try:
+                async with session.request(method, req_url, headers=headers, json=json, timeout=timeout) as resp:
+                    r = requests.Response()
+                    r.status_code = resp.status
+                    r.reason = resp.reason
+                    r.url = str(resp.url)
+                    r.headers = requests.structures.CaseInsensitiveDict(resp.headers)
+                    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+                    r._content = await resp.read()
+            except asyncio.TimeoutError as e:
+                # aiohttp reports timeouts as bare asyncio.TimeoutError; treat them like requests' Timeout
+                exc = requests.exceptions.Timeout("{} {} timed out".format(method, req_url))
+                delay = policy.next_delay(method, attempt, max_attempts, exc=exc, idempotent=idempotent)
+                remaining = deadline_remaining(args)
+                if remaining is not None and (remaining <= 0 or (delay is not None and delay >= remaining)):
+                    raise DeadlineExceeded("deadline exceeded after {} attempt(s)".format(attempt)) from e
+                if delay is None:
+                    raise exc from e
+            except aiohttp.ClientError as e:
+                delay = policy.next_delay(method, attempt, max_attempts, exc=e, idempotent=idempotent)
+                if delay is None:
+                    raise
+                remaining = deadline_remaining(args)
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded("deadline exceeded after {} attempt(s): {}".format(attempt, e)) from e
+            else:
+                if limiter is not None and (r.status_code == 429 or "Retry-After" in r.headers):
+                    limiter.penalize()
+                delay = policy.next_delay(method, attempt, max_attempts, response=r, idempotent=idempotent)
+                remaining = deadline_remaining(args)
+                if delay is None or (remaining is not None and delay >= remaining):
+                    return r if cache is None else cache.update(cache_key, cache_entry, r)
+            await asyncio.sleep(delay)
+
+
+async def async_http_get(args, req_url, headers = None, json = None):
+    return await async_http_request("GET", args, req_url, headers=headers, json=json)
+
+async def async_http_put(args, req_url, headers, json, idempotent = None):
+    return await async_http_request("PUT", args, req_url, headers=headers, json=json, idempotent=idempotent)
+
+async def async_http_post(args, req_url, headers, json={}):
+    return await async_http_request("POST", args, req_url, headers=headers, json=json)
+
+async def async_http_del(args, req_url, headers, json={}):
+    return await async_http_request("DELETE", args, req_url, headers=headers, json=json)
+
+
+# On-disk cache for slow-changing reads (GPU names, templates, benchmarks, cloud connections),
+# shared by every CLI invocation. Entries are small JSON files under CACHE_DIR written with
+# a temp file + os.replace, so readers never see a partial file, and a per-entry flock makes
+# concurrent invocations that miss the same entry fetch it only once. The directory is kept
+# under CACHE_MAX_BYTES by evicting the least recently used entries. --refresh skips the
+# cached copy (but stores the new one), --no-cache bypasses the cache entirely.
+CACHE_TTLS = {                  # seconds an entry is served without refetching, per endpoint
+    "gpu_names":   24 * 3600,
+    "templates":   15 * 60,
+    "benchmarks":  60 * 60,
+    "connections": 5 * 60,
+    "completion":  60,          # tab-completion index, see complete_from_index
+}
+CACHE_MAX_BYTES = int(os.getenv("VAST_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+
+@contextmanager
+def _flock(lock_path: str, shared: bool = False):
+    """Holds an exclusive (or shared) fcntl lock on lock_path, which is created if needed, so
+    that separate CLI processes take turns. Does nothing on platforms without fcntl."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class DiskCache(object):
+    """Size-bounded LRU cache of JSON values on disk, with a TTL per namespace.
+
+    :param str path: cache directory.
+    :param int max_bytes: total size the entries are kept under.
+    :param dict ttls: namespace -> TTL in seconds (default CACHE_TTLS).
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, ttls: Dict = None):
+        self.path = path
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttls = CACHE_TTLS if ttls is None else ttls
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._flush_registered = False
+
+    def _file(self, key: str) -> str:
+        import hashlib
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+
+    def _flock(self, lock_path: str):
+        return _flock(lock_path)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.stats[name] += n
+            if not self._flush_registered:
+                self._flush_registered = True
+                atexit.register(self.flush_stats)
+
+    def _read(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._file(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("key") == key else None
+
+    def get(self, namespace: str, key: str):
+        """Returns (True, value) for a fresh entry, else (False, None)."""
+        path = self._file(key)
+        entry = self._read(key)
+        if entry is None or time.time() - entry.get("stored_at", 0) >= self.ttls.get(namespace, 0):
+            return False, None
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock
+        except OSError:
+            pass
+        return True, entry["value"]
+
+    def peek(self, namespace: str, key: str):
+        """Returns (value, age in seconds) of the entry for key, fresh or stale, else (None, None).
+        Doesn't count as a use for LRU eviction."""
+        entry = self._read(key)
+        if entry is None:
+            return None, None
+        return entry["value"], time.time() - entry.get("stored_at", 0)
+
+    def update(self, namespace: str, key: str, func):
+        """Stores func(current value or None) for key, holding the entry's lock so concurrent
+        read-modify-write updates don't lose each other's changes. Returns the new value."""
+        with self._flock(self._file(key)[:-len(".json")] + ".lock"):
+            value = func(self.peek(namespace, key)[0])
+            self.put(namespace, key, value)
+        return value
+
+    def put(self, namespace: str, key: str, value) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(key)
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "w") as f:
+            json.dump({"namespace": namespace, "key": key, "stored_at": time.time(), "value": value}, f)
+        os.replace(tmp, path)
+        self._count("stores")
+        self._evict()
+
+    def fetch(self, namespace: str, key: str, fetch, mode: str = "on"):
+        """Returns the cached value for key, calling fetch() to (re)fill it when missing or stale.
+
+        :param str mode: 'on', 'refresh' (always fetch, then store) or 'off' (just fetch).
+        """
+        if mode == "off":
+            return fetch()
+        if mode != "refresh":
+            found, value = self.get(namespace, key)
+            if found:
+                self._count("hits")
+                return value
+        with self._flock(self._file(key)[:-len(".json")] + ".lock"):
+            if mode != "refresh":
+                found, value = self.get(namespace, key)  # filled by another process while we waited
+                if found:
+                    self._count("hits")
+                    return value
+            self._count("misses")
+            value = fetch()
+            if value is not None:
+                self.put(namespace, key, value)
+            return value
+
+    def entries(self) -> List[Dict]:
+        """Metadata of every entry: namespace, size, age, fresh."""
+        result = []
+        now = time.time()
+        for name in os.listdir(self.path) if os.path.isdir(self.path) else []:
+            if not name.endswith(".json") or name == "stats.json":
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+                st = os.stat(path)
+            except (OSError, ValueError):
+                continue
+            age = now - entry.get("stored_at", 0)
+            result.append({"namespace": entry.get("namespace"), "size": st.st_size, "age": age, "used": st.st_mtime,
+                           "fresh": age < self.ttls.get(entry.get("namespace"), 0), "path": path})
+        return result
+
+    def _remove(self, path: str) -> None:
+        for p in (path, path[:-len(".json")] + ".lock"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def _size(self) -> int:
+        """Total size of the entry files, from directory stats alone (no file is opened)."""
+        total = 0
+        try:
+            with os.scandir(self.path) as it:
+                for d in it:
+                    if d.name.endswith(".json") and d.name != "stats.json":
+                        try:
+                            total += d.stat().st_size
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        return total
+
+    def _evict(self) -> None:
+        # cheap check on every store; entries are only read once the cache is actually over its bound
+        if self._size() <= self.max_bytes:
+            return
+        with self._flock(os.path.join(self.path, ".lock")):
+            entries = self.entries()
+            total = builtins.sum(e["size"] for e in entries)
+            if total <= self.max_bytes:
+                return
+            # stale entries go first, then the least recently used
+            for e in sorted(entries, key=lambda e: (e["fresh"], e["used"])):
+                if total <= self.max_bytes:
+                    break
+                self._remove(e["path"])
+                total -= e["size"]
+                self._count("evictions")
+
+    def clear(self, namespace: str = None) -> int:
+        """Removes all entries (of one namespace, if given). Returns the number removed."""
+        removed = 0
+        with self._flock(os.path.join(self.path, ".lock")):
+            for e in self.entries():
+                if namespace is None or e["namespace"] == namespace:
+                    self._remove(e["path"])
+                    removed += 1
+        return removed
+
+    def load_stats(self) -> Dict:
+        """Counters accumulated by all invocations so far, including this one."""
+        try:
+            with open(os.path.join(self.path, "stats.json"), "r") as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        with self._lock:
+            return {k: totals.get(k, 0) + v for k, v in self.stats.items()}
+
+    def flush_stats(self) -> None:
+        """Adds this process's counters to the persistent totals in stats.json."""
+        if not any(self.stats.values()) or not os.path.isdir(self.path):
+            return
+        with self._flock(os.path.join(self.path, ".lock")):
+            totals = self.load_stats()
+            tmp = os.path.join(self.path, "stats.json.{}.tmp".format(os.getpid()))
+            with open(tmp, "w") as f:
+                json.dump(totals, f)
+            os.replace(tmp, os.path.join(self.path, "stats.json"))
+            with self._lock:
+                self.stats = dict.fromkeys(self.stats, 0)
+
+
+RESPONSE_CACHE = DiskCache(CACHE_DIR)
+
+
+def cache_mode(args) -> str:
+    """'off' for --no-cache, 'refresh' for --refresh, else 'on'."""
+    if getattr(args, "no_cache", False):
+        return "off"
+    return "refresh" if getattr(args, "refresh", False) else "on"
+
+
+def cached_get_json(args, namespace: str, req_url: str, req_headers=None, fetch=None):
+    """Parsed body of GET req_url, served from RESPONSE_CACHE while younger than CACHE_TTLS[namespace].
+
+    Entries are keyed like the validator cache: the URL without its api_key, plus a hash of the
+    credential. fetch, if given, replaces the plain http_get + raise_for_status + json() and
+    sends req_headers only, so args' api key isn't part of the key; a fetch that returns None
+    is not cached.
+    """
+    def default_fetch():
+        r = http_get(args, req_url, headers=req_headers)
+        r.raise_for_status()
+        return r.json()
+    key = namespace + " " + ValidatorCache.key(req_url, req_headers if fetch else authorized(args, req_headers))
+    return RESPONSE_CACHE.fetch(namespace, key, fetch or default_fetch, cache_mode(args))
 
 
 def load_permissions_from_file(file_path):
     with open(file_path, 'r') as file:
         return json.load(file)
 
+# Tab-completion index. show instances, show machines and show ssh-keys record the ids (and
+# instance labels) they return in RESPONSE_CACHE, per server and api key, so completing an id
+# reads one small file instead of calling the API on every TAB. A missing or stale index is
+# answered from whatever is on disk while a detached process refreshes it, at most once per
+# COMPLETION_REFRESH_INTERVAL; completion never waits on the network.
+COMPLETION_SOURCES = {          # index field -> command that refreshes it
+    "instance_ids":         "instances",
+    "instance_machine_ids": "instances",
+    "instance_labels":      "instances",
+    "machine_ids":          "machines",
+    "ssh_key_ids":          "ssh_keys",
+}
+COMPLETION_REFRESH_INTERVAL = 15    # seconds between background refreshes of one source
+COMPLETION_REFRESH_DEADLINE = 30    # seconds a background refresh may take
+
+
+def _completion_key(args) -> str:
+    import hashlib
+    digest = hashlib.sha256((getattr(args, "api_key", None) or "").encode()).hexdigest()[:16]
+    return "completion {} {}".format(digest, getattr(args, "url", None) or server_url_default)
+
+
+def update_completion_index(args, **fields) -> None:
+    """Replaces the given fields (lists of ids or labels, see COMPLETION_SOURCES) in the
+    completion index of args' account. Best effort: a cache that can't be written is ignored."""
+    if cache_mode(args) == "off":
+        return
+    fields = {k: sorted({str(v) for v in values if v not in (None, "")}) for k, values in fields.items()}
+
+    def merge(index):
+        index = dict(index or {})
+        index.update(fields)
+        return index
+    try:
+        RESPONSE_CACHE.update("completion", _completion_key(args), merge)
+    except (OSError, ValueError):
+        pass
+
+
+def refresh_completion_index(url: str, source: str) -> None:
+    """Refetches one source of the completion index ('instances', 'machines' or 'ssh_keys'), or
+    the cached GPU names ('gpu_names'). Runs in the detached process started by
+    complete_from_index and complete_gpu_name; the api key comes from VAST_API_KEY."""
+    args = argparse.Namespace(url=url, api_key=os.getenv("VAST_API_KEY") or None, retry=1, raw=True,
+                              explain=False, quiet=False, no_cache=False, refresh=False)
+    set_deadline(args, COMPLETION_REFRESH_DEADLINE)
+    fetch = {"instances": show__instances, "machines": show__machines, "ssh_keys": show__ssh_keys,
+             "gpu_names": _get_gpu_names}[source]
+    try:
+        fetch(args)
+    except requests.exceptions.RequestException:
+        pass
+
+
+def _start_completion_refresh(args, source: str) -> None:
+    marker = os.path.join(CACHE_DIR, "completion-refresh-" + source)
+    try:
+        if time.time() - os.path.getmtime(marker) < COMPLETION_REFRESH_INTERVAL:
+            return
+    except OSError:
+        pass
+    try:
+        import subprocess
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(marker, "w"):
+            pass
+        env = {k: v for k, v in os.environ.items() if not k.startswith(("_ARGCOMPLETE", "COMP_"))}
+        env["VAST_API_KEY"] = getattr(args, "api_key", None) or ""
+        code = "import sys; sys.path.insert(0, {!r}); import vast; vast.refresh_completion_index({!r}, {!r})".format(
+            os.path.dirname(os.path.abspath(__file__)), getattr(args, "url", None) or server_url_default, source)
+        subprocess.Popen([sys.executable, "-c", code], env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
+    except OSError:
+        pass
+
+
+def complete_from_index(field: str, parsed_args) -> List[str]:
+    """Completions for field of the completion index, served from disk. Starts a background
+    refresh when the index lacks the field or is older than CACHE_TTLS['completion']."""
+    args = argparse.Namespace(**vars(parsed_args)) if parsed_args is not None else argparse.Namespace()
+    if getattr(args, "api_key", None) is api_key_guard or not hasattr(args, "api_key"):
+        args.api_key = default_api_key()
+    index, age = RESPONSE_CACHE.peek("completion", _completion_key(args))
+    index = index or {}
+    if field not in index or age >= RESPONSE_CACHE.ttls.get("completion", 0):
+        _start_completion_refresh(args, COMPLETION_SOURCES[field])
+    return index.get(field, [])
+
+
 def complete_instance_machine(prefix=None, action=None, parser=None, parsed_args=None):
-  return show__instances(ARGS, {'internal': True, 'field': 'machine_id'})
+  return complete_from_index("instance_machine_ids", parsed_args) + complete_from_index("machine_ids", parsed_args)
 
 def complete_instance(prefix=None, action=None, parser=None, parsed_args=None):
-  return show__instances(ARGS, {'internal': True, 'field': 'id'})
+  return complete_from_index("instance_ids", parsed_args)
+
+def complete_instance_label(prefix=None, action=None, parser=None, parsed_args=None):
+  return complete_from_index("instance_labels", parsed_args)
+
+def complete_ssh_key_id(prefix=None, action=None, parser=None, parsed_args=None):
+  return complete_from_index("ssh_key_ids", parsed_args)
 
 def complete_sshkeys(prefix=None, action=None, parser=None, parsed_args=None):
+  from pathlib import Path
   return [str(m) for m in Path.home().joinpath('.ssh').glob('*.pub')]
 
+def complete_gpu_name(prefix=None, action=None, parser=None, parsed_args=None):
+  """GPU names from the on-disk cache, stale or not; a missing or stale list is refetched in
+  the background, so completion never waits on the network (a cold cache completes nothing)."""
+  names, age = RESPONSE_CACHE.peek("gpu_names", _gpu_names_cache_key())
+  if names is None or age >= RESPONSE_CACHE.ttls.get("gpu_names", 0):
+    args = argparse.Namespace(**vars(parsed_args)) if parsed_args is not None else argparse.Namespace()
+    args.api_key = None  # the GPU names don't need one
+    _start_completion_refresh(args, "gpu_names")
+  return _format_gpu_names(names) if names else []
+
 class apwrap(object):
+    """argparse wrapper behind @parser.command.
+
+    Commands are registered lazily: the decorator only records each command's name, aliases,
+    arguments and help, and the argparse subparser for it is built the first time it is
+    needed. parse_args() builds just the command(s) named on the command line; the full
+    tree is built for top-level help, unknown commands, tab completion and the SDK
+    (anything that reads subparsers_). Global options added with add_argument() are
+    applied to each subparser as it is built.
+    """
     def __init__(self, *args, **kwargs):
         kwargs["formatter_class"] = argparse.RawDescriptionHelpFormatter
         self.parser = argparse.ArgumentParser(*args, **kwargs)
         self.parser.set_defaults(func=self.fail_with_help)
-        self.subparsers_ = None
+        self._subparsers = None
         self.subparser_objs = []
         self.added_help_cmd = False
         self.post_setup = []
         self.verbs = set()
         self.objs = set()
+        self.pending = OrderedDict()  # command name -> recorded command() call, not yet built
+        self.command_names = {}       # command name or alias -> command name
+        self.global_args = []         # (args, kwargs) of add_argument calls, for subparsers built later
 
     def fail_with_help(self, *a, **kw):
+        self.materialize_all()
         self.parser.print_help(sys.stderr)
         raise SystemExit
 
     def add_argument(self, *a, **kw):
         if not kw.get("parent_only"):
+            self.global_args.append((a, kw))
             for x in self.subparser_objs:
                 try:
                     x.add_argument(*a, **kw)
@@ -257,11 +1601,17 @@ class apwrap(object):
         return self.parser.add_argument(*a, **kw)
 
     def subparsers(self, *a, **kw):
-        if self.subparsers_ is None:
+        if self._subparsers is None:
             kw["metavar"] = "command"
             kw["help"] = "command to run. one of:"
-            self.subparsers_ = self.parser.add_subparsers(*a, **kw)
-        return self.subparsers_
+            self._subparsers = self.parser.add_subparsers(*a, **kw)
+        return self._subparsers
+
+    @property
+    def subparsers_(self):
+        """The argparse subparsers action with every command built."""
+        self.materialize_all()
+        return self._subparsers
 
     def get_name(self, verb, obj):
         if obj:
@@ -292,32 +1642,10 @@ class apwrap(object):
                 aliases_transformed.append(self.get_name(verb, obj))
 
             kwargs["formatter_class"] = argparse.RawDescriptionHelpFormatter
-          
-            sp = self.subparsers().add_parser(name, aliases=aliases_transformed, help=help_, **kwargs)
-
-            # TODO: Sometimes the parser.command has a help parameter. Ideally
-            # I'd extract this during the sdk phase but for the life of me
-            # I can't find it.
-            setattr(func, "mysignature", sp)
-            setattr(func, "mysignature_help", help_)
-
-            self.subparser_objs.append(sp)
-            for arg in arguments:
-                tsp = sp.add_argument(*arg.args, **arg.kwargs)
-                myCompleter= None
-                comparator = arg.args[0].lower()
-                if comparator.startswith('machine'):
-                  myCompleter = complete_instance_machine
-                elif comparator.startswith('id') or comparator.endswith('id'):
-                  myCompleter = complete_instance
-                elif comparator.startswith('ssh'):
-                  myCompleter = complete_sshkeys
-                  
-                if myCompleter:
-                  setattr(tsp, 'completer', myCompleter)
-
-
-            sp.set_defaults(func=func)
+            self.pending[name] = (func, aliases_transformed, help_, kwargs, arguments)
+            self.command_names[name] = name
+            for alias in aliases_transformed:
+                self.command_names[alias] = name
             return func
 
         if len(arguments) == 1 and type(arguments[0]) != argument:
@@ -326,15 +1654,78 @@ class apwrap(object):
             return inner(func)
         return inner
 
-    def parse_args(self, argv=None, *a, **kw):
-        if argv is None:
-            argv = sys.argv[1:]
+    def materialize(self, name):
+        """Builds the argparse subparser of command name, if it hasn't been built yet."""
+        pending = self.pending.pop(name, None)
+        if pending is None:
+            return
+        func, aliases, help_, kwargs, arguments = pending
+
+        sp = self.subparsers().add_parser(name, aliases=aliases, help=help_, **kwargs)
+
+        # TODO: Sometimes the parser.command has a help parameter. Ideally
+        # I'd extract this during the sdk phase but for the life of me
+        # I can't find it.
+        setattr(func, "mysignature", sp)
+        setattr(func, "mysignature_help", help_)
+
+        self.subparser_objs.append(sp)
+        for arg in arguments:
+            arg_kwargs = dict(arg.kwargs)
+            myCompleter = arg_kwargs.pop("completer", None)
+            tsp = sp.add_argument(*arg.args, **arg_kwargs)
+            comparator = arg.args[0].lower()
+            if myCompleter:
+              pass
+            elif comparator.startswith('machine'):
+              myCompleter = complete_instance_machine
+            elif comparator.startswith('id') or comparator.endswith('id'):
+              myCompleter = complete_instance
+            elif comparator.startswith('ssh'):
+              myCompleter = complete_sshkeys
+
+            if myCompleter:
+              setattr(tsp, 'completer', myCompleter)
+
+        for a, kw in self.global_args:
+            try:
+                sp.add_argument(*a, **kw)
+            except argparse.ArgumentError:
+                pass
+
+        sp.set_defaults(func=func)
+
+    def materialize_all(self):
+        """Builds every remaining subparser, in registration order."""
+        for name in list(self.pending):
+            self.materialize(name)
+
+    def merge_verbs(self, argv):
+        """Joins each verb with the word after it: ['show', 'instances'] -> ['show instances']."""
         argv_ = []
         for x in argv:
             if argv_ and argv_[-1] in self.verbs:
                 argv_[-1] += " " + x
             else:
                 argv_.append(x)
+        return argv_
+
+    def find_command(self, argv) -> Optional[str]:
+        """The name of the (first) command argv invokes, or None."""
+        for x in self.merge_verbs(argv):
+            if x in self.command_names:
+                return self.command_names[x]
+        return None
+
+    def parse_args(self, argv=None, *a, **kw):
+        if argv is None:
+            argv = sys.argv[1:]
+        argv_ = self.merge_verbs(argv)
+        named = [self.command_names[x] for x in argv_ if x in self.command_names]
+        if not named or os.environ.get("_ARGCOMPLETE"):
+            self.materialize_all()
+        for name in named:
+            self.materialize(name)
         args = self.parser.parse_args(argv_, *a, **kw)
         for func in self.post_setup:
             func(args)
@@ -428,11 +1819,9 @@ def deindent(message: str) -> str:
     :param str message: Message to deindent.
     :rtype str:
     """
-    message = re.sub(r" *$", "", message, flags=re.MULTILINE)
-    indents = [len(x) for x in re.findall("^ *(?=[^ ])", message, re.MULTILINE) if len(x)]
-    a = min(indents)
-    message = re.sub(r"^ {," + str(a) + "}", "", message, flags=re.MULTILINE)
-    return message.strip()
+    lines = [line.rstrip(" ") for line in message.split("\n")]
+    a = min(len(line) - len(line.lstrip(" ")) for line in lines if line.startswith(" "))
+    return "\n".join(line[:a].lstrip(" ") + line[a:] for line in lines).strip()
 
 
 # These are the fields that are displayed when a search is run
@@ -542,6 +1931,14 @@ machine_fields = (
     ("gpu_occupancy", "occup", "{}", None, True),
 )
 
+# These fields are displayed when you do 'list machines'
+machine_listing_fields = (
+    ("id", "Machine ID", "{}", None, True),
+    ("status", "Status", "{}", None, True),
+    ("extended", "Extended", "{}", None, True),
+    ("attempts", "Attempts", "{}", None, True),
+)
+
 # These fields are displayed when you do 'show maints'
 maintenance_fields = (
     ("machine_id", "Machine ID", "{}", None, True),
@@ -705,11 +2102,111 @@ offers_mult = {
 }
 
 
+# The query grammar: field, operator, value, with the whitespace between them kept so that the
+# matches can be checked to cover the whole query.
+QUERY_PATTERN = re.compile(r"([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|\"[^\"]+\"|[^ ]+)?( *)")
+QUERY_OPS = {
+    ">=": "gte",
+    ">": "gt",
+    "gt": "gt",
+    "gte": "gte",
+    "<=": "lte",
+    "<": "lt",
+    "lt": "lt",
+    "lte": "lte",
+    "!=": "neq",
+    "==": "eq",
+    "=": "eq",
+    "eq": "eq",
+    "neq": "neq",
+    "noteq": "neq",
+    "not eq": "neq",
+    "notin": "notin",
+    "not in": "notin",
+    "nin": "notin",
+    "in": "in",
+}
+QUERY_WILDCARDS = ("?", "*", "any")
+
+
+def _frozen(mapping: Dict) -> frozenset:
+    return frozenset(mapping.items())
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_query(query_str: str, fields: frozenset, field_alias: frozenset, field_multiplier: frozenset) -> Tuple:
+    """The comparisons in query_str as (steps, error). steps is a tuple of (name as written, field,
+    op name, value, known field) steps for parse_query to apply; op name is None for a wildcard.
+    For a query that doesn't parse, steps is None and error is (unknown fields seen before the
+    error, in order, message). Memoized, so the steps and their values (lists are tuples here)
+    are never modified."""
+    field_alias, field_multiplier = dict(field_alias), dict(field_multiplier)
+    opts, end = [], 0
+    for m in QUERY_PATTERN.finditer(query_str):
+        if m.start() != end:
+            break
+        opts.append(m.groups(""))
+        end = m.end()
+    if end != len(query_str):
+        joined = "".join("".join(x) for x in QUERY_PATTERN.findall(query_str))
+        return None, ((), "Unconsumed text. Did you forget to quote your query? " + repr(joined) + " != " + repr(query_str))
+
+    steps, unknown = [], []
+    try:
+        for name, op, _, value, _ in opts:
+            value = value.strip(",[]")
+            op = op.strip()
+            op_name = QUERY_OPS.get(op)
+            field = field_alias.get(name, name)
+
+            if (field == "driver_version") and ('.' in value):
+                value = numeric_version(value)
+
+            if field not in fields:
+                unknown.append(field)
+            if not op_name:
+                raise ValueError("Unknown operator. Did you forget to quote your query? " + repr(op).strip("u"))
+            if op_name in ["in", "notin"]:
+                value = [x.strip() for x in value.split(",") if x.strip()]
+            if not value:
+                raise ValueError("Value cannot be blank. Did you forget to quote your query? " + repr((field, op, value)))
+            if value in QUERY_WILDCARDS:
+                if op_name != "eq":
+                    raise ValueError("Wildcard only makes sense with equals.")
+                steps.append((name, field, None, None, field in fields))
+                continue
+
+            if isinstance(value, str):
+                value = value.replace('_', ' ')
+                value = value.strip('\"')
+            elif isinstance(value, list):
+                value = tuple(x.replace('_', ' ').strip('\"') for x in value)
+
+            if field in field_multiplier:
+                if isinstance(value, tuple):
+                    value = tuple(float(x) * field_multiplier[field] for x in value)
+                else:
+                    value = float(value) * field_multiplier[field]
+            elif (value == 'true') or (value == 'True'):
+                value = True
+            elif (value == 'false') or (value == 'False'):
+                value = False
+            elif (value == 'None') or (value == 'null'):
+                value = None
+            steps.append((name, field, op_name, value, field in fields))
+    except ValueError as e:
+        return None, (tuple(unknown), str(e))
+    return tuple(steps), None
+
+
 def parse_query(query_str: str, res: Dict = None, fields = {}, field_alias = {}, field_multiplier = {}) -> Dict:
     """
     Basically takes a query string (like the ones in the examples of commands for the search__offers function) and
     processes it into a dict of URL parameters to be sent to the server.
 
+    The parsing itself is memoized per (query_str, fields, field_alias, field_multiplier); each call
+    merges the parsed comparisons into res (a new dict if None) and returns it.
+
     :param str query_str:
     :param Dict res:
     :return Dict:
@@ -720,109 +2217,166 @@ def parse_query(query_str: str, res: Dict = None, fields = {}, field_alias = {},
     if res is None: res = {}
     if type(query_str) == list:
         query_str = " ".join(query_str)
-    query_str = query_str.strip()
-
-    # Revised regex pattern to accurately capture quoted strings, bracketed lists, and single words/numbers
-    #pattern    = r"([a-zA-Z0-9_]+)\s*(=|!=|<=|>=|<|>| in | nin | eq | neq | not eq | not in )?\s*(\"[^\"]*\"|\[[^\]]+\]|[^ ]+)"
-    #pattern    = "([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|[^ ]+)?( *)"
-    pattern     = r"([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|\"[^\"]+\"|[^ ]+)?( *)"
-    opts        = re.findall(pattern, query_str)
-
-    #print("parse_query regex:")
-    #print(opts)
-
-    #print(opts)
-    # res = {}
-    op_names = {
-        ">=": "gte",
-        ">": "gt",
-        "gt": "gt",
-        "gte": "gte",
-        "<=": "lte",
-        "<": "lt",
-        "lt": "lt",
-        "lte": "lte",
-        "!=": "neq",
-        "==": "eq",
-        "=": "eq",
-        "eq": "eq",
-        "neq": "neq",
-        "noteq": "neq",
-        "not eq": "neq",
-        "notin": "notin",
-        "not in": "notin",
-        "nin": "notin",
-        "in": "in",
-    }
-
-
-
-    joined = "".join("".join(x) for x in opts)
-    if joined != query_str:
-        raise ValueError(
-            "Unconsumed text. Did you forget to quote your query? " + repr(joined) + " != " + repr(query_str))
-
-    for field, op, _, value, _ in opts:
-        value = value.strip(",[]")
-        v = res.setdefault(field, {})
-        op = op.strip()
-        op_name = op_names.get(op)
-
-        if field in field_alias:
-            res.pop(field)
-            field = field_alias[field]
-
-        if (field == "driver_version") and ('.' in value):
-            value = numeric_version(value)
+    steps, error = _compile_query(query_str.strip(), frozenset(fields), _frozen(field_alias), _frozen(field_multiplier))
+    if error is not None:
+        unknown, message = error
+        for field in unknown:
+            print("Warning: Unrecognized field: {}, see list of recognized fields.".format(field), file=sys.stderr);
+        raise ValueError(message)
 
-        if not field in fields:
+    for name, field, op_name, value, known in steps:
+        v = res.setdefault(name, {})
+        if name != field:
+            res.pop(name)
+        if not known:
             print("Warning: Unrecognized field: {}, see list of recognized fields.".format(field), file=sys.stderr);
-        if not op_name:
-            raise ValueError("Unknown operator. Did you forget to quote your query? " + repr(op).strip("u"))
-        if op_name in ["in", "notin"]:
-            value = [x.strip() for x in value.split(",") if x.strip()]
-        if not value:
-            raise ValueError("Value cannot be blank. Did you forget to quote your query? " + repr((field, op, value)))
-        if not field:
-            raise ValueError("Field cannot be blank. Did you forget to quote your query? " + repr((field, op, value)))
-        if value in ["?", "*", "any"]:
-            if op_name != "eq":
-                raise ValueError("Wildcard only makes sense with equals.")
-            if field in v:
-                del v[field]
-            if field in res:
-                del res[field]
+        if op_name is None:
+            res.pop(field, None)
             continue
-
-        if isinstance(value, str):
-            value = value.replace('_', ' ')
-            value = value.strip('\"') 
-        elif isinstance(value, list):
-            value = [x.replace('_', ' ')    for x in value]
-            value = [x.strip('\"')          for x in value]
-
-        if field in field_multiplier:
-            value = float(value) * field_multiplier[field]
-            v[op_name] = value
-        else:
-            #print(value)
-            if   (value == 'true') or (value == 'True'):
-                v[op_name] = True
-            elif (value == 'false') or (value == 'False'):
-                v[op_name] = False
-            elif (value == 'None') or (value == 'null'):
-                v[op_name] = None
-            else:
-                v[op_name] = value
-
+        v[op_name] = list(value) if isinstance(value, tuple) else value
         if field not in res:
             res[field] = v
         else:
             res[field].update(v)
-    #print(res)
     return res
 
 
+def parse_order(spec: str, field_alias: Dict = {}) -> List[List[str]]:
+    """A -o/--order value ("num_gpus,total_flops-": comma-separated fields, postfix - for
+    descending, + or nothing for ascending) as [[field, "asc"|"desc"], ...], with aliases resolved."""
+    order = []
+    for name in spec.split(","):
+        name = name.strip()
+        if not name: continue
+        direction = "asc"
+        field = name
+        if name.strip("-") != name:
+            direction = "desc"
+            field = name.strip("-")
+        if name.strip("+") != name:
+            direction = "asc"
+            field = name.strip("+")
+        order.append([field_alias.get(field, field), direction])
+    return order
+
+
+# search offers simplifies the parse_query() dict before using it. A field's comparisons are
+# combined into one constraint: the tightest lower and upper bounds, the values it may take
+# (== and in, intersected) and those it may not (!= and notin). That constraint is written back
+# as the fewest comparisons meaning the same thing, or found unsatisfiable, in which case the
+# search returns no offers without asking the server. Numbers and numeric strings compare as
+# numbers, other strings only for (in)equality. A field compared with None, with a bound that
+# isn't a number, or with an operator not in QUERY_OPS is left as it is. (Repeating the same
+# comparison, e.g. num_gpus=2 num_gpus=4, already keeps only the last one in parse_query; that
+# is how the default query is overridden.)
+QUERY_BOUND_OPS = ("gt", "gte", "lt", "lte")
+
+
+def _query_key(value) -> Tuple:
+    """What value compares as: ("f", float) for numbers and numeric strings, ("s", str) for other strings."""
+    if isinstance(value, bool):
+        return "b", value
+    try:
+        return "f", float(value)
+    except (TypeError, ValueError):
+        return "s", value
+
+
+def _format_query_ops(ops: Dict) -> str:
+    return ", ".join("{} {}".format(op, json.dumps(value)) for op, value in ops.items())
+
+
+def _optimize_query_field(ops: Dict) -> Tuple[Dict, Optional[str]]:
+    """(simplified ops, None) for one field's {op: value} comparisons, or (ops, reason) if they can't all hold."""
+    if not ops or not set(ops) <= set(QUERY_OPS.values()) or None in ops.values():
+        return ops, None
+    lower = upper = None  # (number, inclusive, op)
+    for op in QUERY_BOUND_OPS:
+        if op not in ops:
+            continue
+        kind, x = _query_key(ops[op])
+        if kind != "f":
+            return ops, None
+        inclusive = op.endswith("e")
+        if op.startswith("g"):
+            if lower is None or x > lower[0] or (x == lower[0] and not inclusive):
+                lower = (x, inclusive, op)
+        elif upper is None or x < upper[0] or (x == upper[0] and not inclusive):
+            upper = (x, inclusive, op)
+    if lower and upper and (lower[0] > upper[0] or (lower[0] == upper[0] and not (lower[1] and upper[1]))):
+        return ops, "{} can't hold".format(_format_query_ops({lower[2]: ops[lower[2]], upper[2]: ops[upper[2]]}))
+
+    def in_bounds(value):
+        kind, x = _query_key(value)
+        if kind != "f":
+            return None  # can't tell
+        return not ((lower and (x < lower[0] or (x == lower[0] and not lower[1]))) or
+                    (upper and (x > upper[0] or (x == upper[0] and not upper[1]))))
+
+    def unique(values):
+        seen = set()
+        return [v for v in values if not (_query_key(v) in seen or seen.add(_query_key(v)))]
+
+    excluded = unique(([ops["neq"]] if "neq" in ops else []) + list(ops.get("notin", [])))
+    allowed, single = None, "eq" in ops
+    if "in" in ops:
+        allowed = unique(ops["in"])
+    if "eq" in ops:
+        allowed = [ops["eq"]] if allowed is None or _query_key(ops["eq"]) in map(_query_key, allowed) else []
+    if allowed is None and lower and upper and lower[0] == upper[0]:
+        allowed, single = [ops[lower[2]]], True  # >= x and <= x
+    if allowed is not None:
+        if (lower or upper) and None in map(in_bounds, allowed):
+            return ops, None
+        excluded_keys = set(map(_query_key, excluded))
+        kept = [v for v in allowed if _query_key(v) not in excluded_keys and in_bounds(v) is not False]
+        if not kept:
+            return ops, "no value satisfies {}".format(_format_query_ops(ops))
+        return ({"eq": kept[0]} if single else {"in": kept}), None
+
+    simplified = {}
+    for bound in (lower, upper):
+        if bound:
+            simplified[bound[2]] = ops[bound[2]]
+    excluded = [v for v in excluded if in_bounds(v) is not False]  # those out of bounds are excluded anyway
+    if "neq" in ops and excluded and _query_key(excluded[0]) == _query_key(ops["neq"]) and len(excluded) == 1:
+        simplified["neq"] = ops["neq"]
+    elif excluded:
+        simplified["notin"] = excluded
+    return simplified, None
+
+
+class QueryPlan(object):
+    """A search query (parse_query() output) simplified field by field, see above.
+
+    :param dict query: field -> {op: value}; other keys (order, limit, ...) are kept as they are.
+    """
+
+    def __init__(self, query: Dict):
+        self.query = {}
+        self.changes = []           # (field, ops, simplified ops)
+        self.unsatisfiable = None   # why no offer can match, if none can
+        for field, ops in query.items():
+            if isinstance(ops, dict):
+                simplified, reason = _optimize_query_field(ops)
+                if reason and self.unsatisfiable is None:
+                    self.unsatisfiable = "{}: {}".format(field, reason)
+                if simplified != ops:
+                    self.changes.append((field, ops, simplified))
+                ops = simplified
+            self.query[field] = ops
+
+    def explain(self) -> str:
+        lines = ["query plan:"]
+        for field, ops, simplified in self.changes:
+            lines.append("  {}: {}  ->  {}".format(field, _format_query_ops(ops), _format_query_ops(simplified) or "(dropped)"))
+        if not self.changes:
+            lines.append("  nothing to simplify")
+        if self.unsatisfiable:
+            lines.append("  {}; no offer can match, not sending the search".format(self.unsatisfiable))
+        return "\n".join(lines)
+
+
 def display_table(rows: list, fields: Tuple) -> None:
     """Basically takes a set of field names and rows containing the corresponding data and prints a nice tidy table
     of it.
@@ -954,6 +2508,67 @@ def attach__ssh(args):
     r.raise_for_status()
     print(r.json())
 
+
+@parser.command(
+    argument("namespace", help="only clear entries of this kind: {}".format(", ".join(sorted(CACHE_TTLS))), nargs="?", default=None),
+    usage="vastai cache clear [NAMESPACE]",
+    help="Delete cached API responses",
+    epilog=deindent("""
+        Deletes the locally cached responses of slow-changing API reads (GPU names, templates,
+        benchmarks, cloud connections), so the next call fetches them again. To bypass the
+        cache for a single command instead, pass --refresh or --no-cache to it.
+
+        Examples:
+         vastai cache clear
+         vastai cache clear templates
+    """),
+)
+def cache__clear(args):
+    removed = RESPONSE_CACHE.clear(args.namespace)
+    legacy = os.path.join(DIRS['temp'], "gpu_names_cache.json")  # pre-DiskCache gpu names cache
+    if args.namespace in (None, "gpu_names") and os.path.exists(legacy):
+        os.remove(legacy)
+    if args.raw:
+        return {"removed": removed}
+    print("removed {} cached response(s) from {}".format(removed, RESPONSE_CACHE.path))
+
+
+@parser.command(
+    usage="vastai cache stats [--raw]",
+    help="Show size, freshness and hit rate of the local response cache",
+    epilog=deindent("""
+        Shows, per kind of cached response, the number of entries, how many are still fresh,
+        their total size and TTL, plus the hit/miss counters accumulated by all invocations.
+        Entries are kept under VAST_CACHE_MAX_BYTES (default 32MiB) in total.
+    """),
+)
+def cache__stats(args):
+    entries = RESPONSE_CACHE.entries()
+    namespaces = {}
+    for name in sorted(set(CACHE_TTLS) | {e["namespace"] for e in entries}):
+        mine = [e for e in entries if e["namespace"] == name]
+        namespaces[name] = {
+            "entries": len(mine),
+            "fresh": len([e for e in mine if e["fresh"]]),
+            "bytes": builtins.sum(e["size"] for e in mine),
+            "ttl": CACHE_TTLS.get(name, 0),
+            "oldest_age": max([e["age"] for e in mine], default=None),
+        }
+    counters = RESPONSE_CACHE.load_stats()
+    lookups = counters["hits"] + counters["misses"]
+    result = {"path": RESPONSE_CACHE.path, "max_bytes": RESPONSE_CACHE.max_bytes, "namespaces": namespaces,
+              "counters": counters, "hit_rate": counters["hits"] / lookups if lookups else None}
+    if args.raw:
+        return result
+    print("{:<14} {:>8} {:>8} {:>10} {:>8} {:>12}".format("namespace", "entries", "fresh", "bytes", "ttl(s)", "oldest(s)"))
+    for name, n in namespaces.items():
+        oldest = "-" if n["oldest_age"] is None else "{:.0f}".format(n["oldest_age"])
+        print("{:<14} {:>8} {:>8} {:>10} {:>8} {:>12}".format(name, n["entries"], n["fresh"], n["bytes"], n["ttl"], oldest))
+    rate = "-" if result["hit_rate"] is None else "{:.1%}".format(result["hit_rate"])
+    print("hits: {hits}  misses: {misses}  stores: {stores}  evictions: {evictions}".format(**counters) + "  hit rate: " + rate)
+    print("{} of {} bytes used in {}".format(builtins.sum(n["bytes"] for n in namespaces.values()), RESPONSE_CACHE.max_bytes, RESPONSE_CACHE.path))
+
+
 @parser.command(
     argument("dst", help="instance_id:/path to target of copy operation", type=str),
     usage="vastai cancel copy DST",
@@ -1063,11 +2678,39 @@ def change__bid(args: argparse.Namespace):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url, headers=headers, json=json_blob)
+    r = http_put(args, url, headers=headers, json=json_blob, idempotent=True)
     r.raise_for_status()
     print("Per gpu bid price changed".format(r.json()))
 
 
+@parser.command(
+    argument("ids", help="ids of instances to change bid", type=int, nargs='+'),
+    argument("--price", help="per machine bid price in $/hour", type=float),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai change bids ID0 ID1 ID2... [--price PRICE] [--parallel N]",
+    help="Change the bid price for a list of spot/interruptible instances",
+    epilog=deindent("""
+        Change the current bid price of each instance to PRICE, or to a winning bid price if PRICE is not specified.
+        Prints a line per instance and a summary, and exits with status 1 if any bid could not be changed.
+        With --raw, prints {"changed": [...], "failed": [...], "results": [...]}.
+        Example: vastai change bids $(vastai show instances -q) --price 0.3
+    """),
+)
+def change__bids(args: argparse.Namespace):
+    """Alters the bids of args.ids concurrently.
+
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    json_blob = {"client_id": "me", "price": args.price,}
+    if (args.explain):
+        print("request json: ")
+        print(json_blob)
+    return bulk_instance_command(args, lambda id: http_put(args, apiurl(args, "/instances/bid_price/{id}/".format(id=id)),
+                                                           headers=headers, json=json_blob, idempotent=True),
+                                 "changing bid of", "changed")
+
+
 
 
 @parser.command(
@@ -1101,6 +2744,7 @@ def copy(args: argparse.Namespace):
     @param src: Location of data object to be copied.
     @param dst: Target to copy object to.
     """
+    import subprocess
 
     (src_id, src_path) = parse_vast_url(args.src)
     (dst_id, dst_path) = parse_vast_url(args.dst)
@@ -1124,7 +2768,7 @@ def copy(args: argparse.Namespace):
         url = apiurl(args, f"/commands/rsync/")
     else:
         url = apiurl(args, f"/commands/copy_direct/")
-    r = http_put(args, url,  headers=headers,json=req_json)
+    r = http_put(args, url,  headers=headers,json=req_json, idempotent=False)
     r.raise_for_status()
     if (r.status_code == 200):
         rj = r.json();
@@ -1201,7 +2845,7 @@ def vm__copy(args: argparse.Namespace):
         print("request json: ")
         print(req_json)
 
-    r = http_put(args, url,  headers=headers,json=req_json)
+    r = http_put(args, url,  headers=headers,json=req_json, idempotent=False)
     r.raise_for_status()
     if (r.status_code == 200):
         rj = r.json();
@@ -1440,7 +3084,7 @@ def create__endpoint(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = requests.post(url, headers=headers,json=json_blob)
+    r = http_post(args, url, headers=headers,json=json_blob)
     r.raise_for_status()
     if 'application/json' in r.headers.get('Content-Type', ''):
         try:
@@ -1538,7 +3182,27 @@ def create__instance(args: argparse.Namespace):
 
     :param argparse.Namespace args: Namespace with many fields relevant to the endpoint.
     """
+    json_blob = create_instance_json(args)
+    if json_blob is None:
+        return 1
+
+    #print(f"put asks/{args.id}/  runtype:{runtype}")
+    url = apiurl(args, "/asks/{id}/".format(id=args.id))
+
+    if (args.explain):
+        print("request json: ")
+        print(json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
+    r.raise_for_status()
+    if args.raw:
+        return r
+    else:
+        print("Started. {}".format(r.json()))
 
+
+def create_instance_json(args: argparse.Namespace) -> Optional[Dict]:
+    """The body of a create instance request (PUT /asks/ID/) for the launch options in args, or
+    None (after printing why) if they don't go together."""
     if args.onstart:
         with open(args.onstart, "r") as reader:
             args.onstart_cmd = reader.read()
@@ -1570,24 +3234,139 @@ def create__instance(args: argparse.Namespace):
     if args.template_hash is None:
         runtype = get_runtype(args)
         if runtype == 1:
-            return 1
+            return None
         json_blob["runtype"] = runtype
 
     if (args.args != None):
         json_blob["args"] = args.args
+    return json_blob
 
-    #print(f"put asks/{args.id}/  runtype:{runtype}")
-    url = apiurl(args, "/asks/{id}/".format(id=args.id))
 
+def create_from_offer(args, offer_id: int, json_blob: Dict) -> int:
+    """Sends a create instance request for offer_id; returns the new contract (instance) id.
+    Raises HTTPError, or ValueError if the offer was not available."""
+    r = http_put(args, apiurl(args, "/asks/{id}/".format(id=offer_id)), headers=headers, json=json_blob, idempotent=False)
+    r.raise_for_status()
+    rj = r.json()
+    if not rj.get("success") or "new_contract" not in rj:
+        raise ValueError(rj.get("msg") or rj.get("error") or "offer unavailable")
+    return rj["new_contract"]
+
+
+@parser.command(
+    argument("--query", help="search offers query for the offers to try, e.g. 'gpu_name=RTX_4090 num_gpus=1' (default query unless -n)", type=str, default=""),
+    argument("--count", help="number of instances to create", type=int, required=True),
+    argument("-n", "--no-default", action="store_true", help="Disable default search query"),
+    argument("-o", "--order", type=str, help="Comma-separated list of fields to sort offers on, as for search offers. default='score-'", default='score-'),
+    argument("--limit", type=int, help="max offers to try (default: 4 x count, at least 64)"),
+    argument("--parallel", help="max create requests in flight (default: 8, never more than the instances still needed)", type=int, default=8),
+    argument("--template_hash", help="Create instances from template info", type=str),
+    argument("--disk", help="size of local disk partition in GB", type=float, default=10),
+    argument("--image", help="docker container image to launch", type=str),
+    argument("--login", help="docker login arguments for private repo authentication, surround with '' ", type=str),
+    argument("--label", help="label to set on the instances", type=str),
+    argument("--onstart", help="filename to use as onstart script", type=str),
+    argument("--onstart-cmd", help="contents of onstart script as single argument", type=str),
+    argument("--entrypoint", help="override entrypoint for args launch instance", type=str),
+    argument("--ssh",     help="Launch as an ssh instance type", action="store_true"),
+    argument("--jupyter", help="Launch as a jupyter instance instead of an ssh instance", action="store_true"),
+    argument("--direct",  help="Use (faster) direct connections for jupyter & ssh", action="store_true"),
+    argument("--jupyter-dir", help="For runtype 'jupyter', directory in instance to use to launch jupyter. Defaults to image's working directory", type=str),
+    argument("--jupyter-lab", help="For runtype 'jupyter', Launch instance with jupyter lab", action="store_true"),
+    argument("--lang-utf8", help="Workaround for images with locale problems: install and generate locales before instance launch, and set locale to C.UTF-8", action="store_true"),
+    argument("--python-utf8", help="Workaround for images with locale problems: set python's locale to C.UTF-8", action="store_true"),
+    argument("--extra", help=argparse.SUPPRESS),
+    argument("--env",   help="env variables and port mapping options, surround with '' ", type=str),
+    argument("--args",  nargs=argparse.REMAINDER, help="list of arguments passed to container ENTRYPOINT. Onstart is recommended for this purpose. (must be last argument)"),
+    argument("--force", help="Skip sanity checks when creating from an existing instance", action="store_true"),
+    argument("--bid_price", help="(OPTIONAL) create INTERRUPTIBLE instances with per machine bid price in $/hour", type=float),
+    usage="vastai create instances --count N [--query QUERY] [OPTIONS] [--args ...]",
+    help="Create N instances from the best matching offers",
+    epilog=deindent("""
+        Searches offers like "search offers" and creates instances from them as the results stream in, with up to
+        --parallel create requests in flight. Each request is sent with --cancel-unavail, so an offer that was taken
+        in the meantime fails instead of leaving a stopped instance, and the next offer is tried in its place.
+        No more requests are in flight than instances still needed, so exactly --count instances are created unless
+        the offers run out first. The launch options are those of "create instance".
+
+        Prints a line per offer tried and a summary with the time to the full fleet, and exits with status 1 if
+        fewer than --count instances were created. With --raw, prints {"instances": [...], "offers": [...],
+        "failed": [...], "tried": N, "time_to_fleet": seconds}.
+
+        Example:
+            vastai create instances --count 8 --query 'gpu_name=RTX_4090 num_gpus=1 reliability>0.99' -o dph --image pytorch/pytorch --ssh --direct
+    """),
+)
+def create__instances(args: argparse.Namespace):
+    """Creates args.count instances from a streamed search, moving on to the next offer when one is taken.
+
+    :param argparse.Namespace args: Namespace with many fields relevant to the endpoint.
+    :rtype int|dict: exit status, or the created instances with --raw.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    if args.count < 1 or args.parallel < 1:
+        raise ValueError("--count and --parallel must be at least 1")
+    args.cancel_unavail = True
+    json_blob = create_instance_json(args)
+    if json_blob is None:
+        return 1
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
-    r.raise_for_status()
+
+    search_args = argparse.Namespace(**vars(args))
+    search_args.query = [args.query]
+    search_args.type = "bid" if args.bid_price is not None else "on-demand"
+    search_args.limit = args.limit or max(64, 4 * args.count)
+    search_args.storage = args.disk
+    search_args.new = search_args.disable_bundling = search_args.local = False
+    search_args.raw = search_args.raw_stream = True
+    offers = search__offers(search_args)
+    if not isinstance(offers, types.GeneratorType):
+        return 1
+
+    start = time.time()
+    created, failed, in_flight = [], [], {}
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        try:
+            while len(created) < args.count:
+                # top up: never more requests in flight than instances still needed
+                while offers is not None and len(in_flight) < min(args.parallel, args.count - len(created)):
+                    offer = next(offers, None)
+                    if offer is None:
+                        offers = None
+                        break
+                    in_flight[executor.submit(create_from_offer, args, offer["id"], json_blob)] = offer["id"]
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offer_id = in_flight.pop(future)
+                    try:
+                        contract = future.result()
+                    except requests.exceptions.HTTPError as e:
+                        failed.append({"offer": offer_id, "msg": http_error_message(e)})
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        failed.append({"offer": offer_id, "msg": str(e)})
+                    else:
+                        created.append({"offer": offer_id, "instance": contract, "seconds": round(time.time() - start, 3)})
+                        if not args.raw:
+                            print("created instance {} from offer {} ({:.1f}s)".format(contract, offer_id, time.time() - start))
+                        continue
+                    if not args.raw:
+                        print("offer {} failed, trying the next one: {}".format(offer_id, failed[-1]["msg"]))
+        finally:
+            if offers is not None:
+                offers.close()
+    elapsed = time.time() - start
     if args.raw:
-        return r
-    else:
-        print("Started. {}".format(r.json()))
+        return {"instances": [c["instance"] for c in created], "offers": [c["offer"] for c in created], "failed": failed,
+                "tried": len(created) + len(failed), "time_to_fleet": round(elapsed, 3) if len(created) == args.count else None}
+    print("created {} of {} instances in {:.1f}s ({} offers tried, {} failed){}".format(
+        len(created), args.count, elapsed, len(created) + len(failed), len(failed),
+        "" if len(created) == args.count else "; ran out of matching offers"))
+    return 0 if len(created) == args.count else 1
+
 
 @parser.command(
     argument("--email", help="email address to use for login", type=str),
@@ -1774,7 +3553,7 @@ def delete__api_key(args):
     print(r.json())
 
 @parser.command(
-    argument("id", help="id ssh key to delete", type=int),
+    argument("id", help="id ssh key to delete", type=int, completer=complete_ssh_key_id),
     usage="vastai delete ssh-key ID",
     help="Remove an ssh-key",
 )
@@ -1934,16 +3713,135 @@ def destroy__instance(args):
     """
     destroy_instance(args.id,args)
 
+def instance_request_result(id, send) -> Dict:
+    """Runs send(), an API call about instance id, and returns {"id", "success"[, "msg"]} instead of raising."""
+    try:
+        r = send()
+        r.raise_for_status()
+        rj = r.json()
+    except requests.exceptions.HTTPError as e:
+        return {"id": id, "success": False, "msg": http_error_message(e)}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {"id": id, "success": False, "msg": str(e)}
+    result = {"id": id, "success": bool(rj.get("success"))}
+    if rj.get("msg"):
+        result["msg"] = rj["msg"]
+    return result
+
+
+def print_instance_result(args, result: Dict, doing: str) -> Dict:
+    """Prints 'DOING instance ID.' or why it failed, unless --raw; returns result."""
+    if args.raw:
+        return result
+    if result["success"]:
+        print("{} instance {}.".format(doing, result["id"]))
+    else:
+        print("failed {} instance {}: {}".format(doing, result["id"], result.get("msg", "unknown error")))
+    return result
+
+
+def summarize_instance_results(args, ids: List[int], results: Dict, done: str):
+    """Prints 'DONE n of m instances' and returns the exit status, or with --raw returns
+    {DONE: [ids], "failed": [ids], "results": [per-id results in the order of ids]}."""
+    ordered = [results[id] for id in ids]
+    succeeded = [r["id"] for r in ordered if r["success"]]
+    failed = [r["id"] for r in ordered if not r["success"]]
+    if args.raw:
+        return {done: succeeded, "failed": failed, "results": ordered}
+    print("{} {} of {} instances{}".format(
+        done, len(succeeded), len(ids), ", failed: {}".format(" ".join(map(str, failed))) if failed else ""))
+    return 1 if failed else 0
+
+
+def bulk_instance_command(args, send, doing: str, done: str):
+    """Runs send(id) for each of args.ids (duplicates dropped) on a WorkQueue of args.parallel
+    threads; the rate limiter still paces the requests. Returns summarize_instance_results()."""
+    if args.parallel < 1:
+        raise ValueError("--parallel must be at least 1")
+    ids = list(dict.fromkeys(args.ids))
+    results = {}
+
+    def one(id):
+        results[id] = print_instance_result(args, instance_request_result(id, lambda: send(id)), doing)
+        return True
+    exec_with_threads(one, ids, nt=args.parallel, max_retries=0)
+    return summarize_instance_results(args, ids, results, done)
+
+
+def _destroy_one(id, args) -> Dict:
+    """DELETEs one instance; returns {"id", "success"[, "msg"]} instead of raising."""
+    return instance_request_result(id, lambda: http_del(args, apiurl(args, "/instances/{id}/".format(id=id)),
+                                                        headers=headers, json={}))
+
+
+def _destroy_batch(ids, args, unsupported: threading.Event) -> List[Dict]:
+    """DELETEs a list of instances in one call, the way start/stop instances PUT an ids list.
+    Returns the results of the ids the response itself reports as destroyed, i.e. listed in
+    its "results" as {"id": ..., "success": true}; a bare {"success": true} proves nothing about
+    any one id. The rest are left to be retried one by one. Sets unsupported if the server has
+    no such endpoint."""
+    try:
+        r = http_del(args, apiurl(args, "/instances/"), headers=headers, json={"ids": ids})
+        if r.status_code in (404, 405, 501):
+            unsupported.set()
+            return []
+        r.raise_for_status()
+        reported = r.json().get("results")
+    except (requests.exceptions.RequestException, ValueError, AttributeError):
+        return []
+    wanted = set(ids)
+    return [{"id": x["id"], "success": True} for x in reported or []
+            if isinstance(x, dict) and x.get("id") in wanted and x.get("success") is True]
+
+
 @parser.command(
     argument("ids", help="ids of instance to destroy", type=int, nargs='+'),
-    usage="vastai destroy instances [--raw] <id>",
+    argument("--batch-size", help="ids per batched request (default: 1, one DELETE per id)", type=int, default=1),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai destroy instances [--raw] [--batch-size N] [--parallel N] ID0 ID1 ID2...",
     help="Destroy a list of instances (irreversible, deletes data)",
+    epilog=deindent("""
+        Sends one DELETE per id, up to --parallel requests at a time. With --batch-size N > 1 the
+        ids are first sent N per request to the bulk DELETE /instances/ endpoint; only ids that
+        its response reports destroyed one by one count as done, and every other id (or all of
+        them, if the server doesn't have the endpoint) is then deleted on its own. Prints a line per id and a summary, and exits with status 1 if any instance could
+        not be destroyed. With --raw, prints {"destroyed": [...], "failed": [...], "results": [...]}.
+        Examples:
+            vastai destroy instances $(vastai show instances -q)
+            vastai destroy instances 329838 984849 --raw
+    """),
 )
 def destroy__instances(args):
-    """
-    """
-    for id in args.ids:
-        destroy_instance(id, args)
+    """Destroys many instances with batched and concurrent DELETE requests.
+
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    if args.batch_size < 1 or args.parallel < 1:
+        raise ValueError("--batch-size and --parallel must be at least 1")
+    ids = list(dict.fromkeys(args.ids))
+    results = {}
+    results_lock = threading.Lock()
+    batch_unsupported = threading.Event()
+
+    def record(result):
+        with results_lock:
+            results[result["id"]] = result
+        return print_instance_result(args, result, "destroying")
+
+    def destroy_chunk(chunk):
+        if not batch_unsupported.is_set():
+            for result in _destroy_batch(chunk, args, batch_unsupported):
+                record(result)
+        return True
+
+    if args.batch_size > 1:
+        exec_with_threads(destroy_chunk, split_list(ids, args.batch_size), nt=args.parallel, max_retries=0)
+    # whatever no batched call reported destroyed goes one id per request
+    remaining = [id for id in ids if id not in results]
+    exec_with_threads(lambda id: record(_destroy_one(id, args)), remaining, nt=args.parallel, max_retries=0)
+
+    return summarize_instance_results(args, ids, results, "destroyed")
 
 @parser.command(
     usage="vastai destroy team",
@@ -2000,7 +3898,7 @@ def execute(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob )
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2010,10 +3908,11 @@ def execute(args):
                 time.sleep(0.3)
                 url = rj.get("result_url",None)
                 if (url is None):
+                    import hashlib
                     api_key_id_h = hashlib.md5( (args.api_key + str(args.id)).encode('utf-8') ).hexdigest()
                     url = "https://s3.amazonaws.com/vast.ai/instance_logs/" + api_key_id_h + "C.log"
                 # print(f"trying {url}")
-                r = requests.get(url) #headers=headers
+                r = http_session().get(url, timeout=http_timeout(args)) #headers=headers
                 # print(f"got: {r.status_code}")
                 if (r.status_code == 200):
                     filtered_text = r.text.replace(rj["writeable_path"], '');
@@ -2081,7 +3980,7 @@ def invite__team_member(args):
 
 @parser.command(
     argument("id", help="id of instance to label", type=int),
-    argument("label", help="label to set", type=str),
+    argument("label", help="label to set", type=str, completer=complete_instance_label),
     usage="vastai label instance <id> <label>",
     help="Assign a string label to an instance",
 )
@@ -2096,7 +3995,7 @@ def label__instance(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
 
     rj = r.json();
@@ -2106,38 +4005,59 @@ def label__instance(args):
         print(rj["msg"]);
 
 
+@parser.command(
+    argument("ids", help="ids of instances to label", type=int, nargs='+'),
+    argument("label", help="label to set", type=str, completer=complete_instance_label),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai label instances ID0 ID1 ID2... LABEL [--parallel N]",
+    help="Assign a string label to a list of instances",
+    epilog=deindent("""
+        Prints a line per instance and a summary, and exits with status 1 if any instance could not be labeled.
+        With --raw, prints {"labeled": [...], "failed": [...], "results": [...]}.
+        Example: vastai label instances $(vastai show instances -q) training-run-7
+    """),
+)
+def label__instances(args):
+    """Labels args.ids concurrently.
+
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    json_blob = { "label": args.label }
+    if (args.explain):
+        print("request json: ")
+        print(json_blob)
+    return bulk_instance_command(args, lambda id: http_put(args, apiurl(args, "/instances/{id}/".format(id=id)),
+                                                           headers=headers, json=json_blob, idempotent=True),
+                                 "labeling", "labeled")
+
+
 def fetch_url_content(url):
-    response = requests.get(url)
+    response = http_session().get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
     response.raise_for_status()  # Raises an HTTPError for bad responses
     return response.text
 
 
-def _get_gpu_names() -> List[str]:
+GPU_NAMES_URL = f"{server_url_default}/api/v0/gpu_names/unique/"
+
+
+def _gpu_names_cache_key() -> str:
+    """The RESPONSE_CACHE key _get_gpu_names stores the list under (see cached_get_json)."""
+    return "gpu_names " + ValidatorCache.key(GPU_NAMES_URL)
+
+
+def _format_gpu_names(gpu_names: Dict) -> List[str]:
+    return [name.replace(" ", "_").replace("-", "_") for name in gpu_names['gpu_names']]
+
+
+def _get_gpu_names(args=None) -> List[str]:
     """Returns a set of GPU names available on Vast.ai, with results cached for 24 hours."""
-    
-    def is_cache_valid() -> bool:
-        """Checks if the cache file exists and is less than 24 hours old."""
-        if not os.path.exists(CACHE_FILE):
-            return False
-        cache_age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(CACHE_FILE))
-        return cache_age < CACHE_DURATION
-    
-    if is_cache_valid():
-        with open(CACHE_FILE, "r") as file:
-            gpu_names = json.load(file)
-    else:
-        endpoint = "/api/v0/gpu_names/unique/"
-        url = f"{server_url_default}{endpoint}"
-        r = requests.get(url, headers={})
+    def fetch():
+        r = http_session().get(GPU_NAMES_URL, headers={}, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
         r.raise_for_status()  # Will raise an exception for HTTP errors
-        gpu_names = r.json()
-        with open(CACHE_FILE, "w") as file:
-            json.dump(gpu_names, file)
+        return r.json()
 
-    formatted_gpu_names = [
-        name.replace(" ", "_").replace("-", "_") for name in gpu_names['gpu_names']
-    ]
-    return formatted_gpu_names
+    return _format_gpu_names(cached_get_json(args, "gpu_names", GPU_NAMES_URL, fetch=fetch))
 
 
 REGIONS = {
@@ -2164,8 +4084,69 @@ def _parse_region(region):
         return REGIONS[region]
     return region
 
+
+def race_launch(args, query: Dict, json_blob: Dict):
+    """launch instance --race K: creates instances on the K best offers for query at once, keeps the
+    first one created and destroys the rest. Returns the exit status, or a dict with --raw."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    if args.race < 1:
+        raise ValueError("--race must be at least 1")
+    query = dict(query, limit=args.race)
+    create_blob = {k: v for k, v in json_blob.items() if k not in ("gpu_name", "num_gpus", "region", "q")}
+    create_blob["cancel_unavail"] = True  # a taken offer should fail, not leave a stopped instance
+    if (args.explain):
+        print("request json: ")
+        print(create_blob)
+    urllib3._import()  # defines HTTP_ACCEPT_ENCODING
+    r = http_post(args, apiurl(args, "/bundles/"), headers=dict(headers, **{"Accept-Encoding": HTTP_ACCEPT_ENCODING}),
+                  json=query, stream=True)
+    try:
+        r.raise_for_status()
+        offers = [offer["id"] for offer in iter_offers(r, query)][:args.race]
+    finally:
+        r.close()  # read to the end and released before the creates, which may take a while
+    if not offers:
+        print("No matching offers found.")
+        return 1
+
+    start = time.time()
+    winner, extra, failed = None, [], []
+    with ThreadPoolExecutor(max_workers=len(offers)) as executor:
+        futures = {executor.submit(create_from_offer, args, offer_id, create_blob): offer_id for offer_id in offers}
+        for future in as_completed(futures):
+            offer_id = futures[future]
+            try:
+                contract = future.result()
+            except requests.exceptions.HTTPError as e:
+                failed.append({"offer": offer_id, "msg": http_error_message(e)})
+                continue
+            except (requests.exceptions.RequestException, ValueError) as e:
+                failed.append({"offer": offer_id, "msg": str(e)})
+                continue
+            if winner is None:
+                winner = {"success": True, "new_contract": contract, "offer": offer_id, "seconds": round(time.time() - start, 3)}
+                if not args.raw:
+                    print("Instance launched successfully: {} (offer {}, {:.1f}s)".format(contract, offer_id, time.time() - start))
+            else:
+                extra.append(contract)
+    destroyed = [_destroy_one(contract, args) for contract in extra]
+    if not args.raw:
+        for result in destroyed:
+            print_instance_result(args, result, "destroying extra")
+    if winner is None:
+        if args.raw:
+            return {"success": False, "failed": failed}
+        for f in failed:
+            print("offer {} failed: {}".format(f["offer"], f["msg"]))
+        print("Failed to launch instance: none of the {} offers tried could be created".format(len(offers)))
+        return 1
+    if args.raw:
+        return dict(winner, failed=failed, destroyed=destroyed)
+    return 0
+
+
 @parser.command(
-    argument("-g", "--gpu-name", type=str, required=True, choices=_get_gpu_names(), help="Name of the GPU model, replace spaces with underscores"),
+    argument("-g", "--gpu-name", type=str, required=True, completer=complete_gpu_name, help="Name of the GPU model, replace spaces with underscores (e.g. RTX_4090)"),
     argument("-n", "--num-gpus", type=str, required=True, choices=["1", "2", "4", "8", "12", "14"], help="Number of GPUs required"),
     argument("-r", "--region", type=str, help="Geographical location of the instance"),
     argument("-i", "--image", required=True, help="Name of the image to use for instance"),
@@ -2190,6 +4171,7 @@ def _parse_region(region):
     argument("--force", help="Skip sanity checks when creating from an existing instance", action="store_true"),
     argument("--cancel-unavail", help="Return error if scheduling fails (rather than creating a stopped instance)", action="store_true"),
     argument("--template_hash",   help="template hash which contains all relevant information about an instance. This can be used as a replacement for other parameters describing the instance configuration", type=str),
+    argument("--race", type=int, metavar="K", help="try the K best offers at once and keep the first instance that starts"),
     usage="vastai launch instance [--help] [--api-key API_KEY] <gpu_name> <num_gpus> <image> [geolocation] [disk_space]",
     help="Launch the top instance from the search offers based on the given parameters",
     epilog=deindent("""
@@ -2208,6 +4190,13 @@ def _parse_region(region):
                     
             # launch a 4x RTX 3090 instance with the pytorch image and 32 GB of disk space located in North America
             python vast.py launch instance -g RTX_3090 -n 4 -i pytorch/pytorch -d 32.0 -r North_America
+
+            # race the 4 best single RTX 4090 offers and keep whichever instance is created first
+            python vast.py launch instance -g RTX_4090 -n 1 -i pytorch/pytorch --race 4
+
+        With --race K, the K best offers are searched for and an instance is created on each of them at the same time
+        (failing fast if the offer was taken). The first one to succeed is kept and any other that also succeeded is
+        destroyed straight away. With --raw, prints {"success", "new_contract", "offer", "seconds", "failed", "destroyed"}.
             
         Available fields:
 
@@ -2228,6 +4217,16 @@ def launch__instance(args):
 
     :param argparse.Namespace args: Namespace with many fields relevant to the endpoint.
     """
+    # The GPU name is validated here rather than with argparse choices, which would fetch the
+    # list at import time. If the list can't be fetched the search below simply finds nothing.
+    try:
+        gpu_names = _get_gpu_names(args)
+    except requests.exceptions.RequestException:
+        gpu_names = None
+    if gpu_names is not None and args.gpu_name not in gpu_names:
+        raise ValueError("argument -g/--gpu-name: invalid choice: '{}' (choose from {})".format(
+            args.gpu_name, ", ".join(sorted(gpu_names))))
+
     args_query = f"num_gpus={args.num_gpus} gpu_name={args.gpu_name}"
 
     if args.region:
@@ -2243,23 +4242,7 @@ def launch__instance(args):
     base_query = {"verified": {"eq": True}, "external": {"eq": False}, "rentable": {"eq": True}, "rented": {"eq": False}}
     query = parse_query(args_query, base_query, offers_fields, offers_alias, offers_mult)
 
-    order = []
-    for name in args.order.split(","):
-        name = name.strip()
-        if not name: continue
-        direction = "asc"
-        field = name
-        if name.strip("-") != name:
-            direction = "desc"
-            field = name.strip("-")
-        if name.strip("+") != name:
-            direction = "asc"
-            field = name.strip("+")
-        #print(f"{field} {name} {direction}")
-        if field in offers_alias:
-            field = offers_alias[field];
-        order.append([field, direction])
-    query["order"] = order
+    query["order"] = parse_order(args.order, offers_alias)
     query["type"] = "on-demand"
     # For backwards compatibility, support --type=interruptible option
     if query["type"] == 'interruptible':
@@ -2307,12 +4290,15 @@ def launch__instance(args):
     if (args.args != None):
         json_blob["args"] = args.args
 
+    if args.race:
+        return race_launch(args, query, json_blob)
+
     url = apiurl(args, "/launch_instance/".format())
 
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url, headers=headers, json=json_blob)
+    r = http_put(args, url, headers=headers, json=json_blob, idempotent=False)
     try:
         r.raise_for_status()  # This will raise an exception for HTTP error codes
         response_data = r.json()
@@ -2352,17 +4338,18 @@ def logs(args):
         print("request json: ")
         print(json_blob)
 
-    r = http_put(args, url, headers=headers, json=json_blob)
+    r = http_put(args, url, headers=headers, json=json_blob, idempotent=False)
     r.raise_for_status()
 
     if r.status_code == 200:
         rj = r.json()
         for i in range(0, 30):
             time.sleep(0.3)
+            import hashlib
             api_key_id_h = hashlib.md5((args.api_key + str(args.INSTANCE_ID)).encode('utf-8')).hexdigest()
             url = "https://s3.amazonaws.com/vast.ai/instance_logs/" + api_key_id_h + ".log"
             print(f"waiting on logs for instance {args.INSTANCE_ID} fetching from {url}")
-            r = requests.get(url)
+            r = http_session().get(url, timeout=http_timeout(args))
             if r.status_code == 200:
                 result = r.text
                 cleaned_text = re.sub(r'\n\s*\n', '\n', result)
@@ -2392,7 +4379,7 @@ def prepay__instance(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
 
     rj = r.json();
@@ -2421,7 +4408,7 @@ def reboot__instance(args):
     :rtype:
     """
     url = apiurl(args, "/instances/reboot/{id}/".format(id=args.id))
-    r = http_put(args, url,  headers=headers,json={})
+    r = http_put(args, url,  headers=headers,json={}, idempotent=False)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2435,6 +4422,27 @@ def reboot__instance(args):
         print("failed with error {r.status_code}".format(**locals()));
 
 
+@parser.command(
+    argument("ids", help="ids of instances to reboot", type=int, nargs='+'),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai reboot instances ID0 ID1 ID2... [--parallel N]",
+    help="Reboot (stop/start) a list of instances",
+    epilog=deindent("""
+        Stops and starts each container without any risk of losing GPU priority.
+        Prints a line per instance and a summary, and exits with status 1 if any instance could not be rebooted.
+        With --raw, prints {"rebooted": [...], "failed": [...], "results": [...]}.
+    """),
+)
+def reboot__instances(args):
+    """
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    return bulk_instance_command(args, lambda id: http_put(args, apiurl(args, "/instances/reboot/{id}/".format(id=id)),
+                                                           headers=headers, json={}, idempotent=False),
+                                 "rebooting", "rebooted")
+
+
 @parser.command(
     argument("id", help="id of instance to reboot", type=int),
     usage="vastai recycle instance ID [OPTIONS]",
@@ -2449,7 +4457,7 @@ def recycle__instance(args):
     :rtype:
     """
     url = apiurl(args, "/instances/recycle/{id}/".format(id=args.id))
-    r = http_put(args, url,  headers=headers,json={})
+    r = http_put(args, url,  headers=headers,json={}, idempotent=False)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2462,6 +4470,27 @@ def recycle__instance(args):
         print(r.text)
         print("failed with error {r.status_code}".format(**locals()));
 
+
+@parser.command(
+    argument("ids", help="ids of instances to recycle", type=int, nargs='+'),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai recycle instances ID0 ID1 ID2... [--parallel N]",
+    help="Recycle (destroy/create) a list of instances",
+    epilog=deindent("""
+        Destroys and recreates each container in place (from newly pulled image) without any risk of losing GPU priority.
+        Prints a line per instance and a summary, and exits with status 1 if any instance could not be recycled.
+        With --raw, prints {"recycled": [...], "failed": [...], "results": [...]}.
+    """),
+)
+def recycle__instances(args):
+    """
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    return bulk_instance_command(args, lambda id: http_put(args, apiurl(args, "/instances/recycle/{id}/".format(id=id)),
+                                                           headers=headers, json={}, idempotent=False),
+                                 "recycling", "recycled")
+
 @parser.command(
     argument("id", help="id of user to remove", type=int),
     usage="vastai remove team-member ID",
@@ -2501,7 +4530,7 @@ def reports(args):
         print("request json: ")
         print(json_blob)
     
-    r = requests.get(url, headers=headers, json=json_blob)
+    r = http_get(args, url, headers=headers, json=json_blob)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2522,38 +4551,154 @@ def reset__api_key(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
     print("api-key reset ".format(r.json()))
 
 
-def exec_with_threads(f, args, nt=16, max_retries=5):
-    def worker(sub_args):
-        for arg in sub_args:
-            retries = 0
-            while retries <= max_retries:
-                try:
-                    result = None
-                    if isinstance(arg,tuple):
-                        result = f(*arg)
-                    else:
-                        result = f(arg)
-                    if result:  # Assuming a truthy return value means success
-                        break
-                except Exception as e:
-                    print(str(e))
-                    pass
-                retries += 1
-                stime = 0.25 * 1.3 ** retries
-                print(f"retrying in {stime}s")
-                time.sleep(stime)  # Exponential backoff
+class WorkItem(object):
+    """Outcome of one item run by a WorkQueue: the return value of the last attempt, or the
+    exception it raised."""
+    __slots__ = ("item", "result", "error", "attempts")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.attempts = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and bool(self.result)
+
+    def __repr__(self):
+        return "WorkItem({!r}, result={!r}, error={!r}, attempts={})".format(self.item, self.result, self.error, self.attempts)
+
+
+class WorkQueue(object):
+    """Runs f over a list of items on a fixed number of worker threads that take items from a
+    shared queue, so a slow item only holds up its own thread.
+
+    An item that returns a falsy value, or raises a transient error (a transport error, or an
+    HTTPError for a 429 or 5xx response), is put back on the queue to be retried after an
+    exponential backoff (0.25 * 1.3**attempt seconds), up to max_retries times; other items run
+    in the meantime. Other exceptions, such as an HTTPError for a 4xx response, fail the item at
+    once, and DeadlineExceeded is never retried: the time is up for every item. Tuples
+    are unpacked into positional arguments. Ctrl-C (or cancel(), or f raising KeyboardInterrupt)
+    stops handing out items; items already running finish. With progress=True, counts of
+    finished, failed and retrying items are kept up to date on stderr if it is a terminal.
+    """
+
+    def __init__(self, f, concurrency: int = 16, max_retries: int = 5, progress: bool = False):
+        self.f = f
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.progress = progress and sys.stderr.isatty()
+        self.cond = threading.Condition()
+        self.cancelled = False
+        self.interrupted = None
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.ready.clear()
+            self.cond.notify_all()
+
+    def _next(self):
+        """Blocks until an item is due; returns None when there is nothing left to do."""
+        with self.cond:
+            while True:
+                if self.cancelled or self.unfinished == 0:
+                    return None
+                now = time.monotonic()
+                if self.ready and self.ready[0][0] <= now:
+                    return heapq.heappop(self.ready)[2]
+                self.cond.wait(self.ready[0][0] - now if self.ready else None)
+
+    def _finish(self, work: WorkItem, retry: bool):
+        with self.cond:
+            if retry and not self.cancelled:
+                self.retrying += 1
+                self.seq += 1
+                heapq.heappush(self.ready, (time.monotonic() + 0.25 * 1.3 ** work.attempts, self.seq, work))
+            else:
+                self.unfinished -= 1
+                self.failed += not work.ok
+            self.cond.notify_all()
+            self._report()
+
+    def _report(self, end=""):
+        if self.progress:
+            sys.stderr.write("\r{}/{} done, {} failed, {} retries{}".format(
+                len(self.items) - self.unfinished, len(self.items), self.failed, self.retrying, end))
+            sys.stderr.flush()
+
+    def _worker(self, outputs):
+        for stream, buffer in outputs:
+            stream.local.buffer = buffer  # keep writing where the calling thread does (vastai batch)
+        while True:
+            work = self._next()
+            if work is None:
+                return
+            work.attempts += 1
+            try:
+                work.result = self.f(*work.item) if isinstance(work.item, tuple) else self.f(work.item)
+                work.error = None
+            except KeyboardInterrupt as e:
+                work.result, work.error = None, e
+                self.interrupted = e
+                self.cancel()
+            except Exception as e:
+                work.result, work.error = None, e
+            self._finish(work, not work.ok and work.attempts <= self.max_retries
+                         and (work.error is None or _is_transient_error(work.error)))
+
+    def run(self, items) -> List[WorkItem]:
+        """Runs every item to completion (or until cancelled); returns a WorkItem per item, in order."""
+        self.items = [WorkItem(item) for item in items]
+        self.ready = [(0.0, i, work) for i, work in enumerate(self.items)]
+        self.seq = len(self.items)
+        self.unfinished = len(self.items)
+        self.failed = self.retrying = 0
+        outputs = [(s, getattr(s.local, "buffer", None)) for s in (sys.stdout, sys.stderr) if isinstance(s, _ThreadOutput)]
+        threads = [threading.Thread(target=self._worker, args=(outputs,), daemon=True)
+                   for _ in range(min(self.concurrency, len(self.items)))]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.2)  # a bare join() would hold off Ctrl-C until it returns
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            if self.items:
+                self._report("\n")
+        if self.interrupted is not None:
+            raise self.interrupted
+        return self.items
 
-    # Split args into nt sublists
-    args_per_thread = math.ceil(len(args) / nt)
-    sublists = [args[i:i + args_per_thread] for i in range(0, len(args), args_per_thread)]
 
-    with ThreadPoolExecutor(max_workers=nt) as executor:
-        executor.map(worker, sublists)
+def _is_deadline_exceeded(e) -> bool:
+    # DeadlineExceeded only exists once requests has been imported, and is only raised after that
+    return e is not None and requests._lazy_module is not None and isinstance(e, DeadlineExceeded)
+
+
+def _is_transient_error(e) -> bool:
+    """Whether a call that raised e may succeed if made again: transport errors and 429/5xx
+    responses may, deterministic failures (4xx, bad input, bugs) and DeadlineExceeded won't."""
+    if requests._lazy_module is None or _is_deadline_exceeded(e):
+        return False
+    if isinstance(e, requests.exceptions.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is not None and (status == 429 or status >= 500)
+    return isinstance(e, requests.exceptions.RequestException) or RetryPolicy._connection_error_kind(e) is not None
+
+
+def exec_with_threads(f, args, nt=16, max_retries=5, progress=False) -> List[WorkItem]:
+    """Runs f over args with a WorkQueue of nt threads; see WorkQueue."""
+    return WorkQueue(f, concurrency=nt, max_retries=max_retries, progress=progress).run(args)
 
 
 def split_into_sublists(lst, k):
@@ -2585,7 +4730,7 @@ def start_instance(id,args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2621,8 +4766,17 @@ def start__instance(args):
     start_instance(args.id,args)
 
 
+def report_bulk_failures(verb: str, work: List[WorkItem]) -> int:
+    """Prints the batches of ids a start/stop instances call gave up on; returns the exit status."""
+    failed = [w for w in work if not w.ok]
+    for w in failed:
+        print("failed to {} instances {}: {}".format(verb, " ".join(map(str, w.item)), w.error or "request failed"))
+    return 1 if failed else 0
+
+
 @parser.command(
     argument("ids", help="ids of instance to start", type=int, nargs='+'),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
     usage="vastai start instances [OPTIONS] ID0 ID1 ID2...",
     help="Start a list of instances",
 )
@@ -2636,7 +4790,8 @@ def start__instances(args):
     #exec_with_threads(lambda id : start_instance(id, args), args.IDs)
 
     idlist = split_list(args.ids, 64)
-    exec_with_threads(lambda ids : start_instance(ids, args), idlist, nt=8)
+    work = exec_with_threads(lambda ids : start_instance(ids, args), idlist, nt=args.parallel, progress=True)
+    return report_bulk_failures("start", work)
 
 
 
@@ -2652,7 +4807,7 @@ def stop_instance(id,args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -2688,6 +4843,7 @@ def stop__instance(args):
 
 @parser.command(
     argument("ids", help="ids of instance to stop", type=int, nargs='+'),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
     usage="vastai stop instances [OPTIONS] ID0 ID1 ID2...",
     help="Stop a list of instances",
     epilog=deindent("""
@@ -2704,7 +4860,8 @@ def stop__instances(args):
 
     idlist = split_list(args.ids, 64)
     #stop_instance(args.IDs, args)
-    exec_with_threads(lambda ids : stop_instance(ids, args), idlist, nt=8)
+    work = exec_with_threads(lambda ids : stop_instance(ids, args), idlist, nt=args.parallel, progress=True)
+    return report_bulk_failures("stop", work)
 
 
 
@@ -2796,9 +4953,7 @@ def search__benchmarks(args):
         return 1  
     #url = apiurl(args, "/benchmarks", {"select_cols" : ['id','last_update','machine_id','score'], "select_filters" : query})
     url = apiurl(args, "/benchmarks", {"select_cols" : ['*'], "select_filters" : query})
-    r = requests.get(url, headers=headers)
-    r.raise_for_status()
-    rows = r.json()
+    rows = cached_get_json(args, "benchmarks", url, headers)
     if True: # args.raw:
         return rows
     else:
@@ -2902,7 +5057,7 @@ def search__invoices(args):
         print("Error: ", e)
         return 1  
     url = apiurl(args, "/invoices", {"select_cols" : ['*'], "select_filters" : query})
-    r = requests.get(url, headers=headers)
+    r = http_get(args, url, headers=headers)
     r.raise_for_status()
     rows = r.json()
     if True: # args.raw:
@@ -2911,6 +5066,42 @@ def search__invoices(args):
         display_table(rows, displayable_fields)
 
 
+def offer_passes_rented_filter(row: Dict, filter_op: str, target) -> bool:
+    rented = False
+    if "rented" in row and row["rented"] is not None:
+        rented = row["rented"]
+    if filter_op == "eq":
+        return rented == target
+    if filter_op == "neq":
+        return rented != target
+    if filter_op == "in":
+        return rented in target
+    if filter_op == "notin":
+        return rented not in target
+    return False
+
+
+def iter_offers(r: requests.Response, query: Dict):
+    """Yields the offers of a (streamed) search response one by one as they are decoded, applying
+    the client-side 'rented' filter of query on the fly. The response is closed when exhausted.
+
+    :param requests.Response r: response of /bundles/ or /search/asks/, ideally sent with stream=True.
+    :param dict query: the search query that was sent.
+    """
+    # TODO: add this post-query geolocation filter to the database call rather than handling it locally
+    filter_op = target = None
+    if 'rented' in query:
+        filter_q  = query['rented']
+        filter_op = list(filter_q.keys())[0]
+        target    = filter_q[filter_op]
+    try:
+        for row in iter_json_array(r.iter_content(chunk_size=64 * 1024), key="offers"):
+            if filter_op is None or offer_passes_rented_filter(row, filter_op, target):
+                yield row
+    finally:
+        r.close()
+
+
 @parser.command(
     argument("-t", "--type", default="on-demand", help="Show 'on-demand', 'reserved', or 'bid'(interruptible) pricing. default: on-demand"),
     argument("-i", "--interruptible", dest="type", const="bid", action="store_const", help="Alias for --type=bid"),
@@ -2923,8 +5114,10 @@ def search__invoices(args):
     argument("--disable-bundling", action="store_true", help="Deprecated"),
     argument("--storage", type=float, default=5.0, help="Amount of storage to use for pricing, in GiB. default=5.0GiB"),
     argument("-o", "--order", type=str, help="Comma-separated list of fields to sort on. postfix field with - to sort desc. ex: -o 'num_gpus,total_flops-'.  default='score-'", default='score-'),
+    argument("--local", action="store_true", help="Search the local offers snapshot (see 'offers snapshot') instead of the API"),
+    argument("--max-staleness", type=float, metavar="SECONDS", help="with --local, first sync the snapshot if it is missing or older than SECONDS"),
     argument("query", help="Query to search for. default: 'external=false rentable=true verified=true', pass -n to ignore default", nargs="*", default=None),
-    usage="vastai search offers [--help] [--api-key API_KEY] [--raw] <query>",
+    usage="vastai search offers [--help] [--api-key API_KEY] [--raw] [--local [--max-staleness SECONDS]] <query>",
     help="Search for instance types using custom query",
     epilog=deindent("""
         Query syntax:
@@ -2961,6 +5154,21 @@ def search__invoices(args):
 
             # search for arm64 cpu architecture
             vastai search offers 'cpu_arch=arm64'
+
+            # the same, answered from the snapshot taken by 'vastai offers snapshot' without calling the API
+            vastai search offers --local 'cpu_arch=arm64'
+
+            # the same, syncing the snapshot first if it is more than 10 minutes old
+            vastai search offers --local --max-staleness 600 'cpu_arch=arm64'
+
+        With --local, every field stored in the snapshot can be queried and sorted on, including
+        fields the API doesn't filter on. Values that are null never match a comparison (use
+        'field == None' for those).
+
+        Comparisons on the same field are combined before searching: 'gpu_ram>=16 gpu_ram>24' becomes
+        'gpu_ram>24', and 'num_gpus in [1,2,4] num_gpus>=2' becomes 'num_gpus in [2,4]'. A query that no
+        offer can satisfy, such as 'dph<0.2 dph>0.5', returns no offers without calling the API.
+        --explain shows what was combined.
             
         Available fields:
 
@@ -3024,6 +5232,22 @@ def search__offers(args):
     :param argparse.Namespace args: should supply all the command-line options
     """
 
+    fields = offers_fields
+    if args.local:
+        path = offer_snapshot_path(args.type)
+        if args.max_staleness is not None and offer_snapshot_stale(path, args.max_staleness, args.storage):
+            stats = refresh_offer_snapshot(args, path, args.type, args.storage)
+            if stats is None:
+                return 1
+            print("Synced the offers snapshot in {seconds:.1f}s: {added} new, {updated} changed, {removed} gone".format(**stats),
+                  file=sys.stderr)
+        try:
+            snapshot = OfferSnapshot(path)
+        except (OSError, ValueError) as e:
+            print("No usable offers snapshot for --type {0} ({1}). Take one with: vastai offers snapshot --type {0}".format(args.type, e))
+            return 1
+        fields = offers_fields | set(snapshot.columns)
+
     try:
 
         if args.no_default:
@@ -3033,26 +5257,9 @@ def search__offers(args):
             #query = {"verified": {"eq": True}, "external": {"eq": False}, "rentable": {"eq": True} }
 
         if args.query is not None:
-            query = parse_query(args.query, query, offers_fields, offers_alias, offers_mult)
+            query = parse_query(args.query, query, fields, offers_alias, offers_mult)
 
-        order = []
-        for name in args.order.split(","):
-            name = name.strip()
-            if not name: continue
-            direction = "asc"
-            field = name
-            if name.strip("-") != name:
-                direction = "desc"
-                field = name.strip("-")
-            if name.strip("+") != name:
-                direction = "asc"
-                field = name.strip("+")
-            #print(f"{field} {name} {direction}")
-            if field in offers_alias:
-                field = offers_alias[field];
-            order.append([field, direction])
-
-        query["order"] = order
+        query["order"] = parse_order(args.order, offers_alias)
         query["type"] = args.type
         if (args.limit):
             query["limit"] = int(args.limit)
@@ -3062,11 +5269,28 @@ def search__offers(args):
             query["type"] = 'bid'
         if args.disable_bundling:
             query["disable_bundling"] = True
+        plan = QueryPlan(query)
+        query = plan.query
+        if args.explain:
+            print(plan.explain())
+        if plan.unsatisfiable:
+            if args.local:
+                snapshot.close()
+            if args.raw:
+                return (row for row in ()) if getattr(args, "raw_stream", False) else []
+            display_table([], displayable_fields_reserved if args.type == "reserved" else displayable_fields)
+            return
+        if args.local:
+            return search_offers_local(args, query, snapshot)
     except ValueError as e:
+        if args.local:
+            snapshot.close()
         print("Error: ", e)
         return 1
 
     new_search_ept = args.new
+    urllib3._import()  # defines HTTP_ACCEPT_ENCODING
+    search_headers = dict(headers, **{"Accept-Encoding": HTTP_ACCEPT_ENCODING})
     
     #json_blob = {"select_cols" : ['*'], "q" : query}
     json_blob = query
@@ -3082,7 +5306,7 @@ def search__offers(args):
             print("request json: ")
             print(json_blob)
 
-        r = http_put(args, url, headers=headers, json=json_blob)
+        r = http_put(args, url, headers=search_headers, json=json_blob, stream=True, idempotent=True)
         etime = time.time()
         print(f"request took {etime-stime}s")
 
@@ -3093,45 +5317,675 @@ def search__offers(args):
         #url = apiurl(args, "/bundles", {"q": query})
         #r = requests.get(url, headers=headers)
         url = apiurl(args, "/bundles/")
-        r = http_post(args, url, headers=headers, json=json_blob)
+        r = http_post(args, url, headers=search_headers, json=json_blob, stream=True)
 
     r.raise_for_status()
    
     if (r.headers.get('Content-Type') != 'application/json'):
         print(f"invalid return Content-Type: {r.headers.get('Content-Type')}")
+        r.close()
         return   
 
-    rows = r.json()["offers"]
+    if (args.explain):
+        print(f"response Content-Encoding: {r.headers.get('Content-Encoding', 'identity')}")
 
-    # TODO: add this post-query geolocation filter to the database call rather than handling it locally
-    if 'rented' in query:
-        filter_q  = query['rented']
-        filter_op = list(filter_q.keys())[0]
-        target    = filter_q[filter_op]
-        new_rows  = []
-        for row in rows:
-            rented = False
-            if "rented" in row and row["rented"] is not None:
-                rented = row["rented"]
-            if filter_op == "eq" and rented == target:
-                new_rows.append(row)
-            if filter_op == "neq" and rented != target:
-                new_rows.append(row)
-            if filter_op == "in" and rented in target:
-                new_rows.append(row)
-            if filter_op == "notin" and rented not in target:
-                new_rows.append(row)
-        rows = new_rows
+    rows = iter_offers(r, query)
 
     if args.raw:
-        return rows
+        # main() prints a generator as it is consumed; SDK and internal callers get a list
+        return rows if getattr(args, "raw_stream", False) else list(rows)
     else:
+        rows = list(rows)
         if args.type == "reserved":           
             display_table(rows, displayable_fields_reserved)
         else:
             display_table(rows, displayable_fields)
 
 
+# Offer market snapshots: `offers snapshot` downloads the whole market once and stores it in
+# a columnar file that later searches can mmap, touching only the columns a query needs
+# instead of downloading and decoding the JSON again. The file is
+#   magic (8 bytes) | header length (uint64) | header JSON | columns | tombstones
+# with every column starting on an 8 byte boundary. The header lists, per column, its kind,
+# array typecode, offset and size. Kinds and their nulls:
+#   "int"   int64 ('q'), OFFER_SNAPSHOT_NULL_INT for null
+#   "float" float64 ('d'), NaN for null
+#   "bool"  int8 ('b'), -1 for null
+#   "str"   int32 ('i') codes into the column's "dictionary", -1 for null
+# Values are in the byte order of the machine that wrote the file (header "byteorder").
+#
+# Later snapshots are synced into the file in place (sync_offer_snapshot): the fresh pull is
+# matched to the stored rows by offer id, changed values are overwritten, new offers are
+# appended into the spare "capacity" every column is allocated with, and offers that are gone
+# get a tombstone (int8 array of capacity, 1 = deleted; header "deleted" counts them). New
+# strings are appended to the dictionaries, which are only sorted as written. The header is
+# padded with spaces so it can be rewritten in place too. When a sync doesn't fit (no room,
+# new fields, too many tombstones) the whole file is rewritten, which also compacts it.
+# A sync first writes (and flushes) the header with "syncing" set and only clears it, in the
+# final header, once the columns are flushed; a file a crashed sync left with "syncing" set
+# is rejected on load and rewritten by the next snapshot.
+#
+# Writers (sync and rewrite) hold an exclusive flock on the "<path>.lock" file next to the
+# snapshot and an open OfferSnapshot holds a shared one, so a reader never sees a half-synced
+# file and a sync waits for the searches reading the file to finish.
+OFFER_SNAPSHOT_MAGIC = b"VASTOFR1"
+OFFER_SNAPSHOT_VERSION = 2
+OFFER_SNAPSHOT_NULL_INT = -2 ** 63
+OFFER_SNAPSHOT_COLUMNS = sorted(offers_fields | {f[0] for f in displayable_fields + displayable_fields_reserved})
+# Python types each column kind accepts, in the order a new column's kind is picked
+OFFER_SNAPSHOT_KINDS = (("bool", {bool}), ("int", {int, bool}), ("float", {int, float, bool}), ("str", {str}))
+# rewrite (compact) instead of syncing once more than this fraction of the rows are tombstones
+OFFER_SNAPSHOT_MAX_DEAD = 0.25
+
+
+def offer_snapshot_path(offer_type: str = "on-demand") -> str:
+    return os.path.join(DIRS['temp'], "offers-{}.snapshot".format(offer_type))
+
+
+def _encode_offer_values(kind: str, values: List, dictionary: List = None):
+    """values as the typed array of a column of that kind; strings not in dictionary are appended to it."""
+    import array
+    if kind == "bool":
+        return array.array("b", [-1 if v is None else int(v) for v in values])
+    if kind == "int":
+        return array.array("q", [OFFER_SNAPSHOT_NULL_INT if v is None else int(v) for v in values])
+    if kind == "float":
+        return array.array("d", [math.nan if v is None else float(v) for v in values])
+    codes = {v: i for i, v in enumerate(dictionary)}
+    for v in values:
+        if v is not None and v not in codes:
+            codes[v] = len(dictionary)
+            dictionary.append(v)
+    return array.array("i", [-1 if v is None else codes[v] for v in values])
+
+
+def _encode_offer_column(values: List):
+    """(kind, array, dictionary) for a column's values, or None if it holds lists, dicts or mixed types."""
+    types_ = {type(v) for v in values if v is not None}
+    for kind, accepted in OFFER_SNAPSHOT_KINDS:
+        if types_ and types_ <= accepted:
+            # sorted, so that comparing codes orders the same way as comparing the strings
+            dictionary = sorted({v for v in values if v is not None}) if kind == "str" else None
+            return kind, _encode_offer_values(kind, values, dictionary), dictionary
+    return None
+
+
+def _offer_snapshot_header_blob(header: Dict, size: int) -> Optional[bytes]:
+    """The header as size bytes of space-padded JSON, or None if it doesn't fit."""
+    blob = json.dumps(header).encode()
+    return blob + b" " * (size - len(blob)) if len(blob) <= size else None
+
+
+def write_offer_snapshot(path: str, offers, meta: Dict = None) -> Dict:
+    """Writes the offers (an iterable of search offers rows) to a snapshot file at path,
+    atomically replacing any previous one. Every scalar field gets a column, plus those of
+    OFFER_SNAPSHOT_COLUMNS that any offer has. Returns the header written."""
+    with _flock(path + ".lock"):
+        return _write_offer_snapshot(path, offers, meta)
+
+
+def _write_offer_snapshot(path: str, offers, meta: Dict = None) -> Dict:
+    values = {name: [] for name in OFFER_SNAPSHOT_COLUMNS}
+    rows = 0
+    for offer in offers:
+        for name in offer.keys() - values.keys():
+            values[name] = [None] * rows  # a field first seen on this offer
+        rows += 1
+        for name, column in values.items():
+            column.append(offer.get(name))
+
+    capacity = rows + max(rows // 4, 64)  # room for the offers later syncs add
+    header = dict(meta or {}, version=OFFER_SNAPSHOT_VERSION, byteorder=sys.byteorder, rows=rows, deleted=0,
+                  capacity=capacity, created=time.time(), columns={})
+    header.setdefault("synced", header["created"])
+    encoded = []
+    for name in sorted(values):
+        column = _encode_offer_column(values.pop(name))
+        if column is None:
+            continue
+        kind, data, dictionary = column
+        info = {"kind": kind, "typecode": data.typecode, "nbytes": capacity * data.itemsize}
+        if dictionary is not None:
+            info["dictionary"] = dictionary
+        header["columns"][name] = info
+        encoded.append((info, data))
+    header["tombstones"] = {"typecode": "b", "nbytes": capacity}
+
+    def pad(n):
+        return -n % 8
+
+    # offsets depend on the header's length, which depends on the offsets: size the header with
+    # placeholder offsets as wide as the real ones can get, plus room for the dictionaries and
+    # counts a sync adds
+    for info in list(header["columns"].values()) + [header["tombstones"]]:
+        info["offset"] = 10 ** 15
+    start = 16 + len(json.dumps(header).encode())
+    start += start // 4 + 4096
+    offset = start + pad(start)
+    for info in list(header["columns"].values()) + [header["tombstones"]]:
+        info["offset"] = offset
+        offset += info["nbytes"] + pad(info["nbytes"])
+    blob = _offer_snapshot_header_blob(header, start - 16 + pad(start))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(OFFER_SNAPSHOT_MAGIC + struct.pack("<Q", len(blob)) + blob)
+        for info, data in encoded:
+            data.tofile(f)
+            f.write(b"\0" * (info["nbytes"] - len(data) * data.itemsize + pad(info["nbytes"])))
+        f.write(b"\0" * (capacity + pad(capacity)))
+    os.replace(tmp, path)
+    return header
+
+
+def sync_offer_snapshot(path: str, offers: List[Dict], meta: Dict = None) -> Optional[Dict]:
+    """Brings the snapshot at path up to date with offers, a complete fresh pull, in place:
+    offers are matched to rows by id, changed values overwritten, new offers appended and
+    offers that are gone tombstoned. Returns the counts {"added", "updated", "removed",
+    "unchanged"}, or None without touching the file when it can't be synced (missing, written
+    for other meta, new fields or types, out of room, too many tombstones) and has to be
+    rewritten with write_offer_snapshot instead."""
+    import mmap
+    try:
+        f = open(path, "r+b")
+    except OSError:
+        return None
+    with f, _flock(path + ".lock"):
+        if f.read(8) != OFFER_SNAPSHOT_MAGIC:
+            return None
+        size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+        if header.get("version") != OFFER_SNAPSHOT_VERSION or header.get("byteorder") != sys.byteorder \
+                or header.get("syncing") or any(header.get(k) != v for k, v in (meta or {}).items()) \
+                or "id" not in header["columns"]:
+            return None
+        mm = mmap.mmap(f.fileno(), 0)
+        try:
+            return _sync_offer_snapshot(mm, header, size, offers)
+        finally:
+            mm.flush()
+            try:
+                mm.close()
+            except BufferError:
+                pass  # a view is still in use; the mapping goes away with it
+
+
+def _sync_offer_snapshot(mm, header: Dict, size: int, offers: List[Dict]) -> Optional[Dict]:
+    columns, rows = header["columns"], header["rows"]
+
+    def view(info):
+        return memoryview(mm)[info["offset"]:info["offset"] + info["nbytes"]].cast(info["typecode"])
+
+    # where each offer goes: its row, or a new one at the end
+    tombstones, ids = view(header["tombstones"]), view(columns["id"])
+    where = {ids[i]: i for i in range(rows) if not tombstones[i]}
+    targets, appended = [], rows
+    for offer in offers:
+        row = where.pop(offer.get("id"), None)
+        if row is None:
+            row, appended = appended, appended + 1
+        targets.append(row)
+    removed = list(where.values())
+    if appended > header["capacity"] or header["deleted"] + len(removed) > OFFER_SNAPSHOT_MAX_DEAD * appended:
+        return None
+
+    # encode every column before writing any, so an offer that doesn't fit leaves the file alone
+    from operator import methodcaller
+    fields = set().union(*map(dict.keys, offers))
+    if any(_encode_offer_column(list(map(methodcaller("get", name), offers))) for name in fields - columns.keys()):
+        return None  # a new field; a rewrite gives it a column
+    encoded = []
+    for name, info in columns.items():
+        values = list(map(methodcaller("get", name), offers))
+        if not set(map(type, values)) - {type(None)} <= dict(OFFER_SNAPSHOT_KINDS)[info["kind"]]:
+            return None
+        encoded.append((info, _encode_offer_values(info["kind"], values, info.get("dictionary"))))
+    synced = dict(header, rows=appended, deleted=header["deleted"] + len(removed), synced=time.time())
+    blobs = [_offer_snapshot_header_blob(dict(header, syncing=True), size), _offer_snapshot_header_blob(synced, size)]
+    if None in blobs:
+        return None
+
+    # the grown dictionaries and the "syncing" mark go in before any code that refers to them;
+    # the new row count, without the mark, goes in last once everything else is on disk
+    mm[16:16 + size] = blobs[0]
+    mm.flush()
+    changed = [False] * len(targets)
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    target_rows = np.array(targets, dtype=np.int64) if np is not None else None
+    for info, data in encoded:
+        column = view(info)
+        if np is not None:
+            column, data = np.asarray(column), np.asarray(data)
+            old = column[target_rows]
+            diff = old != data
+            if info["kind"] == "float":
+                diff &= ~(np.isnan(old) & np.isnan(data))
+            column[target_rows[diff]] = data[diff]
+            changed = np.logical_or(changed, diff)
+            continue
+        for i, (row, value) in enumerate(zip(targets, data)):
+            old = column[row]
+            if old != value and not (old != old and value != value):
+                column[row] = value
+                changed[i] = True
+    for row in removed:
+        tombstones[row] = 1
+    for row in range(rows, appended):
+        tombstones[row] = 0
+    mm.flush()
+    mm[16:16 + size] = blobs[1]
+
+    added = appended - rows
+    updated = len([row for row, c in zip(targets, changed) if c and row < rows])
+    return {"added": added, "updated": updated, "removed": len(removed), "unchanged": len(targets) - added - updated}
+
+
+class OfferSnapshot(object):
+    """A snapshot file written by write_offer_snapshot, memory-mapped. Columns are read (paged
+    in) only when asked for. Row numbers count tombstoned rows too; live() lists the others.
+    Holds a shared lock on the file until closed, which keeps syncs out: close it promptly.
+
+    :param str path: snapshot file.
+    """
+
+    def __init__(self, path: str):
+        import mmap
+        self._lock = _flock(path + ".lock", shared=True)
+        self._lock.__enter__()
+        self.mm = None
+        try:
+            with open(path, "rb") as f:
+                if f.read(8) != OFFER_SNAPSHOT_MAGIC:
+                    raise ValueError("{} is not an offers snapshot".format(path))
+                size, = struct.unpack("<Q", f.read(8))
+                self.header = json.loads(f.read(size))
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.header.get("version") != OFFER_SNAPSHOT_VERSION or self.header.get("byteorder") != sys.byteorder:
+                raise ValueError("{} was written by an incompatible client, take a new snapshot".format(path))
+            if self.header.get("syncing"):
+                raise ValueError("{} was left incomplete by an interrupted sync, take a new snapshot".format(path))
+        except BaseException:
+            self.close()
+            raise
+        self.path = path
+        self.rows = self.header["rows"]
+        self.deleted = self.header["deleted"]
+        self.columns = self.header["columns"]
+
+    @property
+    def age(self) -> float:
+        """Seconds since the offers were last downloaded."""
+        return time.time() - self.header["synced"]
+
+    def _view(self, info: Dict) -> memoryview:
+        itemsize = struct.calcsize(info["typecode"])
+        return memoryview(self.mm)[info["offset"]:info["offset"] + self.rows * itemsize].cast(info["typecode"])
+
+    def column(self, name: str) -> memoryview:
+        """The raw typed array of a column (codes for "str" columns), without copying."""
+        return self._view(self.columns[name])
+
+    def tombstones(self) -> memoryview:
+        """int8 per row, 1 for rows whose offer is gone."""
+        return self._view(self.header["tombstones"])
+
+    def live(self) -> List[int]:
+        """Row numbers of the offers that aren't tombstoned."""
+        if not self.deleted:
+            return list(range(self.rows))
+        return [i for i, dead in enumerate(self.tombstones()) if not dead]
+
+    def ranks(self, name: str) -> List[int]:
+        """For a "str" column, the position of each code's string in sorted order (the
+        dictionary is only sorted until a sync appends to it)."""
+        dictionary = self.columns[name]["dictionary"]
+        ranks = [0] * len(dictionary)
+        for rank, code in enumerate(sorted(range(len(dictionary)), key=dictionary.__getitem__)):
+            ranks[code] = rank
+        return ranks
+
+    def values(self, name: str, indices=None) -> List:
+        """A column decoded to Python values, with None for nulls (and for columns not in the file),
+        for the rows at indices (default: the live ones)."""
+        indices = self.live() if indices is None else indices
+        if name not in self.columns:
+            return [None] * len(indices)
+        info, data = self.columns[name], self.column(name)
+        data = [data[i] for i in indices]
+        kind = info["kind"]
+        if kind == "str":
+            dictionary = info["dictionary"]
+            return [None if c < 0 else dictionary[c] for c in data]
+        if kind == "bool":
+            return [None if v < 0 else bool(v) for v in data]
+        if kind == "int":
+            return [None if v == OFFER_SNAPSHOT_NULL_INT else v for v in data]
+        return [None if v != v else v for v in data]
+
+    def offers(self, indices=None, names=None) -> List[Dict]:
+        """Rebuilds offers as dicts, for the rows at indices (default: the live ones) and the columns in names (default: all)."""
+        indices = self.live() if indices is None else indices
+        names = list(self.columns) if names is None else names
+        if not names:
+            return [{} for _ in indices]
+        columns = [self.values(name, indices) for name in names]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def close(self):
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # a column view is still in use; the mapping goes away with it
+        if self._lock is not None:
+            self._lock.__exit__(None, None, None)
+            self._lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# search offers --local evaluates the parse_query() dict against a snapshot. With NumPy installed
+# each comparison becomes a boolean mask over the mapped column and the order a lexsort;
+# without it the same plan runs as plain Python loops. Semantics follow the API:
+#  - a null value matches no comparison, except "field == None" / "field != None";
+#  - a null "rented" counts as False (see offer_passes_rented_filter);
+#  - string fields are compared through their dictionary (one test per distinct value), with
+#    driver_version compared as numeric_version() and geolocation by its country code;
+#  - -o sorts with nulls last in either direction, ties keeping the snapshot's order.
+OFFER_QUERY_OPS = ("eq", "neq", "lt", "lte", "gt", "gte", "in", "notin")
+# keys of a search offers query that aren't field comparisons
+OFFER_QUERY_SETTINGS = ("order", "type", "limit", "allocated_storage", "disable_bundling")
+
+
+def _version_number(version) -> Optional[int]:
+    """numeric_version() for driver_version values, None (quietly) for malformed ones."""
+    if isinstance(version, int):
+        return version
+    parts = str(version).split(".")
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        return int(version) if str(version).isdigit() else None
+    return int("".join(p.zfill(3) for p in parts))
+
+
+def _offer_value_test(op: str, operand):
+    """A function value -> bool for one comparison, False for a null value."""
+    if op in ("in", "notin"):
+        members = set(operand)
+        return (lambda v: v is not None and v in members) if op == "in" else (lambda v: v is not None and v not in members)
+    compare = {"eq": lambda a, b: a == b, "neq": lambda a, b: a != b, "lt": lambda a, b: a < b,
+               "lte": lambda a, b: a <= b, "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b}[op]
+    return lambda v: v is not None and v == v and compare(v, operand)
+
+
+class LocalOfferQuery(object):
+    """A search offers query compiled against an OfferSnapshot.
+
+    :param OfferSnapshot snapshot:
+    :param dict query: as built by search__offers (parse_query() output plus order/limit/...).
+    """
+
+    def __init__(self, snapshot, query: Dict):
+        self.snapshot = snapshot
+        self.order = [(field, direction) for field, direction in query.get("order", []) if field in snapshot.columns]
+        self.limit = int(query["limit"]) if query.get("limit") else None
+        self.skipped = []       # fields the snapshot has no column for
+        self.predicates = []    # (field, op, operand, kind, lut)
+        for field, comparisons in query.items():
+            if field in OFFER_QUERY_SETTINGS or not isinstance(comparisons, dict):
+                continue
+            for op, value in comparisons.items():
+                if op not in OFFER_QUERY_OPS:
+                    raise ValueError("unsupported operator {} for {}".format(op, field))
+                if field not in snapshot.columns:
+                    self.skipped.append(field)
+                    continue
+                self.predicates.append(self._compile(field, op, value))
+
+    def _compile(self, field: str, op: str, value):
+        info = self.snapshot.columns[field]
+        kind = info["kind"]
+        if value is None:
+            if op not in ("eq", "neq"):
+                raise ValueError("{} {} None: only == and != can compare with None".format(field, op))
+            return field, "isnull" if op == "eq" else "notnull", None, kind, None
+        values = value if op in ("in", "notin") else [value]
+        if kind == "str":
+            derive = str
+            if field == "driver_version":
+                derive, values = _version_number, [_version_number(v) for v in values]
+            elif field == "geolocation":
+                derive = lambda g: g.rsplit(",", 1)[-1].strip()
+            operand = values if op in ("in", "notin") else values[0]
+            test = _offer_value_test(op, operand)
+            # one test per distinct string; rows then look their code up
+            return field, op, operand, kind, [test(derive(d)) for d in info["dictionary"]]
+        if kind == "bool":
+            values = [v if isinstance(v, bool) else str(v).lower() in ("true", "1") for v in values]
+        else:
+            values = [float(v) for v in values]
+        return field, op, values if op in ("in", "notin") else values[0], kind, None
+
+    def indices(self) -> List[int]:
+        """Row numbers of the matching offers, in order and limited."""
+        try:
+            import numpy
+        except ImportError:
+            return self._indices_python()
+        return self._indices_numpy(numpy)
+
+    def _numpy_column(self, np, field):
+        info = self.snapshot.columns[field]
+        return np.frombuffer(self.snapshot.mm, dtype=np.dtype(info["typecode"]), count=self.snapshot.rows, offset=info["offset"])
+
+    def _numpy_nulls(self, np, field, column):
+        kind = self.snapshot.columns[field]["kind"]
+        if kind == "float":
+            return np.isnan(column)
+        if kind == "int":
+            return column == OFFER_SNAPSHOT_NULL_INT
+        if kind == "bool" and field == "rented":
+            return np.zeros(len(column), dtype=bool)
+        return column < 0
+
+    def _indices_numpy(self, np) -> List[int]:
+        if self.snapshot.deleted:
+            mask = np.frombuffer(self.snapshot.mm, dtype=np.int8, count=self.snapshot.rows,
+                                 offset=self.snapshot.header["tombstones"]["offset"]) == 0
+        else:
+            mask = np.ones(self.snapshot.rows, dtype=bool)
+        for field, op, operand, kind, lut in self.predicates:
+            column = self._numpy_column(np, field)
+            if kind == "bool" and field == "rented":
+                column = np.where(column < 0, 0, column)
+            nulls = self._numpy_nulls(np, field, column)
+            if op in ("isnull", "notnull"):
+                mask &= nulls if op == "isnull" else ~nulls
+                continue
+            if lut is not None:
+                lut = np.append(np.array(lut, dtype=bool), False)  # code -1 (null) looks up the False on the end
+                mask &= lut[column]
+                continue
+            if op in ("in", "notin"):
+                hit = np.isin(column, np.asarray(operand))  # no cast: 1.5 must not match 1
+                mask &= ~nulls & (hit if op == "in" else ~hit)
+                continue
+            compare = {"eq": np.equal, "neq": np.not_equal, "lt": np.less, "lte": np.less_equal,
+                       "gt": np.greater, "gte": np.greater_equal}[op]
+            mask &= ~nulls & compare(column, operand)
+        selected = np.flatnonzero(mask)
+        if self.order and len(selected):
+            keys = []
+            for field, direction in self.order:
+                column = self._numpy_column(np, field)[selected]
+                nulls = self._numpy_nulls(np, field, column)
+                if self.snapshot.columns[field]["kind"] == "str":
+                    column = np.array(self.snapshot.ranks(field) + [0], dtype=np.int64)[column]
+                key = column.astype(np.float64)
+                if direction == "desc":
+                    key = -key
+                key[nulls] = np.inf
+                keys.append(key)
+            selected = selected[np.lexsort(keys[::-1])]  # lexsort's last key is the primary one
+        if self.limit is not None:
+            selected = selected[:self.limit]
+        return selected.tolist()
+
+    def _python_values(self, field):
+        """The raw column as a list, with nulls as None ("str" columns stay codes)."""
+        kind = self.snapshot.columns[field]["kind"]
+        column = self.snapshot.column(field).tolist()
+        if kind == "float":
+            return [None if v != v else v for v in column]
+        if kind == "int":
+            return [None if v == OFFER_SNAPSHOT_NULL_INT else v for v in column]
+        if kind == "bool":
+            return [(False if field == "rented" else None) if v < 0 else bool(v) for v in column]
+        return [None if v < 0 else v for v in column]
+
+    def _indices_python(self) -> List[int]:
+        selected = self.snapshot.live()
+        for field, op, operand, kind, lut in self.predicates:
+            column = self._python_values(field)
+            if op in ("isnull", "notnull"):
+                selected = [i for i in selected if (column[i] is None) == (op == "isnull")]
+            elif lut is not None:
+                selected = [i for i in selected if column[i] is not None and lut[column[i]]]
+            else:
+                test = _offer_value_test(op, operand)
+                selected = [i for i in selected if test(column[i])]
+        selected = list(selected)
+        for field, direction in reversed(self.order):  # stable sorts, least significant key first
+            column = self._python_values(field)
+            if self.snapshot.columns[field]["kind"] == "str":
+                ranks = self.snapshot.ranks(field)
+                column = [None if c is None else ranks[c] for c in column]
+            present = [i for i in selected if column[i] is not None]
+            present.sort(key=column.__getitem__, reverse=direction == "desc")
+            selected = present + [i for i in selected if column[i] is None]
+        return selected[:self.limit] if self.limit is not None else selected
+
+
+def offer_snapshot_stale(path: str, max_staleness: float, storage: float) -> bool:
+    """Whether the snapshot at path is missing, unreadable, priced for other storage or older than max_staleness seconds."""
+    try:
+        with OfferSnapshot(path) as snapshot:
+            return snapshot.age > max_staleness or snapshot.header.get("storage") != storage
+    except (OSError, ValueError):
+        return True
+
+
+def refresh_offer_snapshot(args, path: str, offer_type: str, storage: float, limit: int = 100000,
+                           full: bool = False) -> Optional[Dict]:
+    """Downloads the offer market and syncs it into the snapshot at path, or rewrites the file
+    when full is set or a sync isn't possible. Returns the sync counts ("rewritten" set for a
+    rewrite, plus "seconds"), or None if the search failed."""
+    search_args = argparse.Namespace(**vars(args))
+    search_args.type, search_args.storage, search_args.limit = offer_type, storage, limit
+    search_args.no_default, search_args.query, search_args.order = True, None, "score-"
+    search_args.new = search_args.disable_bundling = search_args.local = False
+    search_args.raw = search_args.raw_stream = True
+    start = time.time()
+    offers = search__offers(search_args)
+    if not isinstance(offers, types.GeneratorType):
+        return None
+    offers = list(offers)
+    meta = {"type": offer_type, "storage": storage}
+    stats = None if full else sync_offer_snapshot(path, offers, meta)
+    if stats is None:
+        write_offer_snapshot(path, offers, meta)
+        stats = {"added": len(offers), "updated": 0, "removed": 0, "unchanged": 0, "rewritten": True}
+    stats["seconds"] = round(time.time() - start, 3)
+    return stats
+
+
+@parser.command(
+    argument("-t", "--type", default="on-demand", help="Pricing to snapshot: 'on-demand', 'reserved', or 'bid'(interruptible). default: on-demand"),
+    argument("--storage", type=float, default=5.0, help="Amount of storage to use for pricing, in GiB. default=5.0GiB"),
+    argument("--limit", type=int, default=100000, help="max offers to download (default: %(default)s)"),
+    argument("--output", type=str, help="snapshot file to write (default: in the cache directory, one per --type)"),
+    argument("--info", action="store_true", help="describe the existing snapshot instead of taking a new one"),
+    argument("--full", action="store_true", help="rewrite the snapshot from the download instead of syncing it in place"),
+    argument("--compact", action="store_true", help="rewrite the existing snapshot without its tombstoned rows, without downloading"),
+    usage="vastai offers snapshot [--type TYPE] [--storage GiB] [--limit N] [--output PATH] [--info | --full | --compact]",
+    help="Download the whole offer market into a local columnar snapshot",
+    epilog=deindent("""
+        Runs one search offers call without the default query (-n) and a high --limit, and stores the result
+        in a compact columnar file: one typed array per offer field, with string fields such as gpu_name,
+        geolocation, verification and cpu_arch dictionary-encoded. The file is memory-mapped when read, so
+        a search against it only reads the columns it uses.
+
+        When a snapshot for the same --type and --storage exists, the download is synced into it in place:
+        offers are matched by id, changed values are overwritten, new offers appended and offers that are
+        gone marked deleted (tombstoned). The file is rewritten instead, which also compacts it, when it
+        is out of room, has too many tombstones or the offers gained a field. 'search offers --local
+        --max-staleness SECONDS' syncs the snapshot first when it is older than that.
+
+        Examples:
+            vastai offers snapshot
+            vastai offers snapshot --type bid
+            vastai offers snapshot --info
+            vastai offers snapshot --compact
+    """),
+)
+def offers__snapshot(args):
+    """Downloads the offer market into an OfferSnapshot file.
+
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the snapshot header (and the sync's counts) with --raw.
+    """
+    path = args.output or offer_snapshot_path(args.type)
+    stats = None
+    if args.compact:
+        try:
+            with OfferSnapshot(path) as snapshot:
+                meta = {k: snapshot.header.get(k) for k in ("type", "storage", "synced")}
+                offers = snapshot.offers()
+            write_offer_snapshot(path, offers, meta)  # after closing: the rewrite waits for readers
+        except (OSError, ValueError) as e:
+            print("no usable snapshot: {}".format(e))
+            return 1
+    elif not args.info:
+        stats = refresh_offer_snapshot(args, path, args.type, args.storage, args.limit, full=args.full)
+        if stats is None:
+            return 1
+    try:
+        with OfferSnapshot(path) as snapshot:
+            header = snapshot.header
+    except (OSError, ValueError) as e:
+        print("no usable snapshot: {}".format(e))
+        return 1
+    if args.raw:
+        return dict(header, path=path, columns=sorted(header["columns"]), sync=stats)
+    if stats is not None and not stats.get("rewritten"):
+        print("synced in {seconds:.1f}s: {added} new, {updated} changed, {removed} gone, {unchanged} unchanged".format(**stats))
+    print("{} offers ({} deleted rows), {} columns, {:.1f} KiB, synced {} ago: {}".format(
+        header["rows"] - header["deleted"], header["deleted"], len(header["columns"]), os.path.getsize(path) / 1024.0,
+        timedelta(seconds=int(time.time() - header["synced"])), path))
+    return 0
+
+
+def search_offers_local(args, query: Dict, snapshot):
+    """search offers --local: runs query against the snapshot and displays (or returns) the offers."""
+    with snapshot:
+        if snapshot.header.get("storage") != query["allocated_storage"]:
+            print("Warning: the snapshot was priced for --storage {}".format(snapshot.header.get("storage")), file=sys.stderr)
+        plan = LocalOfferQuery(snapshot, query)
+        for field in sorted(set(plan.skipped)):
+            print("Warning: the snapshot has no {} column; not filtering on it".format(field), file=sys.stderr)
+        rows = snapshot.offers(plan.indices())
+    if args.raw:
+        return rows
+    display_table(rows, displayable_fields_reserved if args.type == "reserved" else displayable_fields)
+
+
 templates_fields = {
     "creator_id",#              int        ID of creator
     "created_at",#              float      time of initial template creation (UTC epoch timestamp)
@@ -3210,19 +6064,25 @@ def search__templates(args):
         print("Error: ", e)
         return 1  
     url = apiurl(args, "/template/", {"select_cols" : ['*'], "select_filters" : query})
-    r = requests.get(url, headers=headers)
-    if r.status_code != 200:
-        print(r.text)
-        r.raise_for_status()
-    elif 'json' in r.headers.get("Content-Type"):
-        rows = r.json().get('templates', [])
+
+    def fetch():
+        r = http_get(args, url, headers=headers)
+        if r.status_code != 200:
+            print(r.text)
+            r.raise_for_status()
+        elif 'json' in r.headers.get("Content-Type"):
+            return r.json()
+        else:
+            print(r.text)
+            print("failed with error {r.status_code}".format(**locals()))
+
+    body = cached_get_json(args, "templates", url, headers, fetch=fetch)
+    if body is not None:
+        rows = body.get('templates', [])
         if True: #args.raw:
             print(json.dumps(rows, indent=1, sort_keys=True))
         else:
             display_table(rows, displayable_fields)
-    else:
-        print(r.text)
-        print("failed with error {r.status_code}".format(**locals()))
 
 
 @parser.command(
@@ -3234,6 +6094,7 @@ def set__api_key(args):
     """Caution: a bad API key will make it impossible to connect to the servers.
     :param argparse.Namespace args: should supply all the command-line options
     """
+    os.makedirs(DIRS['config'], exist_ok=True)
     with open(APIKEY_FILE, "w") as writer:
         writer.write(args.new_api_key)
     print("Your api key has been saved in {}".format(APIKEY_FILE))
@@ -3275,7 +6136,7 @@ def set__user(args):
     with open(args.file, 'r') as file:
         params = json.load(file)
     url = apiurl(args, "/users/")
-    r = requests.put(url, headers=headers, json=params)
+    r = http_put(args, url, headers=headers, json=params, idempotent=True)
     r.raise_for_status()
     print(f"{r.json()}")
 
@@ -3420,6 +6281,12 @@ def show__ssh_keys(args):
     url = apiurl(args, "/ssh/")
     r = http_get(args, url, headers=headers)
     r.raise_for_status()
+    try:
+        rows = r.json()
+    except ValueError:
+        rows = None
+    if isinstance(rows, list):
+        update_completion_index(args, ssh_key_ids=[row.get("id") for row in rows if isinstance(row, dict)])
     if args.raw:
         return r
     else:
@@ -3497,9 +6364,7 @@ def show__connections(args):
     """
     req_url = apiurl(args, "/users/cloud_integrations/");
     print(req_url)
-    r = http_get(args, req_url, headers=headers);
-    r.raise_for_status()
-    rows = r.json()
+    rows = cached_get_json(args, "connections", req_url, headers)
 
     if args.raw:
         return rows
@@ -3760,6 +6625,9 @@ def show__instances(args = {}, extra = {}):
     r = http_get(args, req_url)
     r.raise_for_status()
     rows = r.json()["instances"]
+    update_completion_index(args, instance_ids=[row.get("id") for row in rows],
+                            instance_machine_ids=[row.get("machine_id") for row in rows],
+                            instance_labels=[row.get("label") for row in rows])
     for row in rows:
         row = {k: strip_strings(v) for k, v in row.items()} 
         row['duration'] = time.time() - row['start_date']
@@ -3915,7 +6783,7 @@ def transfer__credit(args: argparse.Namespace):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
 
     if (r.status_code == 200):
@@ -3959,7 +6827,7 @@ def update__autogroup(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
     if 'application/json' in r.headers.get('Content-Type', ''):
         try:
@@ -3993,7 +6861,7 @@ def update__endpoint(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
     if 'application/json' in r.headers.get('Content-Type', ''):
         try:
@@ -4016,7 +6884,7 @@ def update__env_var(args):
     """Update an existing environment variable for the current user."""
     url = apiurl(args, "/secrets/")
     data = {"key": args.name, "value": args.value}
-    r = http_put(args, url, headers=headers, json=data)
+    r = http_put(args, url, headers=headers, json=data, idempotent=True)
     r.raise_for_status()
 
     result = r.json()
@@ -4025,6 +6893,25 @@ def update__env_var(args):
     else:
         print(f"Failed to update environment variable: {result.get('msg', 'Unknown error')}")
 
+
+def update_instance_json(args, id) -> Dict:
+    json_blob = {"id": id}
+    
+    if args.template_id:
+        json_blob["template_id"] = args.template_id
+    if args.template_hash_id:
+        json_blob["template_hash_id"] = args.template_hash_id
+    if args.image:
+        json_blob["image"] = args.image
+    if args.args:
+        json_blob["args"] = args.args
+    if args.env:
+        json_blob["env"] = args.env
+    if args.onstart:
+        json_blob["onstart"] = args.onstart
+    return json_blob
+
+
 @parser.command(
     argument("id", help="id of instance to update", type=int),
     argument("--template_id", help="new template ID to associate with the instance", type=int),
@@ -4045,26 +6932,13 @@ def update__instance(args):
     :rtype:
     """
     url = apiurl(args, f"/instances/update_template/{args.id}/")
-    json_blob = {"id": args.id}
-    
-    if args.template_id:
-        json_blob["template_id"] = args.template_id
-    if args.template_hash_id:
-        json_blob["template_hash_id"] = args.template_hash_id
-    if args.image:
-        json_blob["image"] = args.image
-    if args.args:
-        json_blob["args"] = args.args
-    if args.env:
-        json_blob["env"] = args.env
-    if args.onstart:
-        json_blob["onstart"] = args.onstart
+    json_blob = update_instance_json(args, args.id)
 
     if args.explain:
         print("request json: ")
         print(json_blob)
     
-    r = http_put(args, url, headers=headers, json=json_blob)
+    r = http_put(args, url, headers=headers, json=json_blob, idempotent=False)
 
     if r.status_code == 200:
         response_data = r.json()
@@ -4078,6 +6952,36 @@ def update__instance(args):
         print(f"Failed to update instance {args.id} with error {r.status_code}: {r.text}")
 
 
+@parser.command(
+    argument("ids", help="ids of instances to update", type=int, nargs='+'),
+    argument("--template_id", help="new template ID to associate with the instances", type=int),
+    argument("--template_hash_id", help="new template hash ID to associate with the instances", type=str),
+    argument("--image", help="new image UUID for the instances", type=str),
+    argument("--args", help="new arguments for the instances", type=str),
+    argument("--env", help="new environment variables for the instances", type=json.loads),
+    argument("--onstart", help="new onstart script for the instances", type=str),
+    argument("--parallel", help="max requests in flight (default: 8)", type=int, default=8),
+    usage="vastai update instances ID0 ID1 ID2... [OPTIONS]",
+    help="Update recreate a list of instances from a new/updated template",
+    epilog=deindent("""
+        Prints a line per instance and a summary, and exits with status 1 if any instance could not be updated.
+        With --raw, prints {"updated": [...], "failed": [...], "results": [...]}.
+        Example: vastai update instances $(vastai show instances -q) --template_hash_id 661d064bbda1f2a133816b6d55da07c3
+    """),
+)
+def update__instances(args):
+    """
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-id results with --raw.
+    """
+    if args.explain:
+        print("request json: ")
+        print(update_instance_json(args, args.ids[0]))
+    return bulk_instance_command(args, lambda id: http_put(args, apiurl(args, f"/instances/update_template/{id}/"),
+                                                           headers=headers, json=update_instance_json(args, id), idempotent=False),
+                                 "updating", "updated")
+
+
 @parser.command(
     argument("id", help="id of the role", type=int),
     argument("--name", help="name of the template", type=str),
@@ -4088,7 +6992,7 @@ def update__instance(args):
 def update__team_role(args):
     url = apiurl(args, "/team/roles/{id}/".format(id=args.id))
     permissions = load_permissions_from_file(args.permissions)
-    r = http_put(args, url,  headers=headers, json={"name": args.name, "permissions": permissions})
+    r = http_put(args, url,  headers=headers, json={"name": args.name, "permissions": permissions}, idempotent=True)
     r.raise_for_status()
     if args.raw:
         return r
@@ -4166,7 +7070,7 @@ def update__template(args):
         print("request json: ")
         print(json_blob)
 
-    r = http_put(args, url, headers=headers, json=json_blob)
+    r = http_put(args, url, headers=headers, json=json_blob, idempotent=True)
     r.raise_for_status()
     try:
         rj = r.json()
@@ -4182,7 +7086,7 @@ def update__template(args):
 
 
 @parser.command(
-    argument("id", help="id of the ssh key to update", type=int),
+    argument("id", help="id of the ssh key to update", type=int, completer=complete_ssh_key_id),
     argument("ssh_key", help="value of the ssh_key", type=str),
     usage="vastai update ssh-key id ssh_key",
     help="Update an existing ssh key",
@@ -4190,7 +7094,7 @@ def update__template(args):
 def update__ssh_key(args):
     ssh_key = get_ssh_key(args.ssh_key)
     url = apiurl(args, "/ssh/{id}/".format(id=args.id))
-    r = http_put(args, url,  headers=headers, json={"ssh_key": ssh_key})
+    r = http_put(args, url,  headers=headers, json={"ssh_key": ssh_key}, idempotent=True)
     r.raise_for_status()
     print(r.json())
 
@@ -4403,7 +7307,7 @@ def cancel__maint(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
     print(r.text)
     print(f"Cancel maintenance window(s) scheduled for machine {args.id} success".format(r.json()))
@@ -4414,7 +7318,7 @@ def cleanup_machine(args, machine_id):
 
     if (args.explain):
         print("request json: ")
-    r = http_put(args, req_url, headers=headers, json={})
+    r = http_put(args, req_url, headers=headers, json={}, idempotent=False)
 
     if (r.status_code == 200):
         rj = r.json()
@@ -4470,7 +7374,7 @@ def delete__machine(args):
         print("failed with error {r.status_code}".format(**locals()));
 
 
-def list_machine(args, id):
+def list_machine_request(args, id) -> requests.Response:
     req_url = apiurl(args, "/machines/create_asks/")
 
     json_blob = {'machine': id, 'price_gpu': args.price_gpu,
@@ -4479,7 +7383,11 @@ def list_machine(args, id):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, req_url, headers=headers, json=json_blob)
+    return http_put(args, req_url, headers=headers, json=json_blob, idempotent=True)
+
+
+def list_machine(args, id):
+    r = list_machine_request(args, id)
 
     if (r.status_code == 200):
         rj = r.json()
@@ -4549,19 +7457,79 @@ def list__machine(args):
     argument("-r", "--discount_rate", help="Max long term prepay discount rate fraction, default: 0.4 ", type=float),
     argument("-m", "--min_chunk", help="minimum amount of gpus", type=int),
     argument("-e", "--end_date", help="contract offer expiration - the available until date (optional, in unix float timestamp or MM/DD/YYYY format)", type=str),
+    argument("--parallel", help="max machines listed at the same time (default: 8)", type=int, default=8),
+    argument("--max-retries", help="times to retry machines whose listing failed with a network or server error (default: --retry minus one)", type=int),
     usage="vastai list machines IDs [options]",
     help="[Host] list machines for rent",
     epilog=deindent("""
         This variant can be used to list or update the listings for multiple machines at once with the same args.
+        Up to --parallel machines are listed at a time. Machines whose request failed with a network error or a
+        429/5xx response are tried again after a backoff, up to --max-retries more times (by default, --retry
+        tries in all), while the others carry on;
+        machines that were listed, or that the server rejected, are not sent again. Prints a table of the results, the reasons for any failures and a
+        summary, and exits with status 1 if any machine could not be listed.
+        With --raw, prints {"listed": [...], "failed": [...], "extended": N, "results": [...]}.
         You could extend the end dates of all your machines using a command combo like this:
-        ./vast.py list machines $(./vast.py show machines -q) -e 12/31/2024 --retry 6
+        ./vast.py list machines $(./vast.py show machines -q) -e 12/31/2024
     """)
 )
 def list__machines(args):
-    """
-    """
-    return [list_machine(args, id) for id in args.ids]
-    return res
+    """Lists many machines concurrently, retrying only the ones that failed transiently.
+
+    :param argparse.Namespace args: should supply all the command-line options
+    :rtype int|dict: exit status, or the per-machine results with --raw.
+    """
+    max_retries = args.max_retries if args.max_retries is not None else int(args.retry) - 1
+    if args.parallel < 1 or max_retries < 0:
+        raise ValueError("--parallel must be at least 1 and --max-retries at least 0")
+    ids = list(dict.fromkeys(args.ids))
+    results = {id: {"id": id, "status": "failed", "extended": 0, "attempts": 0} for id in ids}
+    # Retries (--max-retries, or --retry tries in all) are made by the WorkQueue below, where a
+    # machine waiting out its backoff doesn't hold a thread; each request itself is sent once.
+    request_args = argparse.Namespace(**vars(args))
+    request_args.retry_policy = RetryPolicy(max_attempts=1)
+
+    def list_one(id):
+        """Lists one machine into results[id]; returns False if it is worth trying again."""
+        result = results[id]
+        result["attempts"] += 1
+        try:
+            r = list_machine_request(request_args, id)
+            rj = r.json() if r.status_code == 200 else {}
+        except requests.exceptions.RequestException as e:
+            result["msg"] = str(e)
+            if not _is_transient_error(e):
+                raise
+            return False
+        except ValueError as e:
+            result["msg"] = str(e)
+            return True
+        if r.status_code != 200:
+            result["msg"] = "failed with error {}".format(r.status_code)
+            return r.status_code != 429 and r.status_code < 500
+        if not rj.get("success"):
+            result["msg"] = rj.get("msg") or "listing rejected"
+            return True
+        result.update(status="listed", extended=rj.get("extended", 0))
+        result.pop("msg", None)
+        return True
+
+    exec_with_threads(list_one, ids, nt=args.parallel, max_retries=max_retries, progress=not args.raw)
+
+    ordered = [results[id] for id in ids]
+    listed = [r["id"] for r in ordered if r["status"] == "listed"]
+    failed = [r["id"] for r in ordered if r["status"] != "listed"]
+    extended = builtins.sum(r["extended"] for r in ordered)
+    if args.raw:
+        return {"listed": listed, "failed": failed, "extended": extended, "results": ordered}
+    display_table(ordered, machine_listing_fields)
+    for r in ordered:
+        if "msg" in r:
+            print("machine {}: {}".format(r["id"], r["msg"]))
+    print("listed {} of {} machines{}".format(len(listed), len(ids), ", failed: {}".format(len(failed)) if failed else ""))
+    if extended:
+        print("extended {} client contracts to {}".format(extended, args.end_date))
+    return 1 if failed else 0
 
 
 
@@ -4630,7 +7598,7 @@ def set__defjob(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, req_url, headers=headers, json=json_blob)
+    r = http_put(args, req_url, headers=headers, json=json_blob, idempotent=False)
     if (r.status_code == 200):
         rj = r.json();
         if (rj["success"]):
@@ -4733,7 +7701,7 @@ def set__min_bid(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=True)
     r.raise_for_status()
     print("Per gpu min bid price changed".format(r.json()))
 
@@ -4772,7 +7740,7 @@ def schedule__maint(args):
     if (args.explain):
         print("request json: ")
         print(json_blob)
-    r = http_put(args, url,  headers=headers,json=json_blob)
+    r = http_put(args, url,  headers=headers,json=json_blob, idempotent=False)
     r.raise_for_status()
     print(f"Maintenance window scheduled for {dt} success".format(r.json()))
 
@@ -4819,6 +7787,7 @@ def show__machines(args):
     r = http_get(args, req_url)
     r.raise_for_status()
     rows = r.json()["machines"]
+    update_completion_index(args, machine_ids=[row.get("id") for row in rows])
     if args.raw:
         return r
     else:
@@ -5084,6 +8053,7 @@ def run_machinetester(ip_address, port, instance_id, machine_id, delay, args, ap
             retry=3,
             raw=True,
             debugging=args.debugging,
+            deadline_at=getattr(args, "deadline_at", None),
         )
         try:
             instance_info = show__instance(show_args)
@@ -5102,22 +8072,24 @@ def run_machinetester(ip_address, port, instance_id, machine_id, delay, args, ap
                 debug_print(args, f"is_instance(): Error: {e}")
             return 'unknown'
 
-    # Prepare destroy_args with required attributes set to False as needed
+    # Prepare destroy_args with required attributes set to False as needed.
+    # No deadline_at: the cleanup must still go through once the deadline has passed.
     destroy_args = argparse.Namespace(api_key=api_key, url="https://console.vast.ai", retry=3, explain=False, raw=args.raw, debbuging=args.debugging,)
 
     # Delay start if specified
     if delay > 0:
         if args.debugging:
             debug_print(args, f"Sleeping for {delay} seconds before starting tests.")
-        time.sleep(delay)
+        time.sleep(max(0, deadline_cap(args, time.time() + delay) - time.time()))
 
     start_time = time.time()
+    end_time = deadline_cap(args, start_time + 300)
     no_response_seconds = 0
     printed_lines = set()
     first_connection_established = False  # Flag to track first successful connection
     instance_destroyed = False  # Track whether the instance has been destroyed
     try:
-        while time.time() - start_time < 300:
+        while time.time() < end_time:
             # Check instance status with high priority for offline status
             status = is_instance(instance_id)
             if args.debugging:
@@ -5136,7 +8108,7 @@ def run_machinetester(ip_address, port, instance_id, machine_id, delay, args, ap
             try:
                 if args.debugging:
                     debug_print(args, f"Sending GET request to https://{ip_address}:{port}/progress")
-                response = requests.get(f'https://{ip_address}:{port}/progress', verify=False, timeout=10)
+                response = http_session().get(f'https://{ip_address}:{port}/progress', verify=False, timeout=10)
                 
                 if response.status_code == 200 and not first_connection_established:
                     progress_print(args, "Successfully established HTTPS connection to the server.")
@@ -5190,7 +8162,7 @@ def run_machinetester(ip_address, port, instance_id, machine_id, delay, args, ap
 
             if args.debugging:
                 debug_print(args, "Waiting for 20 seconds before the next check.")
-            time.sleep(20)
+            time.sleep(max(0, min(20, end_time - time.time())))
 
         if args.debugging:
             debug_print(args, f"Time limit reached. Destroying instance {instance_id}.")
@@ -5350,19 +8322,21 @@ def wait_for_instance(instance_id, api_key, args, destroy_args, timeout=900, int
         url=args.url,
         retry=args.retry,
         debugging=args.debugging,
+        deadline_at=getattr(args, "deadline_at", None),
     )
-    
+    end_time = deadline_cap(args, start_time + timeout)
+
     if args.debugging:
         debug_print(args, "Starting wait_for_instance with ID:", instance_id)
     
-    while time.time() - start_time < timeout:
+    while time.time() < end_time:
         try:
             # Directly call show__instance and capture the return value
             instance_info = show__instance(show_args)
             
             if not instance_info:
                 progress_print(args, f"No information returned for instance {instance_id}. Retrying...")
-                time.sleep(interval)
+                time.sleep(max(0, min(interval, end_time - time.time())))
                 continue  # Retry
 
             # Check for error in status_msg
@@ -5403,16 +8377,19 @@ def wait_for_instance(instance_id, api_key, args, destroy_args, timeout=900, int
             
             # Print feedback about the current status
             progress_print(args, f"Instance {instance_id} status: {actual_status}... waiting for 'running' status.")
-            time.sleep(interval)
+            time.sleep(max(0, min(interval, end_time - time.time())))
         
         except Exception as e:
             progress_print(args, f"Error retrieving instance info for {instance_id}: {e}. Retrying...")
             if args.debugging:
                 debug_print(args, f"Exception details: {str(e)}")
-            time.sleep(interval)
+            time.sleep(max(0, min(interval, end_time - time.time())))
     
     # Timeout reached without instance running
-    reason = f"Instance {instance_id} did not become running within {timeout} seconds."
+    if end_time < start_time + timeout:
+        reason = f"Instance {instance_id} did not become running before the deadline."
+    else:
+        reason = f"Instance {instance_id} did not become running within {timeout} seconds."
     progress_print(args, reason)
     return False, reason
 
@@ -5546,6 +8523,7 @@ def self_test__machine(args):
                     retry=args.retry,
                     debugging=args.debugging,
                     bid_price=None,  # Ensure bid_price is None
+                    deadline_at=getattr(args, "deadline_at", None),
                 )
 
                 # Create instance
@@ -5660,31 +8638,412 @@ except:
   pass
 
 
-def main():
-    global ARGS
+class _ThreadOutput(object):
+    """Stand-in for sys.stdout / sys.stderr that sends each thread's writes to that thread's
+    buffer, if it has set one, so commands running in parallel don't interleave their output."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def write(self, data: str) -> int:
+        return (getattr(self.local, "buffer", None) or self.fallback).write(data)
+
+    def flush(self):
+        (getattr(self.local, "buffer", None) or self.fallback).flush()
+
+    def isatty(self):
+        return False
+
+
+# Daemon side of `vastai serve`; the client side (forward_to_daemon) is at the top of the file.
+class _DaemonStream(object):
+    """File-like object that sends what a command prints to the client, as it is printed."""
+
+    def __init__(self, conn_file, fd: int):
+        self.conn_file = conn_file
+        self.fd = fd
+
+    def write(self, data: str) -> int:
+        if data:
+            self.conn_file.write(json.dumps({"fd": self.fd, "data": data}).encode() + b"\n")
+        return len(data)
+
+    def flush(self):
+        self.conn_file.flush()
+
+    def isatty(self):
+        return False
+
+
+def _exit_status(e: SystemExit) -> int:
+    """The process exit status SystemExit(e.code) would produce (the message goes to stderr)."""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def _apply_env(env: Dict) -> None:
+    for k, value in env.items():
+        if value is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = value
+
+
+class _ClientContexts(object):
+    """Gives daemon threads the working directory and DAEMON_ENV of their client. Both are
+    process-wide, so commands run concurrently only while their clients agree on them; a
+    command from a client that differs waits until the running ones are done."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._context = None
+        self._running = 0
+        self._saved = None
+
+    @contextmanager
+    def use(self, request: Dict):
+        env = {k: (request.get("env") or {}).get(k) for k in DAEMON_ENV}
+        context = (request.get("cwd"), tuple(sorted(env.items())))
+        with self._cond:
+            while self._running and self._context != context:
+                self._cond.wait()
+            if not self._running:
+                saved = os.getcwd(), {k: os.environ.get(k) for k in DAEMON_ENV}
+                _apply_env(env)
+                try:
+                    os.chdir(request.get("cwd") or saved[0])
+                except OSError:
+                    _apply_env(saved[1])
+                    raise
+                self._context, self._saved = context, saved
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                if not self._running:
+                    os.chdir(self._saved[0])
+                    _apply_env(self._saved[1])
+                    self._context = self._saved = None
+                    self._cond.notify_all()
+
+
+_client_contexts = _ClientContexts()
+
+
+def _serve_one(conn, stdout: _ThreadOutput, stderr: _ThreadOutput) -> None:
+    """Runs the command line a client sent on conn, sending back its output and exit status.
+    stdout/stderr are the _ThreadOutput objects installed as sys.stdout/sys.stderr."""
+    import traceback
+    with conn.makefile("rwb") as f:
+        request = json.loads(f.readline() or "null")
+        if not isinstance(request, dict):
+            return
+        status = 1
+        with _client_contexts.use(request):
+            stdout.local.buffer, stderr.local.buffer = _DaemonStream(f, 1), _DaemonStream(f, 2)
+            try:
+                run(list(request.get("argv") or []))
+                status = 0
+            except SystemExit as e:
+                status = _exit_status(e)
+            except (BrokenPipeError, ConnectionError):
+                raise
+            except Exception:
+                traceback.print_exc()
+            finally:
+                stdout.local.buffer = stderr.local.buffer = None
+        f.write(json.dumps({"exit": status}).encode() + b"\n")
+        f.flush()
+
+
+def _serve_connection(conn, stdout: _ThreadOutput, stderr: _ThreadOutput) -> None:
+    with conn:
+        try:
+            _serve_one(conn, stdout, stderr)
+        except (OSError, ValueError):
+            pass  # client went away or sent garbage; keep serving
+
+
+@parser.command(
+    argument("--socket", help="Unix socket to listen on (default: {})".format(SERVE_SOCKET), type=str),
+    usage="vastai serve [--socket PATH]",
+    help="Run a daemon that executes vastai commands for other vastai invocations",
+    epilog=deindent("""
+        Keeps one process running with the command registry built and HTTP connections to the
+        API open, and listens on a Unix socket (readable by your user only). While it runs, every
+        `vastai ...` invocation is forwarded to it and prints the daemon's output, which saves
+        the interpreter start, imports and TLS handshake of each call. Each invocation is served
+        on its own thread, with the invoking process's working directory and VAST_API_KEY;
+        invocations from different directories or with different keys take turns.
+
+        Commands that prompt for input or run local programs (copy, transfer credit, ...) still
+        run in the invoking process. Set VAST_NO_DAEMON=1 to bypass the daemon, and VAST_SERVE_SOCKET
+        to use another socket path (for both the daemon and its clients). Stop it with Ctrl-C or kill.
+
+        Example:
+            vastai serve &
+            for i in $(seq 100); do vastai show instance 12345 --raw; done
+    """),
+)
+def serve(args):
+    import socket
+    if not hasattr(socket, "AF_UNIX"):
+        print("vastai serve needs Unix domain sockets, which this platform doesn't have")
+        return 1
+    path = args.socket or SERVE_SOCKET
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            print("vastai serve: already running on {}".format(path))
+            return 1
+        except OSError:
+            os.remove(path)  # left behind by a daemon that didn't exit cleanly
+        finally:
+            probe.close()
+    parser.materialize_all()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(64)
+    if threading.current_thread() is threading.main_thread():
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # clean up the socket on kill, too
+    print("vastai serve: listening on {}".format(path), flush=True)
+    saved = sys.stdin, sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr = _ThreadOutput(sys.stdout), _ThreadOutput(sys.stderr)
+    sys.stdin = StringIO("")  # a prompt sees end of input instead of blocking the daemon
+    try:
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=_serve_connection, args=(conn, stdout, stderr), daemon=True).start()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved
+        listener.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+BATCH_COMMANDS_REJECTED = {"batch", "serve"}
+
+
+def _batch_json(res):
+    if isinstance(res, types.GeneratorType):
+        return list(res)
+    if isinstance(res, requests.Response):
+        try:
+            return res.json()
+        except ValueError:
+            return res.text
+    return res
+
+
+def _batch_run_line(batch_args, lineno: int, text: str, stdout: _ThreadOutput, stderr: _ThreadOutput) -> Dict:
+    """Runs one line of a batch file; returns its NDJSON result record."""
+    import shlex
+    record = {"line": lineno, "command": text, "status": 1}
+    out, err = StringIO(), StringIO()
+    stdout.local.buffer, stderr.local.buffer = out, err
+    try:
+        argv = shlex.split(text)
+        if argv and os.path.basename(argv[0]) in ("vastai", "vast", "vast.py"):
+            argv = argv[1:]
+        name = parser.find_command(argv)
+        if name in BATCH_COMMANDS_REJECTED:
+            raise ValueError("`{}` can't be run from a batch".format(name))
+        args = parser.parse_args(argv)
+        # options given to `vastai batch` apply to every line that doesn't set them itself
+        for a, kw in parser.global_args:
+            dest = a[-1].lstrip("-").replace("-", "_")
+            if dest != "api_key" and getattr(args, dest, None) == kw.get("default", False if kw.get("action") == "store_true" else None):
+                setattr(args, dest, getattr(batch_args, dest, None))
+        if args.api_key is api_key_guard:
+            args.api_key = batch_args.api_key
+        elif args.api_key != batch_args.api_key:
+            raise ValueError("--api-key can't differ between the lines of a batch; pass it to `vastai batch` instead")
+        if args.deadline != batch_args.deadline:
+            set_deadline(args, args.deadline)
+        else:
+            args.deadline_at = getattr(batch_args, "deadline_at", None)
+        args.raw = True
+        args.raw_stream = False
+        res = args.func(args)
+        if isinstance(res, int) and not isinstance(res, bool):
+            record["status"] = res  # the command's exit status, as run() would sys.exit() with it
+        else:
+            if isinstance(res, requests.Response):
+                res.raise_for_status()
+            record["result"] = _batch_json(res)
+            record["status"] = 0
+    except SystemExit as e:
+        record["status"] = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        if e.code is not None and not isinstance(e.code, int):
+            record["error"] = str(e.code)
+    except requests.exceptions.HTTPError as e:
+        record["status"], record["error"] = 1, http_error_message(e)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        record["status"], record["error"] = 1, str(e)
+    except Exception as e:
+        record["status"], record["error"] = 1, "{}: {}".format(type(e).__name__, e)
+    finally:
+        stdout.local.buffer = stderr.local.buffer = None
+    if out.getvalue():
+        record["stdout"] = out.getvalue()
+    if err.getvalue():
+        record["stderr"] = err.getvalue()
+    if record["status"] and "error" not in record:
+        # commands report failures on either stream
+        printed = (err.getvalue() or out.getvalue()).strip()
+        record["error"] = printed.splitlines()[-1] if printed else "exited with status {}".format(record["status"])
+    return record
+
+
+@parser.command(
+    argument("file", help="file with one vastai command per line, or - to read standard input", type=str),
+    argument("--parallel", help="number of lines to run at the same time (default: 1)", type=int, default=1),
+    argument("--stop-on-error", action="store_true", help="don't start any more lines after one fails"),
+    usage="vastai batch FILE|- [--parallel N] [--stop-on-error]",
+    help="Run many vastai commands in one process, printing one JSON result per line",
+    epilog=deindent("""
+        Reads one command per line (with or without a leading "vastai"; blank lines and lines
+        starting with # are skipped) and runs them all in this process, sharing its HTTP
+        connections, instead of starting the CLI once per command. Global options given to
+        batch (--url, --retry, --deadline, ...) apply to every line that doesn't set them
+        itself; a --deadline given to batch bounds the whole batch.
+
+        Prints one JSON object per line (NDJSON), in the order of the input:
+            {"line": 3, "command": "show instance 123", "status": 0, "result": {...}}
+        "result" is what the command returns with --raw; "stdout"/"stderr" hold anything it
+        printed and "error" why a line failed. "status" is the line's exit status: non-zero
+        if the command returned one, raised an error or got an HTTP error response. With --parallel N up to N lines
+        run at once; results are still printed in input order. The exit status is 0 if every
+        line succeeded, else 1.
+
+        Examples:
+            vastai batch commands.txt --parallel 8
+            printf 'show instances\\nshow user\\n' | vastai batch -
+    """),
+)
+def batch(args):
+    import collections
+    from concurrent.futures import ThreadPoolExecutor
+    if args.parallel < 1:
+        raise ValueError("--parallel must be at least 1")
+    parser.materialize_all()  # up front: building subparsers from several threads at once isn't safe
+    source = sys.stdin if args.file == "-" else open(args.file, "r")
+    out = sys.stdout
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr = _ThreadOutput(sys.stdout), _ThreadOutput(sys.stderr)
+    failed = False
+    try:
+        with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+            pending = collections.deque()
+            lines = ((n, line.strip()) for n, line in enumerate(source, 1))
+            lines = ((n, text) for n, text in lines if text and not text.startswith("#"))
+            # keep a few lines queued beyond the running ones, unless a failure must stop the batch
+            window = args.parallel if args.stop_on_error else 2 * args.parallel
+            while True:
+                while len(pending) < window and not (failed and args.stop_on_error):
+                    n, text = next(lines, (None, None))
+                    if n is None:
+                        break
+                    pending.append(executor.submit(_batch_run_line, args, n, text, stdout, stderr))
+                if not pending:
+                    break
+                record = pending.popleft().result()
+                failed = failed or record["status"] != 0
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+    finally:
+        sys.stdout, sys.stderr = saved
+        if source is not sys.stdin:
+            source.close()
+    args.raw = False  # the NDJSON above is the output; run() just exits with the status
+    return 1 if failed else 0
+
+
+def print_json_stream(rows, file=None) -> None:
+    """Prints rows as a JSON array while iterating over them. The output is the same as
+    json.dumps(list(rows), indent=1, sort_keys=True), without holding all the rows at once."""
+    out = file or sys.stdout
+    first = True
+    for row in rows:
+        out.write("[\n" if first else ",\n")
+        out.write(textwrap.indent(json.dumps(row, indent=1, sort_keys=True), " "))
+        first = False
+    out.write("[]\n" if first else "\n]\n")
+
+
+def add_global_arguments():
+    """Adds the options every command accepts. Only the first call has any effect."""
+    if any("--url" in a for a, kw in parser.global_args):
+        return
     parser.add_argument("--url", help="server REST api url", default=server_url_default)
     parser.add_argument("--retry", help="retry limit", default=3)
     parser.add_argument("--raw", action="store_true", help="output machine-readable json")
     parser.add_argument("--explain", action="store_true", help="output verbose explanation of mapping of CLI calls to HTTPS API endpoints")
-    parser.add_argument("--api-key", help="api key. defaults to using the one stored in {}".format(APIKEY_FILE), type=str, required=False, default=os.getenv("VAST_API_KEY", api_key_guard))
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the local cache of slow-changing responses (gpu names, templates, ...)")
+    parser.add_argument("--refresh", action="store_true", help="refetch responses that would be served from the local cache, and update it")
+    parser.add_argument("--deadline", type=float, help="give up (exit code 1) if the command hasn't finished within this many seconds, including retries and polling", default=None)
+    parser.add_argument("--api-key", help="api key. defaults to using the one stored in {}".format(APIKEY_FILE), type=str, required=False, default=api_key_guard)
 
-    ARGS = args = parser.parse_args()
 
-    if args.api_key is api_key_guard:
-        if os.path.exists(APIKEY_FILE):
-            with open(APIKEY_FILE, "r") as reader:
-                args.api_key = reader.read().strip()
-        else:
-            args.api_key = None
-    if args.api_key:
-        headers["Authorization"] = "Bearer " + args.api_key
+def main():
+    add_global_arguments()
 
     if TABCOMPLETE:
+        # answers the shell's completion request and exits; must see the unparsed command line
+        parser.materialize_all()
         myautocc = MyAutocomplete()
         myautocc(parser.parser)
 
+    status = None if _forwarded_early else forward_to_daemon(sys.argv[1:])
+    if status is not None:
+        sys.exit(status)
+    run()
+
+
+def http_error_message(e) -> str:
+    """'failed with error STATUS: MESSAGE' for an HTTPError raised by a command."""
+    try:
+        errmsg = e.response.json().get("msg");
+    except JSONDecodeError:
+        if e.response.status_code == 401:
+            errmsg = "Please log in or sign up"
+        else:
+            errmsg = "(no detail message supplied)"
+    return "failed with error {e.response.status_code}: {errmsg}".format(**locals())
+
+
+def run(argv=None):
+    """Parses argv (default: sys.argv[1:]) and runs the command, exiting with its status the
+    way the CLI always has (SystemExit). Called once per command line by main() and serve."""
+    global ARGS
+    ARGS = args = parser.parse_args(argv)
+    set_deadline(args, args.deadline)
+    args.raw_stream = args.raw
+
+    if args.api_key is api_key_guard:
+        args.api_key = default_api_key()
+
     try:
         res = args.func(args)
+        if args.raw and isinstance(res, types.GeneratorType):
+            print_json_stream(res)
+            sys.exit(0)
         if args.raw:
             # There's two types of responses right now
             try:
@@ -5694,14 +9053,10 @@ def main():
             sys.exit(0)
         sys.exit(res)
     except requests.exceptions.HTTPError as e:
-        try:
-            errmsg = e.response.json().get("msg");
-        except JSONDecodeError:
-            if e.response.status_code == 401:
-                errmsg = "Please log in or sign up"
-            else:
-                errmsg = "(no detail message supplied)"
-        print("failed with error {e.response.status_code}: {errmsg}".format(**locals()));
+        print(http_error_message(e))
+    except requests.exceptions.Timeout as e:
+        print("failed: {}".format(e))
+        sys.exit(1)
     except ValueError as e:
       print(e)
 
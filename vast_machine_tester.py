@@ -390,6 +390,10 @@ def main():
     """
     setup_logging()
     args = parse_arguments()
+
+    # The self-tests run as separate vast.py processes; have them share one client-side
+    # rate limiter (state kept in the vastai cache dir) so together they stay under the API limit.
+    os.environ.setdefault("VAST_RATE_LIMIT_SHARED", "1")
     
     offers = run_vast_search(verified=args.verified, host_id=args.host_id)
     if not offers:
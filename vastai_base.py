@@ -9,6 +9,18 @@ class VastAIBase(ABC):
         """Attach an SSH key to an instance."""
         pass
 
+    def batch(self, file: str, parallel: int = 1, stop_on_error: bool = False) -> str:
+        """Run many vastai commands in one process, printing one JSON result per line."""
+        pass
+
+    def cache_clear(self, namespace: Optional[str] = None) -> str:
+        """Delete cached API responses."""
+        pass
+
+    def cache_stats(self) -> str:
+        """Show size, freshness and hit rate of the local response cache."""
+        pass
+
     def cancel_copy(self, dst: str) -> str:
         """Cancel a file copy operation."""
         pass
@@ -21,6 +33,10 @@ class VastAIBase(ABC):
         """Change the bid price for a machine."""
         pass
 
+    def change_bids(self, ids: List[int], price: Optional[float] = None, parallel: int = 8) -> str:
+        """Change the bid price for multiple instances."""
+        pass
+
     def copy(self, src: str, dst: str, identity: Optional[str] = None) -> str:
         """Copy files between instances."""
         pass
@@ -105,6 +121,38 @@ class VastAIBase(ABC):
         """Create a new instance from a contract offer ID."""
         pass
 
+    def create_instances(
+        self,
+        count: int,
+        query: str = "",
+        no_default: bool = False,
+        order: str = "score-",
+        limit: Optional[int] = None,
+        parallel: int = 8,
+        bid_price: Optional[float] = None,
+        disk: Optional[float] = 10,
+        image: Optional[str] = None,
+        login: Optional[str] = None,
+        label: Optional[str] = None,
+        onstart: Optional[str] = None,
+        onstart_cmd: Optional[str] = None,
+        entrypoint: Optional[str] = None,
+        ssh: bool = False,
+        jupyter: bool = False,
+        direct: bool = False,
+        jupyter_dir: Optional[str] = None,
+        jupyter_lab: bool = False,
+        lang_utf8: bool = False,
+        python_utf8: bool = False,
+        extra: Optional[str] = None,
+        env: Optional[str] = None,
+        args: Optional[List[str]] = None,
+        force: bool = False,
+        template_hash: Optional[str] = None,
+    ) -> str:
+        """Create count instances from the best offers matching a search query."""
+        pass
+
     def create_subaccount(
         self,
         email: Optional[str] = None,
@@ -158,7 +206,7 @@ class VastAIBase(ABC):
     def destroy_instance(self, id: int) -> str:
         pass
 
-    def destroy_instances(self, ids: List[int]) -> str:
+    def destroy_instances(self, ids: List[int], batch_size: int = 1, parallel: int = 8) -> str:
         pass
 
     def destroy_team(self) -> str:
@@ -181,6 +229,10 @@ class VastAIBase(ABC):
         """Label an instance."""
         pass
 
+    def label_instances(self, ids: List[int], label: str, parallel: int = 8) -> str:
+        """Label multiple instances."""
+        pass
+
     def launch_instance(
         gpu_name: str,
         num_gpus: str,
@@ -207,6 +259,7 @@ class VastAIBase(ABC):
         force: bool = False,
         cancel_unavail: bool = False,
         template_hash: str = None,
+        race: int = None,
         explain: bool = False,
         raw: bool = False,
     ) -> str:
@@ -222,6 +275,19 @@ class VastAIBase(ABC):
         """Retrieve logs for an instance."""
         pass
 
+    def offers_snapshot(
+        self,
+        type: str = "on-demand",
+        storage: float = 5.0,
+        limit: int = 100000,
+        output: Optional[str] = None,
+        info: bool = False,
+        full: bool = False,
+        compact: bool = False,
+    ) -> str:
+        """Download the offer market into a local columnar snapshot."""
+        pass
+
     def prepay_instance(self, id: int, amount: float) -> str:
         """Prepay for an instance."""
         pass
@@ -230,10 +296,18 @@ class VastAIBase(ABC):
         """Reboot an instance."""
         pass
 
+    def reboot_instances(self, ids: List[int], parallel: int = 8) -> str:
+        """Reboot multiple instances."""
+        pass
+
     def recycle_instance(self, id: int) -> str:
         """Recycle an instance."""
         pass
 
+    def recycle_instances(self, ids: List[int], parallel: int = 8) -> str:
+        """Recycle multiple instances."""
+        pass
+
     def remove_team_member(self, id: int) -> str:
         """Remove a member from the team."""
         pass
@@ -254,7 +328,7 @@ class VastAIBase(ABC):
         """Start an instance."""
         pass
 
-    def start_instances(self, ids: List[int]) -> str:
+    def start_instances(self, ids: List[int], parallel: int = 8) -> str:
         """Start multiple instances."""
         pass
 
@@ -262,7 +336,7 @@ class VastAIBase(ABC):
         """Stop an instance."""
         pass
 
-    def stop_instances(self, ids: List[int]) -> str:
+    def stop_instances(self, ids: List[int], parallel: int = 8) -> str:
         """Stop multiple instances."""
         pass
 
@@ -292,6 +366,10 @@ class VastAIBase(ABC):
         """Search for templates based on a query."""
         pass
 
+    def serve(self, socket: Optional[str] = None) -> str:
+        """Run a daemon that executes vastai commands for other vastai invocations."""
+        pass
+
     def set_api_key(self, new_api_key: str) -> str:
         """Set a new API key."""
         pass
@@ -429,6 +507,20 @@ class VastAIBase(ABC):
         """Update details of a team role."""
         pass
 
+    def update_instances(
+        self,
+        ids: List[int],
+        template_id: Optional[int] = None,
+        template_hash_id: Optional[str] = None,
+        image: Optional[str] = None,
+        args: Optional[str] = None,
+        env: Optional[dict] = None,
+        onstart: Optional[str] = None,
+        parallel: int = 8,
+    ) -> str:
+        """Update multiple instances from a new/updated template."""
+        pass
+
     def update_ssh_key(self, id: int, ssh_key: str) -> str:
         """Update an SSH key."""
         pass
@@ -472,6 +564,8 @@ class VastAIBase(ABC):
         discount_rate: Optional[float] = None,
         min_chunk: Optional[int] = None,
         end_date: Optional[str] = None,
+        parallel: int = 8,
+        max_retries: int = 3,
     ) -> str:
         """List details of multiple machines with optional pricing and configuration parameters."""
         pass
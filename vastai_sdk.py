@@ -1,15 +1,19 @@
 import importlib
+import asyncio
+import functools
 import types
 import argparse
 from typing import Optional, Any
 import io
 import contextlib
-import requests
 import inspect
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 from .vastai_base import VastAIBase
-from .vast import parser
+from .vast import parser, http_session, http_timeout, configure_http_pool, async_http_request, close_async_http
 from textwrap import dedent
 
 
@@ -24,6 +28,9 @@ class VastAI(VastAIBase):
         raw=True,
         explain=False,
         quiet=False,
+        pool_size=None,
+        retry_policy=None,
+        deadline=None,
     ):
         if not api_key:
             raise ValueError("API key is required")
@@ -33,6 +40,10 @@ class VastAI(VastAIBase):
         self.raw = raw
         self.explain = explain
         self.quiet = quiet
+        self.retry_policy = retry_policy
+        self.deadline = deadline
+        if pool_size is not None:
+            configure_http_pool(pool_size=pool_size)
         self.imported_methods = {}
         self.import_cli_functions()
 
@@ -128,6 +139,8 @@ class VastAI(VastAIBase):
         """Create a wrapper to check required arguments, convert keyword arguments, and capture output."""
 
         def wrapper(self, **kwargs):
+            deadline = kwargs.pop("deadline", self.deadline)
+            kwargs.setdefault("deadline_at", time.time() + deadline if deadline else None)
             arg_details = self.imported_methods.get(method_name, {})
             for arg, details in arg_details.items():
                 if details["required"] and arg not in kwargs:
@@ -148,6 +161,8 @@ class VastAI(VastAIBase):
             kwargs.setdefault("raw", self.raw)
             kwargs.setdefault("explain", self.explain)
             kwargs.setdefault("quiet", self.quiet)
+            if self.retry_policy is not None:
+                kwargs.setdefault("retry_policy", self.retry_policy)
 
             args = argparse.Namespace(**kwargs)
 
@@ -173,8 +188,8 @@ class VastAI(VastAIBase):
                hasDoc = True
                wrapper.__doc__ += f"{doc}\n\n"
 
-        sig = getattr(func, "signature")
-        sig_help = getattr(func, "signature_help")
+        sig = getattr(func, "mysignature", None)
+        sig_help = getattr(func, "mysignature_help", None)
         if sig:
             try:
                 wrapper.__signature__, docappend = self.generate_signature_from_argparse(sig)
@@ -204,7 +219,8 @@ class VastAI(VastAIBase):
         """Generic API request handler."""
         url = f"{self.server_url}{endpoint}"
         headers = {"Authorization": f"Bearer {self.api_key}"}
-        response = requests.get(url, headers=headers, params=params)
+        args = argparse.Namespace(deadline_at=time.time() + self.deadline if self.deadline else None)
+        response = http_session().get(url, headers=headers, params=params, timeout=http_timeout(args))
         response.raise_for_status()  # Will raise an exception for HTTP errors
         return response.json()
 
@@ -216,3 +232,100 @@ class VastAI(VastAIBase):
         for name in gpu_names["gpu_names"]:
             output.add(name.replace(" ", "_").replace("-", "_"))
         return output
+
+
+class AsyncVastAI(VastAI):
+    """asyncio counterpart of VastAI. Every CLI command is bound as a coroutine method with the
+    same argparse-derived signature, e.g. ``await client.show_instances()``.
+
+    At most max_concurrency calls run at once (an asyncio.Semaphore per event loop); the rest
+    wait their turn on the loop. The CLI commands are synchronous code, so the command methods
+    are thread-backed: each admitted call occupies a worker thread of a pool of max_concurrency
+    threads for as long as it runs, sharing the process-wide keep-alive connection pool. They
+    free the event loop, not threads.
+
+    request() (and get_gpu_names) do run natively on the event loop through async_http_request,
+    without a thread per call; use it for fan-outs of hundreds of API calls.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        server_url="https://console.vast.ai",
+        retry=3,
+        raw=True,
+        explain=False,
+        quiet=False,
+        pool_size=None,
+        retry_policy=None,
+        deadline=None,
+        max_concurrency=64,
+    ):
+        self.max_concurrency = max_concurrency
+        self._semaphores = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="AsyncVastAI")
+        super().__init__(api_key, server_url, retry, raw, explain, quiet, pool_size, retry_policy, deadline)
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def create_wrapper(self, func, method_name):
+        """Wrap the synchronous VastAI wrapper in a coroutine bounded by the client's semaphore."""
+        sync_wrapper = super().create_wrapper(func, method_name)
+
+        async def wrapper(self, **kwargs):
+            # start the deadline clock now, so time spent queued for the semaphore counts against it
+            deadline = kwargs.pop("deadline", self.deadline)
+            kwargs.setdefault("deadline_at", time.time() + deadline if deadline else None)
+            async with self._semaphore():
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(sync_wrapper, self, **kwargs))
+
+        wrapper.__name__ = sync_wrapper.__name__
+        wrapper.__doc__ = sync_wrapper.__doc__
+        if hasattr(sync_wrapper, "__signature__"):
+            wrapper.__signature__ = sync_wrapper.__signature__
+        return wrapper
+
+    async def request(self, method, endpoint, params=None, json=None, idempotent=None):
+        """Makes one API call (e.g. ``await client.request("GET", "/api/v0/instances/")``) on the
+        native async transport and returns the decoded JSON body. Retries, rate limits and the
+        client's deadline apply as for the commands; pass idempotent=False for calls that must
+        not be replayed, such as creating an instance."""
+        url = f"{self.server_url}{endpoint}"
+        if params:
+            url += "?" + urlencode(params)
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        args = argparse.Namespace(retry=self.retry, retry_policy=self.retry_policy,
+                                  deadline_at=time.time() + self.deadline if self.deadline else None)
+        async with self._semaphore():
+            response = await async_http_request(method, args, url, headers=headers, json=json, idempotent=idempotent)
+        response.raise_for_status()  # Will raise an exception for HTTP errors
+        return response.json()
+
+    async def _api_request(self, endpoint, params=None):
+        """Generic API request handler."""
+        return await self.request("GET", endpoint, params=params)
+
+    async def get_gpu_names(self):
+        """Returns a set of GPU names available on Vast.ai."""
+        endpoint = "/api/v0/gpu_names/unique/"
+        gpu_names = await self._api_request(endpoint)
+        output = set()
+        for name in gpu_names["gpu_names"]:
+            output.add(name.replace(" ", "_").replace("-", "_"))
+        return output
+
+    async def aclose(self):
+        """Release the worker threads and this loop's async HTTP session."""
+        await close_async_http()
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()